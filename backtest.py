@@ -0,0 +1,217 @@
+"""Calibration, scoring and ROI backtests over stored predictions.
+
+Items are streamed in batches from NDJSON update files or from the database (with a projection
+of only the fields used here). Each batch is reduced with NumPy into sums per (model, date) and
+per (model, calibration bin), so memory does not grow with the number of items and the metrics
+for any date range are ratios of those sums.
+
+Items whose outcome is unknown (did_hit_hr 2) are skipped. An item is counted once per time it
+appears, so pass update files whose date ranges do not overlap.
+"""
+import sys
+import glob
+import numpy as np
+import pandas as pd
+
+sys.path.append("utils")
+from base_class import BaseClass
+from profiler import profiler
+from update_io import iter_items, iter_batches
+from odds import parse_american_odds, get_implied_probabilities, get_decimal_odds, PRICE_SUFFIX
+
+DEFAULT_BATCH_SIZE = 5000
+BACKTEST_PROJECTION = {"_id": 0, "date": 1, "model": 1, "home_run_odds": 1, "did_hit_hr": 1, "odds_data.data": 1}
+# Probabilities are clipped to [LOG_LOSS_EPSILON, 1 - LOG_LOSS_EPSILON] for the log loss
+LOG_LOSS_EPSILON = 1e-15
+# Bins of width CALIBRATION_BIN_WIDTH from 0; the last bin also holds everything above it
+CALIBRATION_BIN_WIDTH = 0.01
+N_CALIBRATION_BINS = 30
+# Sums kept per (model, date)
+SUM_NAMES = ["n", "sum_odds", "sum_hr", "brier", "log_loss", "n_with_odds", "sum_implied", "n_bets", "n_bets_won", "profit"]
+
+def get_backtest_query(start_date=None, end_date=None, models=None):
+    """Database query for the resolved items of models from start_date to end_date (YYYY-MM-DD)."""
+    query = {"did_hit_hr": {"$in": [0, 1]}}
+    date_query = {}
+    if start_date is not None:
+        date_query["$gte"] = start_date
+    if end_date is not None:
+        date_query["$lte"] = end_date
+    if len(date_query) > 0:
+        query["date"] = date_query
+    if models is not None:
+        query["model"] = {"$in": list(models)}
+    return query
+
+def iter_file_batches(paths, batch_size=DEFAULT_BATCH_SIZE):
+    """Batches of items from NDJSON update files; paths can hold glob patterns."""
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)):
+            yield from iter_batches(iter_items(path), batch_size)
+
+def iter_collection_batches(collection, query, batch_size=DEFAULT_BATCH_SIZE):
+    """Batches of the items matching query, fetched batch_size documents per round trip."""
+    cursor = collection.find(query, BACKTEST_PROJECTION, batch_size=batch_size)
+    yield from iter_batches(cursor, batch_size)
+
+def get_best_over_prices(items, sportsbooks=None):
+    """Highest over price per item across sportsbooks (all of them by default), NaN without one."""
+    rows, odds = [], []
+    for i, item in enumerate(items):
+        books = (item.get("odds_data") or {}).get("data") or {}
+        for book, book_odds in books.items():
+            if sportsbooks is not None and book not in sportsbooks:
+                continue
+            # The integer price when the odds handler stored one, else the string ("over", or "Over" on older items)
+            price = book_odds.get("over" + PRICE_SUFFIX, book_odds.get("over", book_odds.get("Over")))
+            if price is not None:
+                rows.append(i)
+                odds.append(price)
+    best = np.full(len(items), np.nan)
+    if len(odds) > 0:
+        prices = parse_american_odds(odds)
+        valid = ~np.isnan(prices)
+        rows = np.asarray(rows)[valid]
+        best_valid = np.full(len(items), -np.inf)
+        np.maximum.at(best_valid, rows, prices[valid])
+        has_price = np.isfinite(best_valid)
+        best[has_price] = best_valid[has_price]
+    return best
+
+class Backtest(BaseClass):
+    """Accumulates Brier score, log loss, calibration and flat-stake ROI per model and date.
+
+    A bet is one unit on the over at the best available price whenever the model's probability
+    exceeds the price's implied probability by more than min_edge.
+    """
+    def __init__(self, start_date=None, end_date=None, models=None, sportsbooks=None, min_edge=0.0):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.models = None if models is None else set(models)
+        self.sportsbooks = sportsbooks
+        self.min_edge = min_edge
+        # (model, date) -> row of self.sums, and model -> row of the calibration sums
+        self.groups = {}
+        self.model_rows = {}
+        self.sums = np.zeros((0, len(SUM_NAMES)))
+        self.calibration = np.zeros((0, 3, N_CALIBRATION_BINS))
+        self.n_items = 0
+        self.n_skipped = 0
+
+    def get_rows(self, keys, index, add_row):
+        """Rows for each key, adding missing keys to index; add_row(n) grows the sums by n rows."""
+        codes, uniques = pd.factorize(keys)
+        new_keys = [x for x in uniques if x not in index]
+        for key in new_keys:
+            index[key] = len(index)
+        if len(new_keys) > 0:
+            add_row(len(new_keys))
+        return np.array([index[x] for x in uniques], dtype=np.int64)[codes]
+
+    def add_rows(self, n):
+        self.sums = np.concatenate([self.sums, np.zeros((n, len(SUM_NAMES)))])
+
+    def add_model_rows(self, n):
+        self.calibration = np.concatenate([self.calibration, np.zeros((n, 3, N_CALIBRATION_BINS))])
+
+    @profiler.timed("backtest.add_batch")
+    def add_batch(self, items):
+        self.n_items += len(items)
+        models = np.array([x.get("model") for x in items], dtype=object)
+        dates = np.array([x.get("date") for x in items], dtype=object)
+        odds = np.array([x.get("home_run_odds") for x in items], dtype=np.float64)
+        did_hit_hr = np.array([x.get("did_hit_hr", 2) for x in items], dtype=np.float64)
+
+        keep = ((did_hit_hr == 0) | (did_hit_hr == 1)) & ~np.isnan(odds)
+        if self.start_date is not None:
+            keep &= dates >= self.start_date
+        if self.end_date is not None:
+            keep &= dates <= self.end_date
+        if self.models is not None:
+            keep &= np.array([x in self.models for x in models], dtype=bool)
+        self.n_skipped += int((~keep).sum())
+        if not keep.any():
+            return
+        items = [x for x, k in zip(items, keep) if k]
+        models, dates, p, y = models[keep], dates[keep], odds[keep], did_hit_hr[keep]
+
+        clipped = np.clip(p, LOG_LOSS_EPSILON, 1 - LOG_LOSS_EPSILON)
+        prices = get_best_over_prices(items, self.sportsbooks)
+        implied = get_implied_probabilities(prices)
+        decimal = get_decimal_odds(prices)
+        has_odds = ~np.isnan(implied)
+        bet = has_odds & (p - np.where(has_odds, implied, 1.0) > self.min_edge)
+        values = np.stack([
+            np.ones_like(p),
+            p,
+            y,
+            (p - y) ** 2,
+            -(y * np.log(clipped) + (1 - y) * np.log(1 - clipped)),
+            has_odds,
+            np.where(has_odds, implied, 0.0),
+            bet,
+            bet & (y == 1),
+            np.where(bet, np.where(y == 1, decimal - 1, -1.0), 0.0),
+        ], axis=1)
+
+        rows = self.get_rows(pd.MultiIndex.from_arrays([models, dates]), self.groups, self.add_rows)
+        np.add.at(self.sums, rows, values)
+
+        model_rows = self.get_rows(pd.Series(models), self.model_rows, self.add_model_rows)
+        bins = np.minimum((p / CALIBRATION_BIN_WIDTH).astype(np.int64), N_CALIBRATION_BINS - 1)
+        for k, weights in enumerate([np.ones_like(p), p, y]):
+            np.add.at(self.calibration[:, k, :], (model_rows, bins), weights)
+
+    def add_batches(self, batches):
+        for batch in batches:
+            self.add_batch(batch)
+        self.log(f"Backtested {self.n_items - self.n_skipped} items ({self.n_skipped} unresolved or filtered out)")
+
+    def get_daily_sums(self):
+        """DataFrame of the raw sums per (model, date)."""
+        keys = list(self.groups)
+        df = pd.DataFrame(self.sums, columns=SUM_NAMES)
+        df.insert(0, "model", [x[0] for x in keys])
+        df.insert(1, "date", [x[1] for x in keys])
+        return df.sort_values(["model", "date"]).reset_index(drop=True)
+
+    def get_calibration(self):
+        """Per (model, bin): items, mean predicted probability and observed home run rate."""
+        frames = []
+        for model, row in self.model_rows.items():
+            count, sum_p, sum_y = self.calibration[row]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                frames.append(pd.DataFrame({
+                    "model": model,
+                    "bin_start": np.arange(N_CALIBRATION_BINS) * CALIBRATION_BIN_WIDTH,
+                    "n": count.astype(np.int64),
+                    "mean_odds": sum_p / count,
+                    "hr_rate": sum_y / count,
+                })[count > 0])
+        if len(frames) == 0:
+            return pd.DataFrame(columns=["model", "bin_start", "n", "mean_odds", "hr_rate"])
+        return pd.concat(frames).sort_values(["model", "bin_start"]).reset_index(drop=True)
+
+    def get_metrics(self, by_date=False):
+        """Metrics per model, or per (model, date) with by_date."""
+        sums = self.get_daily_sums()
+        if not by_date:
+            sums = sums.drop(columns="date").groupby("model", as_index=False).sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics = sums[["model"] + (["date"] if by_date else [])].copy()
+            metrics["n"] = sums["n"].astype(np.int64)
+            metrics["mean_odds"] = sums["sum_odds"] / sums["n"]
+            metrics["hr_rate"] = sums["sum_hr"] / sums["n"]
+            metrics["brier"] = sums["brier"] / sums["n"]
+            metrics["log_loss"] = sums["log_loss"] / sums["n"]
+            metrics["n_with_odds"] = sums["n_with_odds"].astype(np.int64)
+            metrics["mean_implied"] = sums["sum_implied"] / sums["n_with_odds"]
+            metrics["n_bets"] = sums["n_bets"].astype(np.int64)
+            metrics["n_bets_won"] = sums["n_bets_won"].astype(np.int64)
+            metrics["profit"] = sums["profit"]
+            metrics["roi"] = sums["profit"] / sums["n_bets"]
+        if not by_date:
+            calibration = self.get_calibration()
+            error = (calibration["n"] * (calibration["mean_odds"] - calibration["hr_rate"]).abs()).groupby(calibration["model"]).sum()
+            metrics["calibration_error"] = (metrics["model"].map(error) / metrics["n"]).to_numpy()
+        return metrics
@@ -0,0 +1,121 @@
+"""Throughput of backtest.Backtest over synthetic resolved items with sportsbook odds.
+
+Writes --seasons seasons of items (about 2430 games * 18 hitters per season and model) to an
+NDJSON update file, then times the backtest reading that file and, with --db, reading the same
+items back through the cursor path. mongomock applies projections in Python and is far slower
+than a real server, so pass --mongo_url for representative database timings.
+
+python benchmarks/backtest_benchmark.py --seasons 3
+python benchmarks/backtest_benchmark.py --seasons 3 --db --mongo_url mongodb://localhost:27017 --output backtest_bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "utils"))
+
+from benchmark import get_git_commit, get_peak_rss_mb, quiet
+
+MODELS = ["logistic_regression", "logistic_regression_with_pitcher_data"]
+SPORTSBOOKS = ["draftkings", "fanduel", "pointsbetus", "betrivers"]
+ITEMS_PER_DAY = 15 * 18
+DAYS_PER_SEASON = 180
+
+def make_items(n_seasons, seed=0):
+    """Yields resolved items for every model, with over/under odds from a random subset of books."""
+    rng = random.Random(seed)
+    for season in range(2024 - n_seasons + 1, 2025):
+        start = datetime.date(season, 3, 28)
+        for day in range(DAYS_PER_SEASON):
+            date = (start + datetime.timedelta(days=day)).strftime("%Y-%m-%d")
+            for k in range(ITEMS_PER_DAY):
+                true_prob = rng.uniform(0.03, 0.25)
+                did_hit_hr = int(rng.random() < true_prob)
+                over = int(round(100 / true_prob - 100 - rng.uniform(0, 100), -1))
+                odds = {}
+                for book in SPORTSBOOKS:
+                    if rng.random() < 0.7:
+                        price = over + rng.randrange(-3, 4) * 10
+                        odds[book] = {"over": f"+{price}", "over_price": price, "under": "-500", "under_price": -500}
+                for model in MODELS:
+                    item = {
+                        "player_name": f"Player {k}",
+                        "date": date,
+                        "model": model,
+                        "home_run_odds": min(max(true_prob + rng.gauss(0, 0.03), 0.001), 0.999),
+                        "did_hit_hr": did_hit_hr,
+                    }
+                    if len(odds) > 0:
+                        item["odds_data"] = {"data": odds, "update_time": "", "game_time": ""}
+                    yield item
+
+def time_backtest(batches):
+    from backtest import Backtest
+
+    backtest = Backtest(sportsbooks=SPORTSBOOKS)
+    start = time.perf_counter()
+    with quiet():
+        backtest.add_batches(batches)
+        metrics = backtest.get_metrics()
+        backtest.get_metrics(by_date=True)
+        backtest.get_calibration()
+    seconds = time.perf_counter() - start
+    return {"seconds": round(seconds, 4), "items_per_sec": round(backtest.n_items / seconds, 1),
+            "items": backtest.n_items}, metrics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest benchmark")
+    parser.add_argument("--seasons", type=int, default=3, help="Seasons of items per model")
+    parser.add_argument("--db", action="store_true", help="Also time reading the items from the database")
+    parser.add_argument("--mongo_url", help="Use this mongod for --db instead of mongomock (uses a scratch database)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    from update_io import write_items
+    from backtest import iter_file_batches, iter_collection_batches, get_backtest_query
+
+    output = os.path.abspath(args.output) if args.output is not None else None
+    stages = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # BaseClass.log appends to ./logs, so run from a scratch directory
+        os.makedirs(os.path.join(work_dir, "logs"))
+        os.chdir(work_dir)
+        update_file = os.path.join(work_dir, "updates.ndjson")
+        n_items = write_items(make_items(args.seasons, seed=args.seed), update_file)
+
+        stages["ndjson"], metrics = time_backtest(iter_file_batches([update_file]))
+        if args.db:
+            if args.mongo_url is not None:
+                from pymongo import MongoClient
+                client = MongoClient(args.mongo_url)
+            else:
+                import mongomock
+                client = mongomock.MongoClient()
+            collection = client["home_run_data_benchmark"]["data"]
+            try:
+                collection.drop()
+                collection.insert_many(list(make_items(args.seasons, seed=args.seed)))
+                stages["db"], _ = time_backtest(iter_collection_batches(collection, get_backtest_query()))
+            finally:
+                collection.drop()
+
+    result = {
+        "commit": get_git_commit(),
+        "config": {"seasons": args.seasons, "items": n_items, "seed": args.seed,
+                   "backend": None if not args.db else "mongod" if args.mongo_url is not None else "mongomock"},
+        "stages": stages,
+        "metrics": json.loads(metrics.to_json(orient="records")),
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+    }
+    print(json.dumps(result, indent=2))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
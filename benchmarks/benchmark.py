@@ -0,0 +1,294 @@
+"""End-to-end benchmark over a synthetic season of game files.
+
+Generates games in the Game.get_game_data JSON schema, stubs the statsapi calls made by
+Hitter/Pitcher, and times ingest (Runner.build_player_map_for_all_games), feature extraction,
+scoring and the Mongo push (against mongomock). Results are printed as JSON so runs can be
+compared across commits.
+
+python benchmarks/benchmark.py --games 500
+python benchmarks/benchmark.py --games 2430 --teams 30 --roster 13 --seasons 2023 2024 --output bench_output.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "utils"))
+
+import numpy as np
+import pandas as pd
+import statsapi
+
+BATTING_COLUMNS = ["Batting", "At Bats", "Runs Scored", "Hits", "Runs Batted In", "Bases on Balls", "Strikeouts",
+                   "Plate Appearances", "Batting Average", "On-Base%", "Slugging %", "On-Base + Slugging %",
+                   "Pitches", "Strikes", "Putouts", "Assists", "details", "Position"]
+PITCHING_COLUMNS = ["Pitching", "Innings Pitched", "Hits", "Runs Scored", "Earned Runs", "Bases on Balls", "Strikeouts",
+                    "Home Runs", "Earned Run Average", "Batters Faced", "Pit", "Str", "Position"]
+POSITIONS = ["C", "1B", "2B", "3B", "SS", "LF", "CF", "RF", "DH"]
+STARTERS_PER_TEAM = 5
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+class SyntheticSeason:
+    """Writes synthetic game files that Game.load and Runner can read."""
+    def __init__(self, n_games, n_teams=30, roster_size=13, seasons=(2024,), seed=0):
+        self.n_games = n_games
+        self.teams = [f"T{i:02d}" for i in range(n_teams)]
+        self.roster_size = roster_size
+        self.seasons = list(seasons)
+        self.rng = random.Random(seed)
+
+    def hitter_name(self, team, i):
+        return f"{team} Hitter {i}"
+
+    def pitcher_name(self, team, i):
+        return f"{team} Pitcher {i}"
+
+    def get_venue(self, team):
+        return f"{team} Park"
+
+    def batting_df(self, team):
+        rng = self.rng
+        rows = []
+        lineup = rng.sample(range(self.roster_size), min(9, self.roster_size))
+        for slot, i in enumerate(lineup):
+            at_bats = rng.randint(2, 5)
+            hits = sum(rng.random() < 0.25 for _ in range(at_bats))
+            home_runs = sum(rng.random() < 0.035 for _ in range(at_bats))
+            details = []
+            if home_runs > 1:
+                details.append(f"{home_runs}·HR")
+            elif home_runs == 1:
+                details.append("HR")
+            if hits > home_runs and rng.random() < 0.3:
+                details.append("2B")
+            rows.append([self.hitter_name(team, i), str(at_bats), str(rng.randint(0, 2)), str(hits), str(rng.randint(0, 3)),
+                         str(rng.randint(0, 1)), str(rng.randint(0, 2)), str(at_bats + 1), f"{rng.uniform(.180, .320):.3f}",
+                         f"{rng.uniform(.250, .400):.3f}", f"{rng.uniform(.300, .550):.3f}", f"{rng.uniform(.550, .950):.3f}",
+                         str(rng.randint(10, 25)), str(rng.randint(5, 15)), str(rng.randint(0, 5)), str(rng.randint(0, 3)),
+                         ",".join(details), POSITIONS[slot]])
+        rows.append([self.pitcher_name(team, 0), "0", "0", "0", "0", "0", "0", "0", "", "", "", "", "0", "0", "0", "0", "", "P"])
+        rows.append(["Team", "34", "4", "8", "4", "3", "8", "38", ".235", ".300", ".400", ".700", "150", "95", "27", "10", "", ""])
+        return pd.DataFrame(rows, columns=BATTING_COLUMNS)
+
+    def pitching_df(self, team, starter):
+        rng = self.rng
+        rows = []
+        for name, innings in [(starter, f"{rng.randint(4, 7)}.{rng.randint(0, 2)}"), (self.pitcher_name(team, STARTERS_PER_TEAM), "2.0")]:
+            home_runs = rng.randint(0, 2)
+            rows.append([name, innings, str(rng.randint(2, 8)), str(rng.randint(0, 4)), str(rng.randint(0, 4)), str(rng.randint(0, 3)),
+                         str(rng.randint(2, 9)), str(home_runs), f"{rng.uniform(2, 5):.2f}", str(rng.randint(18, 28)),
+                         str(rng.randint(70, 105)), str(rng.randint(45, 70)), "P"])
+        rows.append(["Team Totals", "9", "8", "4", "4", "3", "9", "1", "4.00", "36", "140", "90", "P"])
+        return pd.DataFrame(rows, columns=PITCHING_COLUMNS)
+
+    def generate(self, data_dir):
+        from game import Game
+
+        n_per_day = len(self.teams) // 2
+        n_days_per_season = int(np.ceil(self.n_games / (len(self.seasons) * n_per_day)))
+        n_written = 0
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for season in self.seasons:
+                for day, date in enumerate(pd.date_range(f"{season}-04-01", periods=n_days_per_season)):
+                    teams = list(self.teams)
+                    self.rng.shuffle(teams)
+                    for k in range(n_per_day):
+                        if n_written >= self.n_games:
+                            return n_written
+                        home, away = teams[2 * k], teams[2 * k + 1]
+                        game = Game(f"{home}{date.strftime('%Y%m%d')}0",
+                                    "7:05 p.m.",
+                                    date,
+                                    self.get_venue(home),
+                                    home,
+                                    away,
+                                    self.batting_df(home),
+                                    self.batting_df(away),
+                                    self.pitching_df(home, self.pitcher_name(home, day % STARTERS_PER_TEAM)),
+                                    self.pitching_df(away, self.pitcher_name(away, day % STARTERS_PER_TEAM)))
+                        game.save(data_dir=data_dir)
+                        n_written += 1
+        return n_written
+
+    def get_slate(self):
+        """Today's slate as (player_name, team_name, opposing_pitcher_name, venue_name) for every team."""
+        slate = []
+        for k in range(0, len(self.teams) - 1, 2):
+            home, away = self.teams[k], self.teams[k + 1]
+            for batting_team, pitching_team in [(home, away), (away, home)]:
+                for i in range(min(9, self.roster_size)):
+                    slate.append((self.hitter_name(batting_team, i), batting_team, self.pitcher_name(pitching_team, 0), self.get_venue(home)))
+        return slate
+
+HITTING_SEASON_STATS = {"avg": ".250", "obp": ".320", "slg": ".420", "homeRuns": 20, "rbi": 70, "atBats": 500, "hits": 125,
+                        "runs": 70, "gamesPlayed": 140}
+PITCHING_SEASON_STATS = {"era": "3.75", "inningsPitched": "160.1", "hits": 150, "runs": 70, "earnedRuns": 66, "baseOnBalls": 50,
+                         "strikeOuts": 170, "homeRuns": 20, "numberOfPitches": 2700, "strikes": 1750, "battersFaced": 680,
+                         "gamesPlayed": 30}
+
+def stub_statsapi(seasons):
+    """Replaces the statsapi calls made by Hitter/Pitcher with deterministic local data."""
+    previous_seasons = [str(x) for x in range(min(seasons) - 1, max(seasons) + 1)]
+
+    def lookup_player(name, season=None, **kwargs):
+        return [{"id": zlib.crc32(str(name).encode()) % 1000000, "nameFirstLast": str(name), "currentTeam": {"id": 1}}]
+
+    def player_stat_data(player_id, group="[hitting]", type="season", sportId=1, **kwargs):
+        stats = HITTING_SEASON_STATS if "hitting" in group else PITCHING_SEASON_STATS
+        return {"id": player_id, "stats": [{"season": x, "stats": dict(stats)} for x in previous_seasons]}
+
+    statsapi.lookup_player = lookup_player
+    statsapi.player_stat_data = player_stat_data
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+class Benchmark:
+    def __init__(self, season, data_dir):
+        self.season = season
+        self.data_dir = data_dir
+        self.stages = {}
+
+    def time_stage(self, name, func, n_games=None, n_rows=None):
+        start = time.perf_counter()
+        with quiet():
+            result = func()
+        seconds = time.perf_counter() - start
+        stage = {"seconds": round(seconds, 4), "peak_rss_mb": round(get_peak_rss_mb(), 1)}
+        if n_games is not None:
+            stage["games"] = n_games
+            stage["games_per_sec"] = round(n_games / seconds, 2) if seconds > 0 else None
+        if n_rows is not None:
+            n_rows = n_rows(result) if callable(n_rows) else n_rows
+            stage["rows"] = n_rows
+            stage["rows_per_sec"] = round(n_rows / seconds, 2) if seconds > 0 else None
+        self.stages[name] = stage
+        return result
+
+    def run(self, model_config, n_workers=1):
+        from main import STAT_NAMES, PITCHER_STAT_NAMES
+        from runner import Runner
+        from updates import UpdateBuilder
+        from model_artifact import load_scorer
+
+        n_games = len(os.listdir(self.data_dir))
+        runner = Runner(STAT_NAMES, PITCHER_STAT_NAMES, data_dir=self.data_dir)
+        self.time_stage("ingest", runner.build_player_map_for_all_games, n_games=n_games)
+        self.stages["ingest"]["memory"] = runner.player_map.get_memory_report()
+
+        features = model_config["features"]
+
+        def extract_features():
+            rows = []
+            for game_id in runner.get_games():
+                game = runner.get_game(game_id)
+                for hitter_name in game.get_hitters() or []:
+                    stats = runner.get_stats_for_player_before_game(hitter_name, game_id, game.date,
+                                                                    hitter_games_threshold=0, pitcher_games_threshold=0)
+                    if stats is not None and len(stats) > 0:
+                        rows.append(np.array(stats[features]).astype(float))
+            return np.array(rows)
+        X = self.time_stage("features", extract_features, n_games=n_games, n_rows=len)
+
+        scorer = load_scorer(model_config)
+        self.time_stage("score_rows", lambda: [scorer.predict_proba(x) for x in X], n_rows=len(X))
+        self.time_stage("score_batch", lambda: scorer.predict_proba(X), n_rows=len(X))
+
+        builder = UpdateBuilder(runner)
+        start_date, end_date = runner.get_games()[0][3:11], runner.get_games()[-1][3:11]
+        items = self.time_stage("update_items", lambda: list(builder.get_items_for_date_range(model_config, scorer, start_date, end_date)),
+                                n_games=n_games, n_rows=len)
+        self.time_stage("update_items_workers",
+                        lambda: list(builder.get_items_for_date_range_with_workers([(model_config, scorer)], start_date, end_date, n_workers=n_workers)),
+                        n_games=n_games, n_rows=len)
+        self.stages["update_items_workers"]["workers"] = n_workers
+        slate = self.season.get_slate()
+        slate_items = self.time_stage("slate_items", lambda: list(builder.get_items_for_slate(model_config, scorer, slate)), n_rows=len)
+
+        try:
+            import mongomock
+        except ImportError:
+            self.stages["push"] = {"skipped": "mongomock is not installed"}
+            return self.stages
+        from database import BulkItemWriter
+
+        collection = mongomock.MongoClient()["home_run_data"]["data"]
+        def push():
+            with BulkItemWriter(collection) as writer:
+                writer.add_all(items + slate_items)
+        self.time_stage("push", push, n_rows=len(items) + len(slate_items))
+        self.time_stage("push_unchanged", push, n_rows=len(items) + len(slate_items))
+        return self.stages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic season benchmark")
+    parser.add_argument("--games", type=int, default=500, help="Number of synthetic games")
+    parser.add_argument("--teams", type=int, default=30, help="Number of teams")
+    parser.add_argument("--roster", type=int, default=13, help="Hitters per team")
+    parser.add_argument("--seasons", type=int, nargs="+", default=[2024], help="Seasons to spread the games over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the update_items_workers stage")
+    parser.add_argument("--data_dir", help="Directory for the game files (a temporary directory by default)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    from config.models import models
+
+    model_config = dict(models[-1])
+    for key in ["scaler_path", "model_path"]:
+        model_config[key] = os.path.join(REPO_DIR, model_config[key])
+
+    season = SyntheticSeason(args.games, n_teams=args.teams, roster_size=args.roster, seasons=args.seasons, seed=args.seed)
+    stub_statsapi(args.seasons)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # BaseClass.log appends to ./logs, so run from a scratch directory
+        os.makedirs(os.path.join(work_dir, "logs"))
+        output = os.path.abspath(args.output) if args.output is not None else None
+        data_dir = os.path.abspath(args.data_dir) if args.data_dir is not None else os.path.join(work_dir, "game_data")
+        os.makedirs(data_dir, exist_ok=True)
+        os.chdir(work_dir)
+
+        generate_start = time.perf_counter()
+        n_games = season.generate(data_dir)
+        generate_seconds = time.perf_counter() - generate_start
+
+        b = Benchmark(season, data_dir)
+        b.run(model_config, n_workers=args.workers)
+
+    result = {
+        "commit": get_git_commit(),
+        "python": sys.version.split()[0],
+        "config": {"games": n_games, "teams": args.teams, "roster": args.roster, "seasons": args.seasons, "seed": args.seed},
+        "generate_seconds": round(generate_seconds, 4),
+        "stages": b.stages,
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+    }
+    print(json.dumps(result, indent=2))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
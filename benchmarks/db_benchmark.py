@@ -0,0 +1,137 @@
+"""Per-write cost of the item lookups, without and with the indexes from database.ensure_indexes.
+
+Fills a collection with synthetic items, then times the (player_name, date, model) lookup used
+by add_item, the (player_name, date) lookup used for odds and outcomes, and add_item itself.
+Against a real mongod (--mongo_url) each lookup is also explained, giving keys and documents
+examined per write; mongomock has no explain, so only timings are reported there.
+
+python benchmarks/db_benchmark.py --items 20000
+python benchmarks/db_benchmark.py --mongo_url mongodb://localhost:27017 --items 200000 --output db_bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "utils"))
+
+from benchmark import get_git_commit, quiet
+
+MODELS = ["logistic_regression", "logistic_regression_with_pitcher_data"]
+
+def make_items(n_items, seed=0):
+    """Items for n_items / len(MODELS) (player, date) pairs, one per model, shaped like UpdateBuilder's."""
+    rng = random.Random(seed)
+    n_players = max(1, int((n_items / len(MODELS)) ** 0.5))
+    items = []
+    for k in range(n_items // len(MODELS)):
+        player_name = f"Player {k % n_players}"
+        date = (datetime.date(2020, 1, 1) + datetime.timedelta(days=k // n_players)).strftime("%Y-%m-%d")
+        for model in MODELS:
+            items.append({
+                "player_name": player_name,
+                "opposing_pitcher": f"Pitcher {rng.randrange(150)}",
+                "team_name": "Team",
+                "date": date,
+                "model": model,
+                "home_run_odds": rng.random() * 0.3,
+                "did_hit_hr": rng.randrange(2),
+                "stats": {"Batting Average": 0.25, "Home Runs": 10, "Runs Batted In": 40, "On-Base%": 0.32,
+                          "Slugging %": 0.42, "At Bats": 200, "Games Played": 60},
+                "game_id": f"NYA{date.replace('-', '')}0",
+                "odds_data": {"data": {"draftkings": {"Over": 350, "Under": -500}}, "update_time": "", "game_time": ""},
+            })
+    return items
+
+def explain_counts(collection, query, projection):
+    stats = collection.find(query, projection).explain()["executionStats"]
+    return stats["totalKeysExamined"], stats["totalDocsExamined"]
+
+def run_lookups(collection, items, explain):
+    from database import add_item, ITEM_PROJECTION
+    from sportsbook_odds_data_handler import ODDS_PROJECTION
+
+    lookups = {
+        "find_player_date_model": (lambda x: {"player_name": x["player_name"], "date": x["date"], "model": x["model"]}, ITEM_PROJECTION),
+        "find_player_date": (lambda x: {"player_name": x["player_name"], "date": x["date"]}, ODDS_PROJECTION),
+    }
+    results = {}
+    for name, (get_query, projection) in lookups.items():
+        start = time.perf_counter()
+        for item in items:
+            list(collection.find(get_query(item), projection))
+        seconds = time.perf_counter() - start
+        results[name] = {"ms_per_write": round(1000 * seconds / len(items), 4)}
+        if explain:
+            counts = [explain_counts(collection, get_query(x), projection) for x in items]
+            results[name]["keys_examined_per_write"] = sum(x[0] for x in counts) / len(counts)
+            results[name]["docs_examined_per_write"] = sum(x[1] for x in counts) / len(counts)
+
+    # Unchanged items, so add_item only does its lookup
+    start = time.perf_counter()
+    with quiet():
+        for item in items:
+            add_item(collection, {k: v for k, v in item.items() if k != "_id"})
+    results["add_item_unchanged"] = {"ms_per_write": round(1000 * (time.perf_counter() - start) / len(items), 4)}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DB index benchmark")
+    parser.add_argument("--items", type=int, default=20000, help="Number of items in the collection")
+    parser.add_argument("--writes", type=int, default=200, help="Number of lookups/writes timed")
+    parser.add_argument("--mongo_url", help="Benchmark against this mongod instead of mongomock (uses a scratch database)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    import database
+
+    if args.mongo_url is not None:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_url)
+        backend = "mongod"
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+        backend = "mongomock"
+    db = client["home_run_data_benchmark"]
+    collection = db["data"]
+    explain = backend == "mongod"
+
+    items = make_items(args.items, seed=args.seed)
+    sample = random.Random(args.seed).sample(items, min(args.writes, len(items)))
+    output = os.path.abspath(args.output) if args.output is not None else None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # BaseClass.log appends to ./logs, so run from a scratch directory
+        os.makedirs(os.path.join(work_dir, "logs"))
+        os.chdir(work_dir)
+        try:
+            collection.drop()
+            collection.insert_many([dict(x) for x in items])
+            without_indexes = run_lookups(collection, sample, explain)
+            with quiet():
+                database.ensure_indexes(db)
+            with_indexes = run_lookups(collection, sample, explain)
+            indexes = [x["key"] for x in collection.list_indexes()]
+        finally:
+            collection.drop()
+
+    result = {
+        "commit": get_git_commit(),
+        "backend": backend,
+        "config": {"items": len(items), "writes": len(sample), "seed": args.seed},
+        "indexes": indexes,
+        "without_indexes": without_indexes,
+        "with_indexes": with_indexes,
+    }
+    print(json.dumps(result, indent=2, default=str))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2, default=str)
@@ -0,0 +1,82 @@
+"""Import-time benchmark for the main.py entry point.
+
+Runs `python -X importtime -c "import main"` from the repo root and fails if any of the
+heavy dependencies are imported at module load or if the total import time exceeds the budget.
+
+python benchmarks/import_time.py
+python benchmarks/import_time.py --max_ms 75 --runs 5 --output bench_output.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED_MODULES = ["pandas", "numpy", "tqdm", "statsapi", "pymongo", "bs4", "requests", "sklearn",
+                    "runner", "player", "game", "scraper", "sportsbook_odds_data_handler"]
+DEFAULT_MAX_MS = 75
+
+def parse_importtime(stderr, root="main"):
+    """Returns {module name: cumulative microseconds} for root and everything it imported.
+
+    -X importtime prints children (indented) before their parent, so the subtree of root is
+    the run of indented lines directly above its own unindented line.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((name[1:], int(cumulative)))
+
+    modules = {}
+    for i, (name, cumulative) in enumerate(entries):
+        if name == root:
+            modules[root] = cumulative
+            j = i - 1
+            while j >= 0 and entries[j][0].startswith(" "):
+                modules[entries[j][0].strip()] = entries[j][1]
+                j -= 1
+    return modules
+
+def measure(statement="import main"):
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                         cwd=REPO_DIR, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr)
+    return parse_importtime(res.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="main.py import-time benchmark")
+    parser.add_argument("--max_ms", type=float, default=DEFAULT_MAX_MS, help="Budget for importing main, in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs; the fastest is reported")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    totals = [modules["main"] / 1000 for modules in runs]
+    best = runs[totals.index(min(totals))]
+    slowest = sorted([x for x in best.items() if x[0] != "main"], key=lambda x: -x[1])[:10]
+    loaded_deferred = sorted(set(DEFERRED_MODULES).intersection(best.keys()))
+
+    result = {
+        "statement": "import main",
+        "total_ms": min(totals),
+        "max_ms": args.max_ms,
+        "slowest_modules_us": dict(slowest),
+        "deferred_modules_loaded": loaded_deferred,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    if len(loaded_deferred) > 0:
+        print(f"FAIL: importing main loads {', '.join(loaded_deferred)}")
+        failed = True
+    if min(totals) > args.max_ms:
+        print(f"FAIL: importing main took {min(totals):.1f} ms (budget {args.max_ms} ms)")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -1,3 +1,6 @@
+import os
+import json
+
 
 models = [
     #{
@@ -89,3 +92,9 @@ models = [
                      "Opposing Pitcher Last Season Average Strikeouts"]
     },
 ]
+
+# Entries added by --train
+TRAINED_MODELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trained_models.json")
+if os.path.exists(TRAINED_MODELS_PATH):
+    with open(TRAINED_MODELS_PATH, "r") as f:
+        models += json.load(f)
@@ -0,0 +1,220 @@
+import sys
+from pymongo import UpdateOne, UpdateMany
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+
+sys.path.append("utils")
+from base_class import BaseClass
+from profiler import profiler
+from resources import get_mongo_client
+
+REQUIRED_FIELDS = ["player_name", "date", "model", "home_run_odds", "did_hit_hr", "opposing_pitcher", "team_name"]
+DEFAULT_BATCH_SIZE = 500
+# Items are looked up by (player_name, date, model) when writing model results, and by
+# (player_name, date) when writing odds and outcomes, which uses the prefix of the same index
+ITEM_INDEX_KEYS = [("player_name", 1), ("date", 1), ("model", 1)]
+ITEM_INDEX_NAME = "player_name_date_model"
+# Created instead when duplicate items keep the unique index from being built
+NON_UNIQUE_ITEM_INDEX_NAME = ITEM_INDEX_NAME + "_non_unique"
+# Fields compared to decide whether an item changed
+COMPARED_FIELDS = REQUIRED_FIELDS + ["model_version", "shadow_odds"]
+ITEM_PROJECTION = {x : 1 for x in COMPARED_FIELDS}
+
+log = BaseClass().log
+# Clients whose database already has its indexes, kept (not their ids) so an id is never reused
+indexed_clients = []
+
+def get_database(client=None):
+    """Returns the home_run_data database on client, the shared pooled client by default."""
+    if client is None:
+        client = get_mongo_client()
+    db = client["home_run_data"]
+    if not any(x is client for x in indexed_clients):
+        ensure_indexes(db)
+        indexed_clients.append(client)
+    return db
+
+def find_duplicate_items(collection, limit=10):
+    """Returns up to limit {"_id": {player_name, date, model}, "count": n} groups with more than one item."""
+    pipeline = [
+        {"$group": {"_id": {"player_name": "$player_name", "date": "$date", "model": "$model"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return list(collection.aggregate(pipeline))
+
+def ensure_indexes(db):
+    """Creates the item index if it is missing.
+
+    If duplicate items keep the unique index from being built, they are logged and a
+    non-unique index on the same keys is created so lookups are still indexed. Once it exists,
+    later connections use it without retrying the unique index; drop it after removing the
+    duplicates to build the unique one.
+    """
+    collection = db["data"]
+    index_names = collection.index_information().keys()
+    if ITEM_INDEX_NAME in index_names:
+        return
+    if NON_UNIQUE_ITEM_INDEX_NAME in index_names:
+        log(f"Using {NON_UNIQUE_ITEM_INDEX_NAME}; drop it once duplicate items are removed to build {ITEM_INDEX_NAME}", error=True)
+        return
+    try:
+        collection.create_index(ITEM_INDEX_KEYS, unique=True, name=ITEM_INDEX_NAME)
+    except OperationFailure as e:
+        log(f"Could not create unique index {ITEM_INDEX_NAME}: {e}", error=True)
+        for duplicate in find_duplicate_items(collection):
+            log(f"Duplicate items: {duplicate['_id']} x{duplicate['count']}", error=True)
+        try:
+            collection.create_index(ITEM_INDEX_KEYS, name=NON_UNIQUE_ITEM_INDEX_NAME)
+        except OperationFailure as e:
+            log(f"Could not create index {NON_UNIQUE_ITEM_INDEX_NAME}: {e}", error=True)
+
+def get_item_update(item):
+    """$set of the item's fields. Items scored without shadows also unset the shadow_odds of shadows since removed."""
+    update = {"$set": {k: v for k, v in item.items() if k != "_id"}}
+    if "shadow_odds" not in item:
+        update["$unset"] = {"shadow_odds": ""}
+    return update
+
+def get_edge_update(item):
+    """(query, update) setting odds_summary.edge from the item's home_run_odds, or None without them.
+
+    The odds update stores edge as home_run_odds minus the consensus, so it is recomputed on the
+    server whenever an item is re-scored. Items without a consensus probability are not matched.
+    """
+    if not isinstance(item.get("home_run_odds"), (int, float)):
+        return None
+    query = {"player_name": item["player_name"], "date": item["date"], "model": item["model"],
+             "odds_summary.consensus_over_probability": {"$type": "number"}}
+    update = [{"$set": {"odds_summary.edge": {"$subtract": [item["home_run_odds"], "$odds_summary.consensus_over_probability"]}}}]
+    return query, update
+
+@profiler.timed("db.add_item")
+def add_item(collection, item):
+    required_fields = REQUIRED_FIELDS
+    for field in required_fields:
+        if field not in item:
+            log(f"{field} not in item", error=True)
+            return False
+
+    # Check if item already exists, fetching only the fields that are compared
+    query = {"player_name": item["player_name"], "date": item["date"], "model": item["model"]}
+    queried_item = collection.find_one(query, ITEM_PROJECTION)
+    if queried_item is not None:
+        did_update = False
+        for field in COMPARED_FIELDS:
+            if (field in item and item[field] != queried_item.get(field)) or (field == "shadow_odds" and field not in item and field in queried_item):
+                # $set keeps fields written by other jobs, e.g. odds_data
+                collection.update_one({"_id": queried_item["_id"]}, get_item_update(item))
+                edge_update = get_edge_update(item)
+                if edge_update is not None:
+                    collection.update_one(*edge_update)
+                log(f"Updating {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
+                did_update = True
+                break
+        if not did_update:
+            log(f"No change for {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
+    else:
+        try:
+            collection.insert_one(item)
+        except DuplicateKeyError:
+            # Added by another writer since the lookup
+            collection.update_one(query, get_item_update(item))
+        log(f"Added {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
+    return True
+
+def add_data(collection, data_to_add):
+    for item in data_to_add:
+        if not add_item(collection, item):
+            pass
+
+def update_outcomes(collection, date, outcomes, batch_size=DEFAULT_BATCH_SIZE):
+    """Sets did_hit_hr and game_id on every model's item for each hitter on date (YYYY-MM-DD).
+
+    outcomes is {player_name: (did_hit_home_run, game_id)}. Items that already have the outcome
+    are not matched, so re-running is cheap. Returns (matched, modified).
+    """
+    operations = []
+    n_matched, n_modified = 0, 0
+    for player_name, (did_hit_home_run, game_id) in outcomes.items():
+        did_hit_hr = 1 if did_hit_home_run else 0
+        query = {"player_name": player_name, "date": date,
+                 "$or": [{"did_hit_hr": {"$ne": did_hit_hr}}, {"game_id": {"$ne": game_id}}]}
+        operations.append(UpdateMany(query, {"$set": {"did_hit_hr": did_hit_hr, "game_id": game_id}}))
+    for i in range(0, len(operations), batch_size):
+        with profiler.stage("db.bulk_write"):
+            res = collection.bulk_write(operations[i:i + batch_size], ordered=False)
+        n_matched += res.matched_count
+        n_modified += res.modified_count
+    return n_matched, n_modified
+
+class BulkItemWriter(BaseClass):
+    """Upserts model result items in batches with bulk_write instead of one round trip per item.
+
+    Items are matched on (player_name, date, model) like add_item. Only the fields in the item
+    are $set (and shadow_odds unset without shadows), so fields written by other jobs (e.g. odds_data) are kept.
+    The odds_summary.edge of items that have one is then recomputed from the new home_run_odds.
+    """
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.operations = []
+        # Applied after self.operations, so they see the new home_run_odds
+        self.edge_operations = []
+        self.n_inserted = 0
+        self.n_updated = 0
+        self.n_unchanged = 0
+
+    def add(self, item):
+        for field in REQUIRED_FIELDS:
+            if field not in item:
+                self.log(f"{field} not in item", error=True)
+                return False
+        query = {"player_name": item["player_name"], "date": item["date"], "model": item["model"]}
+        self.operations.append(UpdateOne(query, get_item_update(item), upsert=True))
+        edge_update = get_edge_update(item)
+        if edge_update is not None:
+            self.edge_operations.append(UpdateOne(*edge_update))
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+        return True
+
+    def add_all(self, items):
+        for item in items:
+            self.add(item)
+
+    def flush(self):
+        if len(self.operations) == 0:
+            return
+        with profiler.stage("db.bulk_write"):
+            try:
+                res = self.collection.bulk_write(self.operations, ordered=False)
+                n_inserted, n_updated = res.upserted_count, res.modified_count
+            except BulkWriteError as e:
+                # Two upserts of a new item raced on the unique index; the retry finds the item
+                retry = [self.operations[x["index"]] for x in e.details["writeErrors"] if x["code"] == 11000]
+                if len(retry) < len(e.details["writeErrors"]):
+                    raise
+                res = self.collection.bulk_write(retry, ordered=False)
+                n_inserted = e.details["nUpserted"] + res.upserted_count
+                n_updated = e.details["nModified"] + res.modified_count
+            if len(self.edge_operations) > 0:
+                self.collection.bulk_write(self.edge_operations, ordered=False)
+        profiler.count("db.items_written", len(self.operations))
+        n_unchanged = len(self.operations) - n_inserted - n_updated
+        self.n_inserted += n_inserted
+        self.n_updated += n_updated
+        self.n_unchanged += n_unchanged
+        self.log(f"Wrote {len(self.operations)} items: {n_inserted} added, {n_updated} updated, {n_unchanged} unchanged")
+        self.operations = []
+        self.edge_operations = []
+
+    def close(self):
+        self.flush()
+        self.log(f"Finished writing: {self.n_inserted} added, {self.n_updated} updated, {self.n_unchanged} unchanged")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,134 @@
+import sys
+import time
+import sqlite3
+import datetime
+
+sys.path.append("utils")
+from base_class import BaseClass
+
+# Hidden, so the runner's glob over data_dir does not pick it up
+MANIFEST_FILENAME = ".download_manifest.sqlite"
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 15 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dates (
+    date TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    n_games INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS games_date ON games (date);
+"""
+
+def get_backoff_seconds(attempts):
+    return min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+class DownloadManifest(BaseClass):
+    """Per-date and per-game download status, kept in SQLite next to the game files.
+
+    A date is "listed" once its /boxes/ page has been scraped and "done" once every game on it has
+    been saved; done dates are skipped without any request. Games are "pending", "done" or "failed";
+    failed games are retried after an exponential backoff, up to MAX_ATTEMPTS times per run. Each run
+    starts with a fresh budget; the total number of attempts is kept for reporting.
+    Every status change is committed immediately, so an interrupted download resumes where it stopped.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        # Manifests written before run_attempts was added
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(games)")]
+        if "run_attempts" not in columns:
+            self.conn.execute("ALTER TABLE games ADD COLUMN run_attempts INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def now(self):
+        return datetime.datetime.now().isoformat(timespec="seconds")
+
+    def start_run(self):
+        """Gives failed games a fresh attempt budget and no backoff, so a new run retries them right away."""
+        with self.conn:
+            self.conn.execute("UPDATE games SET run_attempts = 0, next_attempt_at = 0 WHERE status = 'failed'")
+
+    def get_date_status(self, date):
+        row = self.conn.execute("SELECT status FROM dates WHERE date = ?", (date,)).fetchone()
+        return None if row is None else row[0]
+
+    def add_games(self, date, game_ids, final):
+        """Records the games listed for date; final means the list will not change (the date is over)."""
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO games (game_id, date, status, updated_at) VALUES (?, ?, 'pending', ?)",
+                                  [(x, date, self.now()) for x in game_ids])
+            self.conn.execute("INSERT INTO dates (date, status, n_games, attempts, updated_at) VALUES (?, ?, ?, 1, ?) "
+                              "ON CONFLICT(date) DO UPDATE SET status = excluded.status, n_games = excluded.n_games, "
+                              "attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at",
+                              (date, "listed" if final else "partial", len(game_ids), self.now()))
+
+    def mark_date_failed(self, date, error):
+        with self.conn:
+            self.conn.execute("INSERT INTO dates (date, status, attempts, error, updated_at) VALUES (?, 'failed', 1, ?, ?) "
+                              "ON CONFLICT(date) DO UPDATE SET status = 'failed', attempts = attempts + 1, "
+                              "error = excluded.error, updated_at = excluded.updated_at",
+                              (date, error, self.now()))
+
+    def get_games_to_download(self, date, now=None):
+        """Pending games, and failed games whose backoff has passed, for date."""
+        now = time.time() if now is None else now
+        rows = self.conn.execute("SELECT game_id FROM games WHERE date = ? AND (status = 'pending' OR "
+                                 "(status = 'failed' AND run_attempts < ? AND next_attempt_at <= ?)) ORDER BY game_id",
+                                 (date, MAX_ATTEMPTS, now)).fetchall()
+        return [x[0] for x in rows]
+
+    def get_retryable_games(self, dates):
+        """(game_id, date, next_attempt_at) for failed games on dates that still have attempts left in this run."""
+        rows = self.conn.execute("SELECT game_id, date, next_attempt_at FROM games WHERE status = 'failed' AND run_attempts < ? "
+                                 "ORDER BY next_attempt_at", (MAX_ATTEMPTS,)).fetchall()
+        dates = set(dates)
+        return [x for x in rows if x[1] in dates]
+
+    def mark_game_done(self, game_id):
+        with self.conn:
+            self.conn.execute("UPDATE games SET status = 'done', attempts = attempts + 1, error = NULL, updated_at = ? "
+                              "WHERE game_id = ?", (self.now(), game_id))
+
+    def mark_game_failed(self, game_id, error):
+        """Records a failed attempt and returns the number of attempts in this run."""
+        run_attempts = self.conn.execute("SELECT run_attempts FROM games WHERE game_id = ?", (game_id,)).fetchone()[0] + 1
+        with self.conn:
+            self.conn.execute("UPDATE games SET status = 'failed', attempts = attempts + 1, run_attempts = ?, error = ?, "
+                              "next_attempt_at = ?, updated_at = ? WHERE game_id = ?",
+                              (run_attempts, error, time.time() + get_backoff_seconds(run_attempts), self.now(), game_id))
+        return run_attempts
+
+    def update_date_status(self, date):
+        """Marks a listed date done once all of its games are done."""
+        if self.get_date_status(date) != "listed":
+            return
+        n_remaining = self.conn.execute("SELECT COUNT(*) FROM games WHERE date = ? AND status != 'done'", (date,)).fetchone()[0]
+        if n_remaining == 0:
+            with self.conn:
+                self.conn.execute("UPDATE dates SET status = 'done', updated_at = ? WHERE date = ?", (self.now(), date))
+
+    def get_failures(self, dates):
+        """(game_id or date, attempts, error) for everything in dates that is not done."""
+        dates = set(dates)
+        games = self.conn.execute("SELECT game_id, date, attempts, error FROM games WHERE status = 'failed'").fetchall()
+        failed_dates = self.conn.execute("SELECT date, date, attempts, error FROM dates WHERE status = 'failed'").fetchall()
+        return [(x[0], x[2], x[3]) for x in failed_dates + games if x[1] in dates]
@@ -0,0 +1,125 @@
+"""Feature extraction for --get_updates in forked worker processes.
+
+Workers are forked after the player map is built, so they read it copy-on-write instead of
+receiving a pickled copy. Each worker assembles the feature rows of a slice of games and hands
+the matrix back in a shared memory block; only the row metadata is pickled.
+"""
+import sys
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+sys.path.append("utils")
+from profiler import profiler
+
+TASKS_PER_WORKER = 4
+
+# Set in the parent before forking, so workers inherit the built runner
+shared_runner = None
+
+def get_game_rows(runner, game_id, columns):
+    """Returns (metadata, values) for the hitters of game_id, as get_items_for_date_range scores them.
+
+    metadata is (player_name, team_name, opposing_pitcher, date, game_id, did_hit_home_run) and
+    values holds columns, NaN for stats the hitter does not have.
+    """
+    game = runner.get_game(game_id)
+    home_hitters, away_hitters = game.get_home_hitters(), game.get_away_hitters()
+    if home_hitters is None or away_hitters is None:
+        return [], []
+    metadata, values = [], []
+    date = game.date.strftime("%Y-%m-%d")
+    for player_name, team_name in [(x, game.home_team) for x in home_hitters] + [(x, game.away_team) for x in away_hitters]:
+        stats = runner.get_stats_dict_for_player_before_game(player_name, game_id, game.date,
+                                                             include_last_season_data=True,
+                                                             hitter_games_threshold=0,
+                                                             pitcher_games_threshold=0)
+        if stats is None or len(stats) == 0:
+            continue
+        hitter = runner.player_map.get_hitter(player_name)
+        metadata.append((player_name, team_name, hitter.get_pitcher_id_for_game(game_id), date, game_id,
+                         hitter.did_hit_home_run(game_id)))
+        values.append([stats.get(x, np.nan) for x in columns])
+    return metadata, values
+
+def build_slice(runner, game_ids, columns):
+    metadata, values = [], []
+    for game_id in game_ids:
+        game_metadata, game_values = get_game_rows(runner, game_id, columns)
+        metadata += game_metadata
+        values += game_values
+    return metadata, np.array(values, dtype=np.float64).reshape(len(values), len(columns))
+
+def extract_slice(task):
+    """Worker: builds one slice and returns (shared memory name, row count, metadata, error).
+
+    Errors are returned as a traceback instead of raised, so the parent still receives (and
+    unlinks) the blocks of every other slice.
+    """
+    game_ids, columns = task
+    try:
+        metadata, values = build_slice(shared_runner, game_ids, columns)
+    except Exception:
+        return None, 0, [], traceback.format_exc()
+    if len(metadata) == 0:
+        return None, 0, metadata, None
+    shm = shared_memory.SharedMemory(create=True, size=values.nbytes)
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    # The parent unlinks the block once it has copied it, so the worker's tracker must not
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return shm.name, len(metadata), metadata, None
+
+def unlink_block(name):
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+@profiler.timed("feature_pool.extract")
+def extract_features(runner, game_ids, columns, n_workers=1):
+    """Returns (metadata, values) for every scored hitter of game_ids, in game order.
+
+    With n_workers > 1 the games are split into contiguous slices handled by forked workers.
+    Every block a worker returns is unlinked, even if another slice failed.
+    """
+    global shared_runner
+    if n_workers <= 1:
+        return build_slice(runner, game_ids, columns)
+
+    n_tasks = min(len(game_ids), n_workers * TASKS_PER_WORKER)
+    tasks = [(list(x), columns) for x in np.array_split(np.array(game_ids, dtype=object), n_tasks)] if n_tasks > 0 else []
+    shared_runner = runner
+    results = []
+    try:
+        with multiprocessing.get_context("fork").Pool(n_workers) as pool:
+            for result in pool.imap(extract_slice, tasks):
+                results.append(result)
+        errors = [x[3] for x in results if x[3] is not None]
+        if len(errors) > 0:
+            raise RuntimeError(f"Feature extraction failed in {len(errors)} of {len(tasks)} slices:\n{errors[0]}")
+
+        metadata = []
+        values = np.empty((sum(x[1] for x in results), len(columns)), dtype=np.float64)
+        i = 0
+        for name, n_rows, slice_metadata, _ in results:
+            metadata += slice_metadata
+            if name is None:
+                continue
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                values[i:i + n_rows] = np.ndarray((n_rows, len(columns)), dtype=np.float64, buffer=shm.buf)
+            finally:
+                shm.close()
+            i += n_rows
+    finally:
+        shared_runner = None
+        for name, _, _, _ in results:
+            if name is not None:
+                unlink_block(name)
+    return metadata, values
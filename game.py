@@ -7,6 +7,7 @@ import numpy as np
 
 sys.path.append("utils")
 from base_class import BaseClass
+from profiler import profiler
 
 class Game(BaseClass):
     def __init__(
@@ -68,9 +69,12 @@ class Game(BaseClass):
         with open(filename, "w") as f:
             json.dump(self.get_game_data(), f)
 
+    @profiler.timed("game.load")
     def load(self, filename="./data/game_data"):
         with open(filename, "r") as f:
             self.load_game_data(json.load(f))
+            profiler.count("game.files_read")
+            profiler.count("game.bytes_read", f.tell())
         # self.log(f"Data recovered for {self.id} from {filename}")
 
     def get_hitter_stats_from_raw_data(self):
@@ -121,6 +125,22 @@ class Game(BaseClass):
         batting_df = batting_df[ (batting_df["Position"] != "P") & (batting_df["Batting"] != "Team") ].set_index("Batting")
         return list(batting_df.index)
 
+    def get_home_hitters(self):
+        batting_df = self.home_team_batting_df
+        if "Batting" not in batting_df.columns:
+            self.log(f"Batting not found in batting_df for game {self.id}", error=True)
+            return None
+        batting_df = batting_df[ (batting_df["Position"] != "P") & (batting_df["Batting"] != "Team") ]
+        return list(batting_df["Batting"])
+
+    def get_away_hitters(self):
+        batting_df = self.away_team_batting_df
+        if "Batting" not in batting_df.columns:
+            self.log(f"Batting not found in batting_df for game {self.id}", error=True)
+            return None
+        batting_df = batting_df[ (batting_df["Position"] != "P") & (batting_df["Batting"] != "Team") ]
+        return list(batting_df["Batting"])
+
     def get_pitcher_stats_from_raw_data(self):
         """
         Returns stats for pitchers based on what has happened in the game + any games before it.
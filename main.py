@@ -1,19 +1,13 @@
 import os
 import argparse
-import pickle
-import tqdm
-import json
-import pandas as pd
-import numpy as np
-import statsapi
-from pymongo import MongoClient
+import datetime
 from dotenv import load_dotenv
 load_dotenv()
-from scraper import BaseballReferenceScraper
-from sportsbook_odds_data_handler import SportsbookOddsDataHandler
-from runner import Runner
 from config.models import models
 
+# Heavy dependencies (pandas, numpy, statsapi, pymongo, the scraper and the runner stack)
+# are imported inside the mode that needs them so that e.g. --push_to_db starts quickly.
+
 STAT_NAMES = ["Batting Average",
               "On-Base%",
               "Slugging %",
@@ -28,6 +22,14 @@ STAT_NAMES = ["Batting Average",
               "Average Runs Scored",
               "At Bats Per Game",
               "Games Played",
+              "Last 7 Games Home Runs",
+              "Last 15 Games Home Runs",
+              "Last 30 Games Home Runs",
+              "Last 7 Games At Bats",
+              "Last 15 Games At Bats",
+              "Last 30 Games At Bats",
+              "EWMA Home Runs",
+              "EWMA At Bats",
               "details"]
 
 PITCHER_STAT_NAMES = ["Earned Run Average",
@@ -46,309 +48,565 @@ PITCHER_STAT_NAMES = ["Earned Run Average",
                       "Average Earned Runs",
                       "Average Bases on Balls",
                       "Average Home Runs",
-                      "Average Strikeouts"]
-MIN_ABS_TO_PUSH = 50
+                      "Average Strikeouts",
+                      "Last 3 Games Home Runs",
+                      "Last 5 Games Home Runs",
+                      "Last 5 Games Batters Faced",
+                      "EWMA Home Runs",
+                      "EWMA Batters Faced"]
 ACCEPTED_SPORTSBOOKS = ["draftkings", "fanduel", "pointsbetus", "betrivers"]
-
-class NpEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NpEncoder, self).default(obj)
+# Set from --workers and --ledger
+n_workers = 1
+ledger_path = None
 
 def log(text, error=False, log=True, verbose=True):
-    msg = f"[{pd.Timestamp.now()}] {text}"
+    now = datetime.datetime.now()
+    msg = f"[{now}] {text}"
     if error:
-        msg = f"[{pd.Timestamp.now()}] ERROR: {text}"
+        msg = f"[{now}] ERROR: {text}"
     if verbose:
         print(msg)
     if log:
-        logfile = "logs/" + pd.Timestamp.now().strftime("%Y%m%d") + ".log"
+        logfile = "logs/" + now.strftime("%Y%m%d") + ".log"
         with open(logfile, "a") as f:
             f.write(msg + "\n")
 
-def download(start_date, end_date, data_dir, remove=False):
-    s = BaseballReferenceScraper(data_dir=data_dir)
+def download_game(s, manifest, game_id):
+    try:
+        s.get_game_data(game_id)
+    except Exception as e:
+        attempts = manifest.mark_game_failed(game_id, repr(e))
+        log(f"Downloading {game_id} failed (attempt {attempts} of this run): {e!r}", error=True)
+        return
+    manifest.mark_game_done(game_id)
+
+def download(start_date, end_date, data_dir, remove=False, session=None):
+    """Downloads the games from start_date to end_date, resuming from the manifest in data_dir.
+
+    Dates whose games are all saved are skipped without any request. Games that fail are retried
+    at the end after their backoff, up to MAX_ATTEMPTS times per run; anything still failing is
+    logged and retried on the next run, which starts with a fresh budget.
+    """
+    import glob
+    import time
+    import pandas as pd
+    from scraper import BaseballReferenceScraper
+    from download_manifest import DownloadManifest, MANIFEST_FILENAME
+
+    s = BaseballReferenceScraper(data_dir=data_dir, session=session)
+    manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
 
     if remove:
         wildcard = os.path.join(data_dir, "*")
         s.log(f"Removing {wildcard}")
-        for f in glob.glob(wildcard):
+        for f in glob.glob(wildcard) + glob.glob(manifest_path):
             os.remove(f)
 
-    game_ids = s.get_game_ids(start_date, end_date)
-    for game_id in game_ids:
-        try:
-            s.get_game_data(game_id)
-        except KeyboardInterrupt:
-            break
-        except:
-            log("Error", error=True)
-            continue
-
-def get_database():
-    client = MongoClient(os.getenv("MONGO_URL"))
-    return client["home_run_data"]
-
-def add_item(collection, item):
-    required_fields = ["player_name", "date", "model", "home_run_odds", "did_hit_hr", "opposing_pitcher", "team_name"]
-    other_fields = ["odds_data"]
-    for field in required_fields:
-        if field not in item:
-            log(f"{field} not in item", error=True)
-            return False
-
-    # Check if item already exists
-    queried_item = collection.find_one({"player_name": item["player_name"],
-                                        "date": item["date"],
-                                        "model": item["model"],
-                                        })
-    if queried_item is not None:
-        item["_id"] = queried_item["_id"]
-        for field in other_fields:
-            if field in queried_item:
-                item[field] = queried_item[field]
-        did_update = False
-        for field in required_fields:
-            if field in item and field in queried_item and item[field] != queried_item[field]:
-                collection.replace_one(queried_item, item)
-                log(f"Updating {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
-                did_update = True
-                break
-        if not did_update:
-            log(f"No change for {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
+    manifest = DownloadManifest(manifest_path)
+    manifest.start_run()
+    today = datetime.date.today()
+    dates = pd.date_range(start_date, end_date)
+    date_keys = [t.strftime("%Y%m%d") for t in dates]
+    try:
+        for t, date in zip(dates, date_keys):
+            status = manifest.get_date_status(date)
+            if status == "done":
+                s.log(f"All games for {date} already downloaded")
+                continue
+            if status != "listed":
+                try:
+                    game_ids = s.get_game_ids_for_date(t)
+                except Exception as e:
+                    manifest.mark_date_failed(date, repr(e))
+                    log(f"Getting game IDs for {date} failed: {e!r}", error=True)
+                    continue
+                # Unfinished games are not listed, so today's list is fetched again next time
+                manifest.add_games(date, game_ids, final=t.date() < today)
+            for game_id in manifest.get_games_to_download(date):
+                download_game(s, manifest, game_id)
+            manifest.update_date_status(date)
+
+        retryable = manifest.get_retryable_games(date_keys)
+        while len(retryable) > 0:
+            game_id, date, next_attempt_at = retryable[0]
+            wait = next_attempt_at - time.time()
+            if wait > 0:
+                log(f"Retrying {len(retryable)} failed games, next in {wait:.0f} seconds")
+                time.sleep(wait)
+            download_game(s, manifest, game_id)
+            manifest.update_date_status(date)
+            retryable = manifest.get_retryable_games(date_keys)
+    except KeyboardInterrupt:
+        log(f"Download interrupted, progress is saved in {manifest_path}")
+
+    for name, attempts, error in manifest.get_failures(date_keys):
+        log(f"{name} not downloaded after {attempts} attempts: {error}", error=True)
+    manifest.close()
+
+def build_runner(data_dir):
+    from runner import Runner
+
+    r = Runner(STAT_NAMES, PITCHER_STAT_NAMES, data_dir=data_dir)
+    r.build_player_map_for_all_games()
+    return r
+
+def run_download(mode_args):
+    assert(len(mode_args) >= 3)
+    start_date = mode_args[0]
+    end_date = mode_args[1]
+    data_dir = mode_args[2]
+    remove = False
+    if len(mode_args) > 3:
+        remove = mode_args[3]
+
+    log(f"Running download mode from {start_date} to {end_date} and saving into {data_dir}")
+
+    if not os.path.exists(data_dir):
+        log(f"{data_dir} does not exist", error=True)
+        assert(False)
+
+    download(start_date, end_date, data_dir, remove=remove)
+
+def open_ledger():
+    if ledger_path is None:
+        return None
+    from score_ledger import ScoreLedger
+    log(f"Only emitting items that are not in the ledger {ledger_path}")
+    return ScoreLedger(ledger_path)
+
+def get_model_scorers():
+    """(model_config, scorer) for each model in config/models.py, loaded once per process by model_registry."""
+    from model_registry import get_registry
+    return get_registry(STAT_NAMES, PITCHER_STAT_NAMES).get_model_scorers()
+
+def get_model_names():
+    return list(dict.fromkeys(x["name"] for x in models))
+
+def run_get_updates(mode_args):
+    from updates import UpdateBuilder
+    from update_io import NdjsonItemWriter
+
+    assert(len(mode_args) >= 4)
+    start_date = mode_args[0]
+    end_date = mode_args[1]
+    data_dir = mode_args[2]
+    output_file = mode_args[3]
+
+    log(f"Running update mode from {start_date} to {end_date} and saving into {data_dir}")
+
+    scorers = get_model_scorers()
+    builder = UpdateBuilder(build_runner(data_dir))
+    ledger = open_ledger()
+    with NdjsonItemWriter(output_file) as writer:
+        if n_workers > 1:
+            writer.write_all(builder.get_items_for_date_range_with_workers(scorers, start_date, end_date, n_workers=n_workers, ledger=ledger))
+        else:
+            for model_config, scorer in scorers:
+                log(f"Getting updates for model {model_config['name']}")
+                writer.write_all(builder.get_items_for_date_range(model_config, scorer, start_date, end_date, ledger=ledger))
+    log(f"Wrote {writer.n_items} items to {output_file}")
+    if ledger is not None:
+        # Recorded by --push_to_db once the items are in the database
+        ledger.stage(output_file)
+        ledger.close()
+
+def run_get_updates_shard(mode_args):
+    from sharding import ShardWorker
+
+    assert(len(mode_args) >= 6)
+    start_date, end_date, data_dir, output_file = mode_args[:4]
+    shard_index = int(mode_args[4])
+    n_shards = int(mode_args[5])
+    snapshot_dir = mode_args[6] if len(mode_args) > 6 else None
+
+    worker = ShardWorker(data_dir, STAT_NAMES, PITCHER_STAT_NAMES, snapshot_dir=snapshot_dir)
+    worker.run(get_model_scorers(), start_date, end_date, output_file, shard_index, n_shards)
+
+def run_merge_shards(mode_args):
+    from sharding import merge_partials
+
+    assert(len(mode_args) >= 2)
+    output_file = mode_args[0]
+    n_shards = int(mode_args[1])
+
+    n_items = merge_partials(output_file, n_shards, get_model_names(), remove=True)
+    log(f"Wrote {n_items} items from {n_shards} shards to {output_file}")
+
+def run_get_updates_sharded(mode_args):
+    from sharding import run_local_shards, merge_partials
+
+    assert(len(mode_args) >= 5)
+    start_date, end_date, data_dir, output_file = mode_args[:4]
+    n_shards = int(mode_args[4])
+    snapshot_dir = mode_args[5] if len(mode_args) > 5 else None
+
+    log(f"Running update mode from {start_date} to {end_date} in {n_shards} shards")
+    failed = run_local_shards(os.path.abspath(__file__), start_date, end_date, data_dir, output_file, n_shards, snapshot_dir=snapshot_dir)
+    if len(failed) > 0:
+        log(f"Shards {failed} failed, finished shards are kept for --merge_shards", error=True)
+        assert(False)
+    n_items = merge_partials(output_file, n_shards, get_model_names(), remove=True)
+    log(f"Wrote {n_items} items from {n_shards} shards to {output_file}")
+
+def run_get_updates_today(mode_args):
+    from updates import UpdateBuilder
+    from update_io import NdjsonItemWriter
+
+    assert(len(mode_args) >= 2)
+    output_file = mode_args[0]
+    # A data directory, or a map file from --publish_map to skip building the player map
+    data_dir = mode_args[1]
+
+    scorers = get_model_scorers()
+    slate = UpdateBuilder(None).get_todays_slate()
+    if os.path.isfile(data_dir):
+        from map_server import SharedMapTables
+        log(f"Using the published map {data_dir}")
+        builder = UpdateBuilder(None)
+        slate_stats = builder.get_slate_stats(slate, tables=SharedMapTables(data_dir))
     else:
-        collection.insert_one(item)
-        log(f"Added {item['player_name']} {item['date']} {item['model']} {item['did_hit_hr']} {item['home_run_odds']}")
-    return True
+        builder = UpdateBuilder(build_runner(data_dir))
+        slate_stats = builder.get_slate_stats(slate)
+    with NdjsonItemWriter(output_file) as writer:
+        for model_config, scorer in scorers:
+            log(f"Getting updates for model {model_config['name']}")
+            writer.write_all(builder.get_items_for_slate(model_config, scorer, slate, slate_stats=slate_stats))
+    log(f"Wrote {writer.n_items} items to {output_file}")
+
+def run_track_slate(mode_args):
+    """Scores today's batters as their lineups and starters are posted and pushes them to MongoDB.
+
+    Only games still missing a lineup or starter are polled, and only batters not scored yet are
+    scored. Without poll_minutes it polls once, e.g. from cron; with it, it keeps polling until
+    every game has its lineups or has started.
+    """
+    import time
+    from updates import UpdateBuilder
+    from slate_tracker import SlateTracker
+    from database import get_database, BulkItemWriter
+
+    assert(len(mode_args) >= 2)
+    # A data directory, or a map file from --publish_map
+    data_dir = mode_args[0]
+    state_path = mode_args[1]
+    poll_minutes = float(mode_args[2]) if len(mode_args) > 2 else None
+
+    scorers = get_model_scorers()
+    collection = get_database()["data"]
+    # Built on the first poll that finds batters to score, so polls with nothing new stay cheap
+    builder, tables = None, None
+
+    tracker = SlateTracker(state_path)
+    try:
+        while True:
+            tracker.poll()
+            keys, slate = tracker.get_pending_slate()
+            if len(slate) > 0:
+                if builder is None and os.path.isfile(data_dir):
+                    from map_server import SharedMapTables
+                    builder, tables = UpdateBuilder(None), SharedMapTables(data_dir)
+                elif builder is None:
+                    builder = UpdateBuilder(build_runner(data_dir))
+                log(f"Scoring {len(slate)} batters")
+                slate_stats = builder.get_slate_stats(slate, tables=tables)
+                with BulkItemWriter(collection) as writer:
+                    for model_config, scorer in scorers:
+                        writer.add_all(builder.get_items_for_slate(model_config, scorer, slate, slate_stats=slate_stats))
+                # Batters that could not be scored (unknown players, too few ABs) are not retried either
+                tracker.mark_scored(keys)
+            if poll_minutes is None or tracker.is_done():
+                break
+            time.sleep(poll_minutes * 60)
+    except KeyboardInterrupt:
+        log(f"Slate tracking interrupted, progress is saved in {state_path}")
+    tracker.close()
 
-def add_data(collection, data_to_add):
-    for item in data_to_add:
-        if not add_item(collection, item):
-            pass
+def run_publish_map(mode_args):
+    from map_server import publish_map
 
-def date_greater_than_or_equal(d1, d2):
-    return d1.year > d2.year or\
-           (d1.year == d2.year and d1.month > d2.month) or\
-           (d1.year == d2.year and d1.month == d2.month and d1.day >= d2.day)
+    assert(len(mode_args) >= 2)
+    data_dir = mode_args[0]
+    map_path = mode_args[1]
 
-if __name__ == "__main__":
-    log("----Running main-----")
-    parser = argparse.ArgumentParser(description="Baseball modeling CLI")
+    size = publish_map(build_runner(data_dir), map_path)
+    log(f"Published {size / 2 ** 20:.1f} MB of latest stats to {map_path}")
 
-    parser.add_argument("--download", nargs="+", help="Download data")
-    parser.add_argument("--get_updates", nargs="+", help="Get updates for model results for database")
-    parser.add_argument("--get_updates_today", nargs="+", help="Get updates for model results today's games")
-    parser.add_argument("--push_to_db", nargs="+", help="Push updates to MongoDB")
-    parser.add_argument("--update_sportsbook_odds", nargs="+", help="Push sportsbook odds updates to MongoDB")
-    args = parser.parse_args()
+def run_serve_map(mode_args):
+    from map_server import MapServer
 
-    if args.download is not None:
-        assert(len(args.download) >= 3)
-        start_date = args.download[0]
-        end_date = args.download[1]
-        data_dir = args.download[2]
-        remove = False
-        if len(args.download) > 3:
-            remove = args.download[3]
+    assert(len(mode_args) >= 2)
+    map_path = mode_args[0]
+    socket_path = mode_args[1]
 
-        log(f"Running download mode from {start_date} to {end_date} and saving into {data_dir}")
+    with MapServer(map_path, socket_path) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log("Map server stopped")
 
-        if not os.path.exists(data_dir):
-            log(f"{data_dir} does not exist", error=True)
-            assert(False)
+def run_push_to_db(mode_args):
+    assert(len(mode_args) >= 1)
+    output_file = mode_args[0]
 
-        download(start_date, end_date, data_dir, remove=remove)
+    if not os.path.exists(output_file):
+        log(f"{output_file} does not exist", error=True)
+        assert(False)
 
-    if args.get_updates is not None:
-        assert(len(args.get_updates) >= 4)
-        start_date = args.get_updates[0]
-        end_date = args.get_updates[1]
-        data_dir = args.get_updates[2]
-        output_file = args.get_updates[3]
+    log(f"Running push to DB mode from {output_file}")
 
-        log(f"Running update mode from {start_date} to {end_date} and saving into {data_dir}")
+    from database import get_database, BulkItemWriter
+    from update_io import iter_items
+    from score_ledger import commit_staged
 
-        r = Runner(STAT_NAMES, PITCHER_STAT_NAMES, data_dir=data_dir)
-        r.build_player_map_for_all_games()
+    db = get_database()
+    collection = db["data"]
+    log("Connected to db and collection")
 
-        for model_config in models:
-            log(f"Getting updates for model {model_config['name']}")
-            model_path = model_config["model_path"]
-            scaler_path = model_config["scaler_path"]
-
-            with open(model_path, "rb") as f:
-                model = pickle.load(f)
-            with open(scaler_path, "rb") as f:
-                scaler = pickle.load(f)
-
-            items = []
-            for game_id in tqdm.tqdm(r.get_games()):
-                game = r.get_game(game_id)
-                if date_greater_than_or_equal(pd.Timestamp(game.date), pd.Timestamp(start_date)) and date_greater_than_or_equal(pd.Timestamp(end_date), pd.Timestamp(game.date)):
-                    for player_name in game.get_hitters():
-                        stats = r.get_stats_for_player_before_game(hitter_name,
-                                                                   game_id,
-                                                                   game.date,
-                                                                   include_last_season_data=include_last_season_data,
-                                                                   hitter_games_threshold=0,
-                                                                   pitcher_games_threshold=0)
-                        if stats is not None and stats["At Bats"] < MIN_ABS_TO_PUSH:
-                            log(f"Not enough ABs ({stats['At Bats']}) for {player_name}, skipping")
-                            continue
-                        if stats is None or len(stats) == 0:
-                            continue
-                        input_data = scaler.transform([np.array(stats[model_config["features"]]).astype(float)])
-                        predicted_prob = model.predict_proba(input_data)[0][1]
-                        did_hit_home_run = r.player_map.get_player(player_name).did_hit_home_run(game_id)
-                        if did_hit_home_run is None:
-                            c = 2
-                        elif did_hit_home_run:
-                            c = 1
-                        else:
-                            c = 0
-                        item = {
-                            "player_name": player_name,
-                            "date": game.date.strftime("%Y-%m-%d"),
-                            "model": model_config["name"],
-                            "home_run_odds": predicted_prob,
-                            "did_hit_hr": c,
-                            "stats": dict(stats[["Batting Average", "Home Runs", "Runs Batted In", "On-Base%", "Slugging %", "At Bats", "Games Played"]]),
-                            "game_id": game_id,
-                        }
-                        items.append(item)
-
-        with open(output_file, "w") as f:
-            json.dump(items, f, cls=NpEncoder)
-
-    if args.get_updates_today is not None:
-        assert(len(args.get_updates_today) >= 2)
-        output_file = args.get_updates_today[0]
-        data_dir = args.get_updates_today[1]
-
-        schedule = statsapi.schedule()
-        game_ids = [x["game_id"] for x in schedule]
-        log(f"Getting updates for {len(game_ids)} games")
-
-        batter_names, batter_teams, opposing_pitchers = [], [], []
-        for game_id in tqdm.tqdm(game_ids):
-            boxscore_data = statsapi.boxscore_data(game_id)
-            away_batter_ids = [x["personId"] for x in boxscore_data["awayBatters"] if x["personId"] != 0]
-            home_batter_ids = [x["personId"] for x in boxscore_data["homeBatters"] if x["personId"] != 0]
-
-            if len(boxscore_data["awayPitchers"]) < 2 or len(boxscore_data["homePitchers"]) < 2:
-                log(f"Pitcher data not found for game {game_id}, skipping", error=True)
-                continue
-            away_pitcher_id = boxscore_data["awayPitchers"][1]["personId"]
-            away_pitcher_name = statsapi.lookup_player(away_pitcher_id)[0]["nameFirstLast"]
-            home_pitcher_id = boxscore_data["homePitchers"][1]["personId"]
-            home_pitcher_name = statsapi.lookup_player(home_pitcher_id)[0]["nameFirstLast"]
-
-            for bid in away_batter_ids:
-                player_query = statsapi.lookup_player(bid)[0]
-                player_team = statsapi.lookup_team(int(player_query["currentTeam"]["id"]))[0]["name"]
-                player_name = player_query["nameFirstLast"]
-                batter_names.append(player_name)
-                batter_teams.append(player_team)
-                opposing_pitchers.append(home_pitcher_name)
-            for bid in home_batter_ids:
-                player_query = statsapi.lookup_player(bid)[0]
-                player_team = statsapi.lookup_team(int(player_query["currentTeam"]["id"]))[0]["name"]
-                player_name = player_query["nameFirstLast"]
-                batter_names.append(player_name)
-                batter_teams.append(player_team)
-                opposing_pitchers.append(away_pitcher_name)
-        log(f"Found {len(batter_names)} batters today")
-
-        r = Runner(STAT_NAMES, PITCHER_STAT_NAMES, data_dir=data_dir)
-        r.build_player_map_for_all_games()
-
-        for model_config in models:
-            log(f"Getting updates for model {model_config['name']}")
-            model_path = model_config["model_path"]
-            scaler_path = model_config["scaler_path"]
+    # Items are read one line at a time and written in bounded bulk batches
+    with BulkItemWriter(collection) as writer:
+        writer.add_all(iter_items(output_file))
+    # Ledger hashes staged by --get_updates --ledger, now that the items are in the database
+    commit_staged(output_file)
 
-            with open(model_path, "rb") as f:
-                model = pickle.load(f)
-            with open(scaler_path, "rb") as f:
-                scaler = pickle.load(f)
+def run_update_sportsbook_odds(mode_args):
+    from sportsbook_odds_data_handler import SportsbookOddsDataHandler
+    from database import get_database
 
-            items = []
-            for player_name, player_team, pitcher_name in zip(batter_names, batter_teams, opposing_pitchers):
-                if r.player_map.get_player(player_name) is None:
-                    continue
-                stats = r.player_map.get_player(player_name).get_latest_stats()
-                stats = r.get_latest_stats_for_player_and_pitcher(player_name, pitcher_name)
-                if stats is not None and stats["At Bats"] < MIN_ABS_TO_PUSH:
-                    log(f"Not enough ABs ({stats['At Bats']}) for {player_name}, skipping")
-                    continue
-                if stats is None or len(stats) == 0:
-                    continue
-                input_data = scaler.transform([np.array(stats[model_config["features"]]).astype(float)])
-                predicted_prob = model.predict_proba(input_data)[0][1]
-                did_hit_home_run = r.player_map.get_player(player_name).did_hit_home_run(game_id)
-                assert(did_hit_home_run is None)
-                if did_hit_home_run is None:
-                    c = 2
-                elif did_hit_home_run:
-                    c = 1
-                else:
-                    c = 0
-                item = {
-                    "player_name": player_name,
-                    "opposing_pitcher": pitcher_name,
-                    "team_name": player_team,
-                    "date": pd.Timestamp.now().strftime("%Y-%m-%d"),
-                    "model": model_config["name"],
-                    "home_run_odds": predicted_prob,
-                    "did_hit_hr": c,
-                    "stats": dict(stats[["Batting Average", "Home Runs", "Runs Batted In", "On-Base%", "Slugging %", "At Bats", "Games Played"]]),
-                    "game_id": -1,
-                }
-                items.append(item)
-
-        with open(output_file, "w") as f:
-            json.dump(items, f, cls=NpEncoder)
-
-    if args.push_to_db is not None:
-        assert(len(args.push_to_db) >= 1)
-        output_file = args.push_to_db[0]
-
-        if not os.path.exists(output_file):
-            log(f"{output_file} does not exist", error=True)
-            assert(False)
-
-        log(f"Running push to DB mode from {output_file}")
-
-        db = get_database()
-        collection = db["data"]
-        log("Connected to db and collection")
-
-        with open(output_file, "r") as f:
-            data_to_add = json.load(f)
-            add_data(collection, data_to_add)
-
-    if args.update_sportsbook_odds is not None:
-        assert(len(args.update_sportsbook_odds) >= 1)
-        threshold_minutes = int(args.update_sportsbook_odds[0])
-
-        h = SportsbookOddsDataHandler()
-        h.log("Loaded handler")
-        if threshold_minutes >= 0:
-            games_to_update = h.get_games_to_update(threshold_minutes=threshold_minutes, update_all_games=False)
-        else:
-            games_to_update = h.get_games_to_update(update_all_games=True)
-        h.log(f"Updating {len(games_to_update)} games")
-        if len(games_to_update) > 0:
-            odds_for_games = h.get_odds_for_games(games_to_update, ACCEPTED_SPORTSBOOKS)
-            if len(odds_for_games) > 0:
-                db = get_database()
-                collection = db["data"]
-                h.log("Connected to db and collection")
-                h.upload_results_to_db(odds_for_games, collection)
+    assert(len(mode_args) >= 1)
+    threshold_minutes = int(mode_args[0])
 
+    h = SportsbookOddsDataHandler()
+    h.log("Loaded handler")
+    if threshold_minutes >= 0:
+        games_to_update = h.get_games_to_update(threshold_minutes=threshold_minutes, update_all_games=False)
+    else:
+        games_to_update = h.get_games_to_update(update_all_games=True)
+    h.log(f"Updating {len(games_to_update)} games")
+    if len(games_to_update) > 0:
+        odds_for_games = h.get_odds_for_games(games_to_update, ACCEPTED_SPORTSBOOKS)
+        if len(odds_for_games) > 0:
+            db = get_database()
+            collection = db["data"]
+            h.log("Connected to db and collection")
+            h.upload_results_to_db(odds_for_games, collection)
+
+def run_resolve_outcomes(mode_args):
+    """Sets did_hit_hr on a day's items from its box scores, without scoring or looking up season stats."""
+    import glob
+    from runner import Runner
+    from player import PlayerMap
+    from database import get_database, update_outcomes
+
+    assert(len(mode_args) >= 1)
+    data_dir = mode_args[0]
+    if len(mode_args) >= 2:
+        date = datetime.datetime.strptime(mode_args[1], "%Y-%m-%d").date()
+    else:
+        date = datetime.date.today() - datetime.timedelta(days=1)
+    date_string = date.strftime("%Y-%m-%d")
+
+    download(date_string, date_string, data_dir)
+
+    # A player map of only that day's games, read from the same per-game home run arrays as scoring
+    runner = Runner(STAT_NAMES, PITCHER_STAT_NAMES, data_dir=data_dir)
+    runner.player_map = PlayerMap(STAT_NAMES, PITCHER_STAT_NAMES, load_season_stats=False)
+    filenames = sorted(glob.glob(os.path.join(data_dir, "???" + date.strftime("%Y%m%d") + "?.json")),
+                       key=lambda x : int(os.path.basename(x)[3:-5]))
+    for filename in filenames:
+        runner.add_game_file(filename)
+    outcomes = runner.player_map.get_outcomes_for_date(date.strftime("%Y%m%d"))
+    log(f"Found outcomes for {len(outcomes)} hitters in {len(filenames)} games on {date_string}")
+
+    collection = get_database()["data"]
+    n_matched, n_modified = update_outcomes(collection, date_string, outcomes)
+    log(f"Resolved {n_modified} items ({n_matched} matched)")
+
+def run_pipeline(mode_args):
+    """Runs download -> today's scoring -> windowed backfill -> DB push in one process.
+
+    The Runner is built once and shared by every step, the Mongo client and HTTP sessions come
+    from resources.py, and items go straight to the bulk writer instead of through update_data/*.ndjson.
+    """
+    from updates import UpdateBuilder
+    from database import get_database, BulkItemWriter
+    from update_io import NdjsonItemWriter
+
+    assert(len(mode_args) >= 3)
+    start_date = mode_args[0]
+    end_date = mode_args[1]
+    data_dir = mode_args[2]
+    dump_dir = None
+    if len(mode_args) > 3:
+        dump_dir = mode_args[3]
+
+    log(f"Running pipeline from {start_date} to {end_date} using {data_dir}")
+
+    if not os.path.exists(data_dir):
+        log(f"{data_dir} does not exist", error=True)
+        assert(False)
+
+    collection = get_database()["data"]
+    # Fails on a bad model config before the download
+    scorers = get_model_scorers()
+
+    download(start_date, end_date, data_dir)
+
+    slate = UpdateBuilder(None).get_todays_slate()
+    builder = UpdateBuilder(build_runner(data_dir))
+    slate_stats = builder.get_slate_stats(slate)
+    ledger = open_ledger()
+
+    steps = [
+        ("updates_today", lambda model_config, scorer: builder.get_items_for_slate(model_config, scorer, slate, slate_stats=slate_stats)),
+        ("updates", lambda model_config, scorer: builder.get_items_for_date_range(model_config, scorer, start_date, end_date, ledger=ledger)),
+    ]
+    with BulkItemWriter(collection) as writer:
+        for step_name, get_items in steps:
+            dump_writer = None
+            if dump_dir is not None:
+                dump_writer = NdjsonItemWriter(os.path.join(dump_dir, step_name + ".ndjson"))
+            for model_config, scorer in scorers:
+                log(f"Getting {step_name} for model {model_config['name']}")
+                for item in get_items(model_config, scorer):
+                    writer.add(item)
+                    if dump_writer is not None:
+                        dump_writer.write(item)
+            writer.flush()
+            if ledger is not None:
+                # The items are in the database now
+                ledger.commit()
+            if dump_writer is not None:
+                dump_writer.close()
+    if ledger is not None:
+        ledger.close()
+
+def run_backtest(mode_args):
+    """Brier score, log loss, calibration and ROI against the sportsbooks for stored predictions.
+
+    source is "db" for the data collection, or NDJSON update files (glob patterns allowed).
+    """
+    from backtest import Backtest, get_backtest_query, iter_file_batches, iter_collection_batches
+
+    assert(len(mode_args) >= 1)
+    source = mode_args[0]
+    start_date = mode_args[1] if len(mode_args) > 1 else None
+    end_date = mode_args[2] if len(mode_args) > 2 else None
+    output_dir = mode_args[3] if len(mode_args) > 3 else None
+
+    log(f"Running backtest on {source} from {start_date} to {end_date}")
+    backtest = Backtest(start_date=start_date, end_date=end_date, sportsbooks=ACCEPTED_SPORTSBOOKS)
+    if source == "db":
+        from database import get_database
+        batches = iter_collection_batches(get_database()["data"], get_backtest_query(start_date, end_date))
+    else:
+        batches = iter_file_batches([source])
+    backtest.add_batches(batches)
+
+    metrics = backtest.get_metrics()
+    log("Backtest results:\n" + metrics.to_string(index=False))
+    if output_dir is not None:
+        metrics.to_csv(os.path.join(output_dir, "backtest_metrics.csv"), index=False)
+        backtest.get_metrics(by_date=True).to_csv(os.path.join(output_dir, "backtest_metrics_by_date.csv"), index=False)
+        backtest.get_calibration().to_csv(os.path.join(output_dir, "backtest_calibration.csv"), index=False)
+        log(f"Wrote backtest tables to {output_dir}")
+
+def run_build_training_set(mode_args):
+    from training import TrainingSetBuilder, DEFAULT_CHUNK_SIZE
+
+    assert(len(mode_args) >= 4)
+    start_date = mode_args[0]
+    end_date = mode_args[1]
+    data_dir = mode_args[2]
+    output_dir = mode_args[3]
+    chunk_size = DEFAULT_CHUNK_SIZE
+    if len(mode_args) > 4:
+        chunk_size = int(mode_args[4])
+
+    log(f"Building training set from {start_date} to {end_date} using {data_dir} into {output_dir}")
+
+    # Store the features of the latest model so the same columns can be retrained
+    builder = TrainingSetBuilder(build_runner(data_dir), models[-1]["features"], output_dir, chunk_size=chunk_size)
+    builder.build(start_date, end_date)
+
+def run_train(mode_args):
+    from training import ModelTrainer
+
+    assert(len(mode_args) >= 2)
+    training_dir = mode_args[0]
+    name = mode_args[1]
+    model_prefix = datetime.date.today().strftime("%Y%m%d") + name
+    if len(mode_args) > 2:
+        model_prefix = mode_args[2]
+
+    log(f"Training {name} on {training_dir}")
+
+    # A model that already has a primary entry is retrained as its shadow, scored alongside it until promoted
+    trainer = ModelTrainer(training_dir)
+    trainer.train(name, model_prefix, shadow=name in get_model_names())
+
+def run_export_models(mode_args):
+    from model_artifact import export_model
+
+    for model_config in models:
+        artifact_path, max_diff = export_model(model_config)
+        log(f"Exported {model_config['name']} to {artifact_path} (max difference from pickle {max_diff:.2e})")
+
+# Modes run in this order when several are passed in one invocation
+MODES = [
+    ("download", run_download, "Download data"),
+    ("get_updates", run_get_updates, "Get updates for model results for database"),
+    ("get_updates_today", run_get_updates_today, "Get updates for model results today's games"),
+    ("get_updates_sharded", run_get_updates_sharded,
+     "Like get_updates, split into date shards run as local processes: start end data_dir output_file n_shards [snapshot_dir]"),
+    ("get_updates_shard", run_get_updates_shard,
+     "Score one date shard into a partial file, e.g. on another node: start end data_dir output_file shard_index n_shards [snapshot_dir]"),
+    ("merge_shards", run_merge_shards, "Merge finished shard partials: output_file n_shards"),
+    ("track_slate", run_track_slate,
+     "Score and push today's batters as lineups are posted, polling only incomplete games: data_dir_or_map state_path [poll_minutes]"),
+    ("publish_map", run_publish_map,
+     "Build the player map and publish its latest stats to a file other processes can map: data_dir map_path"),
+    ("serve_map", run_serve_map, "Serve feature lookups from a published map over a Unix socket: map_path socket_path"),
+    ("push_to_db", run_push_to_db, "Push updates to MongoDB"),
+    ("resolve_outcomes", run_resolve_outcomes, "Set did_hit_hr on a day's items (default yesterday): data_dir [YYYY-MM-DD]"),
+    ("update_sportsbook_odds", run_update_sportsbook_odds, "Push sportsbook odds updates to MongoDB"),
+    ("pipeline", run_pipeline, "Download, score today's games and the date range, and push to MongoDB in one process"),
+    ("backtest", run_backtest,
+     "Brier score, log loss, calibration and ROI of stored predictions: db or update_file_pattern [start end [output_dir]]"),
+    ("build_training_set", run_build_training_set, "Write chunked training arrays for a date range"),
+    ("train", run_train, "Fit a scaler/model pair on a training set and add it to config/trained_models.json"),
+]
 
+if __name__ == "__main__":
+    log("----Running main-----")
+    parser = argparse.ArgumentParser(description="Baseball modeling CLI")
+
+    for name, _, help_text in MODES:
+        parser.add_argument(f"--{name}", nargs="+", help=help_text)
+    parser.add_argument("--export_models", action="store_true", help="Export pickled models in config/models.py to NumPy artifacts")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for --get_updates feature extraction, forked after the player map is built")
+    parser.add_argument("--ledger", help="SQLite score ledger; --get_updates and --pipeline then only emit items whose inputs or model changed")
+    parser.add_argument("--profile", nargs="*", help="Print per-stage timings and counters at exit, or dump them to a JSON file")
+    parser.add_argument("--profile_stage", nargs="+", help="Run one stage under cProfile (default) or pyinstrument, e.g. runner.build_player_map pyinstrument")
+    args = parser.parse_args()
+    n_workers = args.workers
+    ledger_path = args.ledger
+
+    if args.profile is not None or args.profile_stage is not None:
+        import sys
+        import atexit
+        sys.path.append("utils")
+        from profiler import profiler
+
+        profiler.enable()
+        if args.profile_stage is not None:
+            profiler.set_profile_hook(*args.profile_stage[:2])
+        profile_output = args.profile[0] if args.profile is not None and len(args.profile) > 0 else None
+        atexit.register(profiler.write_report, profile_output)
+
+    for name, run_mode, _ in MODES:
+        mode_args = getattr(args, name)
+        if mode_args is not None:
+            run_mode(mode_args)
+
+    if args.export_models:
+        run_export_models([])
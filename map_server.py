@@ -0,0 +1,248 @@
+"""Read-only latest-stats tables shared between processes through one memory-mapped file.
+
+publish_map writes the player map's latest hitter and pitcher stats tables, the matchup totals
+and the park factors to a file: a fixed header, a JSON index (columns, player and matchup rows,
+park factors and where each array starts) and the arrays themselves, aligned for NumPy. Any
+process can attach to it with SharedMapTables, whose arrays are views of the mapping, so the
+tables are never copied or unpickled. Publishing replaces the file atomically; attached readers
+keep the old mapping until they reload.
+
+MapServer answers "features for (hitter, pitcher)" requests over a Unix socket, one JSON object
+per line, from an attached file, for consumers that cannot map the file themselves.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import socket
+import struct
+import tempfile
+import datetime
+import socketserver
+import numpy as np
+
+sys.path.append("utils")
+from base_class import BaseClass
+from player import LatestStatsTable, MATCHUP_STAT_NAMES
+from park_factors import normalize_venue_name, PARK_FACTOR_STAT_NAME
+
+MAGIC = b"HRMAP001"
+# Magic and the length of the JSON index that follows
+HEADER = struct.Struct("<8sQ")
+ALIGNMENT = 64
+# How often the server checks whether the file has been republished
+RELOAD_CHECK_SECONDS = 1.0
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def publish_map(runner, path):
+    """Writes the runner's latest stats tables to path and returns the number of bytes written."""
+    player_map = runner.player_map
+    if player_map.latest_hitter_stats is None:
+        player_map.refresh_latest_stats()
+    hitters, pitchers = player_map.latest_hitter_stats, player_map.latest_pitcher_stats
+    matchup_keys = sorted(player_map.matchup_rows, key=player_map.matchup_rows.get)
+    park_factors = runner.park_factors
+    arrays = {
+        "hitter_values": np.ascontiguousarray(hitters.values, dtype=np.float64),
+        "pitcher_values": np.ascontiguousarray(pitchers.values, dtype=np.float64),
+        "matchup_totals": np.ascontiguousarray(player_map.matchup_totals[:len(matchup_keys)], dtype=np.int32),
+    }
+    index = {
+        "published_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "hitters": {"player_rows": hitters.player_rows, "stat_names": hitters.stat_names, "count_names": list(hitters.count_names)},
+        "pitchers": {"player_rows": pitchers.player_rows, "stat_names": pitchers.stat_names, "count_names": list(pitchers.count_names)},
+        "matchup_keys": [list(x) for x in matchup_keys],
+        "park_factors": {x: park_factors.get_factor(i) for x, i in park_factors.venue_ids.items()},
+        "default_park_factor": park_factors.get_factor(None),
+        "arrays": {},
+    }
+    # Array offsets depend on the index length, which depends on the offsets, so lay out the
+    # arrays after a first pass with placeholder offsets wide enough for any file size
+    for name, values in arrays.items():
+        index["arrays"][name] = {"offset": 2 ** 62, "dtype": values.dtype.str, "shape": list(values.shape)}
+    offset = align(HEADER.size + len(json.dumps(index).encode()))
+    for name, values in arrays.items():
+        index["arrays"][name]["offset"] = offset
+        offset = align(offset + values.nbytes)
+    index_bytes = json.dumps(index).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(index_bytes)))
+        f.write(index_bytes)
+        for name, values in arrays.items():
+            f.write(b"\0" * (index["arrays"][name]["offset"] - f.tell()))
+            f.write(values.tobytes())
+        size = f.tell()
+    # Readers attached to the old file keep their mapping; new readers get the complete new file
+    os.replace(tmp_path, path)
+    return size
+
+class SharedMapTables(BaseClass):
+    """Read-only view of a file written by publish_map.
+
+    Has the latest stats tables, get_matchup_totals and get_latest_factor of a PlayerMap and a
+    ParkFactorTable, so runner.get_latest_stats_for_slate works on it directly.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a published map")
+        index = json.loads(self.mm[HEADER.size:HEADER.size + index_length])
+        arrays = {}
+        for name, spec in index["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            arrays[name] = np.frombuffer(self.mm, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+
+        self.published_at = index["published_at"]
+        self.latest_hitter_stats = LatestStatsTable.from_values(index["hitters"]["player_rows"], index["hitters"]["stat_names"],
+                                                                index["hitters"]["count_names"], arrays["hitter_values"])
+        self.latest_pitcher_stats = LatestStatsTable.from_values(index["pitchers"]["player_rows"], index["pitchers"]["stat_names"],
+                                                                 index["pitchers"]["count_names"], arrays["pitcher_values"])
+        self.matchup_rows = {tuple(x): i for i, x in enumerate(index["matchup_keys"])}
+        self.matchup_totals = arrays["matchup_totals"]
+        self.park_factors = index["park_factors"]
+        self.default_park_factor = index["default_park_factor"]
+
+    def is_stale(self):
+        """True once the file has been republished since it was attached."""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return False
+
+    def get_matchup_totals(self, hitter_ids, pitcher_ids):
+        rows = np.array([self.matchup_rows.get(x, -1) for x in zip(hitter_ids, pitcher_ids)], dtype=np.int64)
+        totals = np.zeros((len(rows), len(MATCHUP_STAT_NAMES)), dtype=np.int32)
+        found = rows >= 0
+        totals[found] = self.matchup_totals[rows[found]]
+        return totals
+
+    def get_latest_factor(self, venue):
+        if venue is None:
+            return self.default_park_factor
+        return self.park_factors.get(normalize_venue_name(venue), self.default_park_factor)
+
+    def get_features(self, hitter_id, pitcher_id, venue=None, include_last_season_data=True):
+        """{feature: value} for one (hitter, pitcher), with the columns of get_latest_stats_for_slate, or None if either is missing.
+
+        Reads the rows directly instead of building a DataFrame, for single lookups.
+        """
+        hitter_row = self.latest_hitter_stats.player_rows.get(hitter_id)
+        pitcher_row = self.latest_pitcher_stats.player_rows.get(pitcher_id)
+        if hitter_row is None or pitcher_row is None:
+            return None
+        features = {}
+        for table, row, prefix in [(self.latest_hitter_stats, hitter_row, ""), (self.latest_pitcher_stats, pitcher_row, "Opposing Pitcher ")]:
+            n_columns = len(table.columns) if include_last_season_data else len(table.stat_names)
+            for x, value in zip(table.columns[:n_columns], table.values[row, :n_columns].tolist()):
+                features[prefix + x] = int(value) if x in table.count_names else value
+            if prefix == "":
+                matchup_row = self.matchup_rows.get((hitter_id, pitcher_id))
+                totals = [0] * len(MATCHUP_STAT_NAMES) if matchup_row is None else self.matchup_totals[matchup_row].tolist()
+                features.update(zip(MATCHUP_STAT_NAMES, totals))
+        features[PARK_FACTOR_STAT_NAME] = self.get_latest_factor(venue)
+        return features
+
+    def close(self):
+        # Views of the mapping must be dropped before it can be closed
+        self.latest_hitter_stats = self.latest_pitcher_stats = self.matchup_totals = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # Still referenced by a frame a caller holds; the mapping is freed with it
+            pass
+
+class MapRequestHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line on a persistent connection, answered with one JSON line.
+
+    {"hitter": ..., "pitcher": ..., "venue": ...} gets {"features": {...}} ({"features": null} if
+    either player is unknown), and {"pairs": [[hitter, pitcher, venue], ...]} gets
+    {"features": [...]}. "include_last_season_data": false leaves out the "Last Season" columns.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                tables = self.server.get_tables()
+                include_last_season_data = request.get("include_last_season_data", True)
+                if "pairs" in request:
+                    features = [tables.get_features(*x, include_last_season_data=include_last_season_data) for x in request["pairs"]]
+                else:
+                    features = tables.get_features(request["hitter"], request["pitcher"], request.get("venue"),
+                                                   include_last_season_data=include_last_season_data)
+                response = {"features": features}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": repr(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+class MapServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer, BaseClass):
+    """Serves feature lookups from a published map file, reattaching when it is republished."""
+    daemon_threads = True
+
+    def __init__(self, map_path, socket_path):
+        self.map_path = map_path
+        self.socket_path = socket_path
+        self.tables = SharedMapTables(map_path)
+        self.last_check = time.monotonic()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, MapRequestHandler)
+        self.log(f"Serving {map_path} (published {self.tables.published_at}) on {socket_path}")
+
+    def get_tables(self):
+        now = time.monotonic()
+        if now - self.last_check > RELOAD_CHECK_SECONDS:
+            self.last_check = now
+            if self.tables.is_stale():
+                # Requests still using the old tables keep them alive until they finish
+                self.tables = SharedMapTables(self.map_path)
+                self.log(f"Reattached {self.map_path} (published {self.tables.published_at})")
+        return self.tables
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+class MapClient:
+    """Client for MapServer over one persistent connection."""
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.f = self.sock.makefile("rwb")
+
+    def request(self, request):
+        self.f.write(json.dumps(request).encode() + b"\n")
+        self.f.flush()
+        response = json.loads(self.f.readline())
+        if "error" in response:
+            raise ValueError(f"Map server error: {response['error']}")
+        return response["features"]
+
+    def get_features(self, hitter_id, pitcher_id, venue=None, include_last_season_data=True):
+        return self.request({"hitter": hitter_id, "pitcher": pitcher_id, "venue": venue,
+                             "include_last_season_data": include_last_season_data})
+
+    def get_features_for_pairs(self, pairs, include_last_season_data=True):
+        """Features for each (hitter, pitcher, venue) in one round trip."""
+        return self.request({"pairs": [list(x) for x in pairs], "include_last_season_data": include_last_season_data})
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,118 @@
+import os
+import pickle
+import numpy as np
+
+PARITY_TOLERANCE = 1e-9
+
+def get_artifact_path(model_path):
+    """The artifact for model_data/x_model.p lives next to it at model_data/x_model.npz."""
+    root, _ = os.path.splitext(model_path)
+    return root + ".npz"
+
+def fold_scaler_into_coefficients(scaler, model):
+    """Folds a StandardScaler into logistic regression weights.
+
+    sigmoid(((x - mu) / sigma) . w + b) == sigmoid(x . (w / sigma) + (b - sum(mu * w / sigma)))
+    """
+    if len(model.classes_) != 2:
+        raise ValueError("Only binary logistic regression models can be exported")
+    coef = np.asarray(model.coef_, dtype=np.float64)[0]
+    intercept = float(np.asarray(model.intercept_, dtype=np.float64)[0])
+    mean = np.zeros_like(coef)
+    scale = np.ones_like(coef)
+    if getattr(scaler, "with_mean", True) and scaler.mean_ is not None:
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+    if getattr(scaler, "with_std", True) and scaler.scale_ is not None:
+        scale = np.asarray(scaler.scale_, dtype=np.float64)
+    folded_coef = coef / scale
+    folded_intercept = intercept - float(np.dot(mean, folded_coef))
+    return folded_coef, folded_intercept
+
+class LogisticScorer:
+    """Pure NumPy logistic scorer over raw (unscaled) feature rows."""
+    def __init__(self, coef, intercept, features=None):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.features = list(features) if features is not None else None
+
+    @classmethod
+    def load(cls, artifact_path):
+        with np.load(artifact_path, allow_pickle=False) as data:
+            features = [str(x) for x in data["features"]] if "features" in data else None
+            return cls(data["coef"], data["intercept"][0], features=features)
+
+    @classmethod
+    def from_sklearn(cls, scaler, model, features=None):
+        coef, intercept = fold_scaler_into_coefficients(scaler, model)
+        return cls(coef, intercept, features=features)
+
+    def save(self, artifact_path):
+        arrays = {"coef": self.coef, "intercept": np.array([self.intercept])}
+        if self.features is not None:
+            arrays["features"] = np.array(self.features)
+        # np.savez appends .npz unless the path already ends with it
+        np.savez(artifact_path, **arrays)
+
+    @property
+    def version(self):
+        """Hash of the coefficients, intercept and features, which changes whenever the model does."""
+        import hashlib
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.coef.astype("<f8").tobytes())
+        h.update(repr(self.intercept).encode())
+        h.update(repr(self.features).encode())
+        return h.hexdigest()
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return X @ self.coef + self.intercept
+
+    def predict_proba(self, X):
+        """Returns P(home run) for each row of X (a 2D array, or a single 1D row)."""
+        z = self.decision_function(X)
+        # Numerically stable sigmoid: 1 / (1 + exp(-z))
+        return np.exp(-np.logaddexp(0, -z))
+
+def load_sklearn_pair(scaler_path, model_path):
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    with open(scaler_path, "rb") as f:
+        scaler = pickle.load(f)
+    return scaler, model
+
+def check_parity(scaler, model, scorer, n=5000, seed=42):
+    """Compares the scorer against scaler.transform -> predict_proba on random rows around the scaler mean."""
+    rng = np.random.default_rng(seed)
+    n_features = len(scorer.coef)
+    mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.mean_ is not None else np.zeros(n_features)
+    scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler.scale_ is not None else np.ones(n_features)
+    X = mean + 3 * scale * rng.standard_normal((n, n_features))
+    expected = model.predict_proba(scaler.transform(X))[:, 1]
+    actual = scorer.predict_proba(X)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if max_diff > PARITY_TOLERANCE:
+        raise ValueError(f"Exported model differs from pickled model by {max_diff}")
+    return max_diff
+
+def export_model(model_config):
+    """Writes the folded artifact next to the pickled model and checks it against the pickles."""
+    scaler, model = load_sklearn_pair(model_config["scaler_path"], model_config["model_path"])
+    scorer = LogisticScorer.from_sklearn(scaler, model, features=model_config["features"])
+    if len(scorer.coef) != len(model_config["features"]):
+        raise ValueError(f"Model has {len(scorer.coef)} coefficients but config has {len(model_config['features'])} features")
+    max_diff = check_parity(scaler, model, scorer)
+    artifact_path = get_artifact_path(model_config["model_path"])
+    scorer.save(artifact_path)
+    return artifact_path, max_diff
+
+def load_scorer(model_config):
+    """Loads the NumPy scorer for a model config, falling back to folding the pickles if no artifact exists."""
+    artifact_path = get_artifact_path(model_config["model_path"])
+    if os.path.exists(artifact_path):
+        scorer = LogisticScorer.load(artifact_path)
+        if scorer.features is not None and scorer.features != list(model_config["features"]):
+            raise ValueError(f"Features in {artifact_path} do not match the model config")
+        return scorer
+    scaler, model = load_sklearn_pair(model_config["scaler_path"], model_config["model_path"])
+    return LogisticScorer.from_sklearn(scaler, model, features=model_config["features"])
@@ -0,0 +1,87 @@
+"""Loads, validates and caches the models in config/models.py.
+
+Every entry is checked against the features the runner can produce when the registry is built,
+so a config typo fails at startup instead of as a KeyError halfway through scoring. Each loaded
+scorer is tagged with a content hash of its coefficients (LogisticScorer.version), and scorers
+are cached per process, so the pipeline and long-running modes load each artifact once.
+
+Entries with "shadow": True are scored alongside the primary entry of the same name in the same
+pass. Their scores go on the primary's items under "shadow_odds", keyed by version, so a new
+model can be compared on live data before it replaces the current one.
+"""
+import sys
+
+sys.path.append("utils")
+from base_class import BaseClass
+from model_artifact import load_scorer, get_artifact_path
+
+VERSION_LENGTH = 12
+
+# (artifact path, scaler path) -> scorer, shared by every registry in the process
+scorer_cache = {}
+registries = {}
+
+def get_producible_features(stat_names, pitcher_stat_names):
+    """Feature names that Runner.get_stats_for_player_before_game and the slate tables produce."""
+    from player import MATCHUP_STAT_NAMES
+    from park_factors import PARK_FACTOR_STAT_NAME
+
+    hitter_stats = [x for x in stat_names if x != "details"]
+    pitcher_stats = [x for x in pitcher_stat_names if x != "details"]
+    features = set(hitter_stats + ["Last Season " + x for x in hitter_stats])
+    features.update(MATCHUP_STAT_NAMES)
+    features.update("Opposing Pitcher " + x for x in pitcher_stats)
+    features.update("Opposing Pitcher Last Season " + x for x in pitcher_stats)
+    features.add(PARK_FACTOR_STAT_NAME)
+    return features
+
+def get_cached_scorer(model_config):
+    key = (get_artifact_path(model_config["model_path"]), model_config["scaler_path"])
+    if key not in scorer_cache:
+        scorer_cache[key] = load_scorer(model_config)
+    return scorer_cache[key]
+
+class ModelRegistry(BaseClass):
+    def __init__(self, model_configs, stat_names, pitcher_stat_names):
+        features = get_producible_features(stat_names, pitcher_stat_names)
+        for model_config in model_configs:
+            missing = [x for x in model_config["features"] if x not in features]
+            if len(missing) > 0:
+                raise ValueError(f"Model {model_config['name']} ({model_config['model_path']}) uses features "
+                                 f"the runner does not produce: {', '.join(missing)}")
+
+        # name -> primary config, and name -> shadow configs, in config order
+        self.primary = {}
+        self.shadows = {}
+        for model_config in model_configs:
+            name = model_config["name"]
+            scorer = get_cached_scorer(model_config)
+            entry = dict(model_config, version=scorer.version[:VERSION_LENGTH])
+            if model_config.get("shadow", False):
+                self.shadows.setdefault(name, []).append((entry, scorer))
+            elif name in self.primary:
+                raise ValueError(f"Model {name} has more than one entry without \"shadow\": True")
+            else:
+                self.primary[name] = (entry, scorer)
+        for name in self.shadows:
+            if name not in self.primary:
+                raise ValueError(f"Shadow model {name} has no primary entry")
+        self.log(f"Loaded {len(self.primary)} models: " +
+                 ", ".join(f"{x}@{self.primary[x][0]['version']} ({len(self.shadows.get(x, []))} shadows)" for x in self.primary))
+
+    def get_model_names(self):
+        return list(self.primary)
+
+    def get_model_scorers(self):
+        """(model_config, scorer) for each primary model, with its "version" and "shadows" [(config, scorer)] set."""
+        return [(dict(entry, shadows=self.shadows.get(name, [])), scorer) for name, (entry, scorer) in self.primary.items()]
+
+def get_registry(stat_names, pitcher_stat_names, model_configs=None):
+    """The process-wide registry for config/models.py (or model_configs), built on first use."""
+    if model_configs is None:
+        from config.models import models
+        model_configs = models
+    key = (id(model_configs), tuple(stat_names), tuple(pitcher_stat_names))
+    if key not in registries:
+        registries[key] = ModelRegistry(model_configs, stat_names, pitcher_stat_names)
+    return registries[key]
@@ -0,0 +1,85 @@
+"""Vectorized conversions of American odds to implied, no-vig probabilities and payouts."""
+import numpy as np
+import pandas as pd
+
+# odds_data.data[book] has the display string under the side ("over") and the integer price under side + PRICE_SUFFIX
+PRICE_SUFFIX = "_price"
+
+def parse_american_odds(odds):
+    """Float array of American prices from strings like "+350" and "-500" or numbers.
+
+    Missing or unparseable prices, and prices between -100 and +100 (e.g. the "+0" written for a
+    price of 0), are NaN.
+    """
+    prices = pd.to_numeric(pd.Series(odds, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+    prices[np.abs(prices) < 100] = np.nan
+    return prices
+
+def get_implied_probabilities(prices):
+    """Break-even probability of each American price (including the book's margin), NaN where the price is NaN."""
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(prices > 0, 100 / (prices + 100), -prices / (100 - prices))
+
+def get_decimal_odds(prices):
+    """Total return per unit staked for each American price, e.g. +350 -> 4.5 and -500 -> 1.2."""
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(prices > 0, 1 + prices / 100, 1 - 100 / prices)
+
+def get_no_vig_probabilities(over_prices, under_prices):
+    """Over probability with the book's margin removed, from each over/under price pair; NaN without both sides."""
+    over = get_implied_probabilities(over_prices)
+    under = get_implied_probabilities(under_prices)
+    return over / (over + under)
+
+def nan_mean(values, axis):
+    """Mean of the non-NaN values along axis, NaN (without numpy's warning) where there are none."""
+    n = (~np.isnan(values)).sum(axis=axis)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n > 0, np.nansum(values, axis=axis) / n, np.nan)
+
+def to_optional_float(x):
+    return None if np.isnan(x) else float(x)
+
+def get_odds_summaries(player_names, sportsbooks, sides, prices):
+    """Best price and consensus per player from flat arrays of outcomes, one entry per (player, book, side).
+
+    Returns {player_name: summary}, where summary holds the best over and under prices and the book
+    offering each, the implied probability of the best over price, and the mean implied and no-vig
+    over probabilities across books. Missing values are None.
+    """
+    player_codes, players = pd.factorize(pd.Series(player_names, dtype=object))
+    book_codes, books = pd.factorize(pd.Series(sportsbooks, dtype=object))
+    sides = pd.Series(sides, dtype=object).str.lower()
+    side_codes = np.where(sides == "over", 0, np.where(sides == "under", 1, -1))
+    prices = parse_american_odds(prices)
+    valid = (side_codes >= 0) & ~np.isnan(prices) & (player_codes >= 0) & (book_codes >= 0)
+
+    # (player, book, side) prices, NaN where a book has no price
+    table = np.full((len(players), len(books), 2), np.nan)
+    table[player_codes[valid], book_codes[valid], side_codes[valid]] = prices[valid]
+    over, under = table[:, :, 0], table[:, :, 1]
+    rows = np.arange(len(players))
+    best_over_book = np.argmax(np.where(np.isnan(over), -np.inf, over), axis=1)
+    best_under_book = np.argmax(np.where(np.isnan(under), -np.inf, under), axis=1)
+    best_over = over[rows, best_over_book]
+    best_under = under[rows, best_under_book]
+    best_over_probability = get_implied_probabilities(best_over)
+    implied_over_probability = nan_mean(get_implied_probabilities(over), axis=1)
+    consensus_over_probability = nan_mean(get_no_vig_probabilities(over, under), axis=1)
+    n_sportsbooks = (~np.isnan(over)).sum(axis=1)
+
+    summaries = {}
+    for i, player_name in enumerate(players):
+        summaries[player_name] = {
+            "best_over_price": None if np.isnan(best_over[i]) else int(best_over[i]),
+            "best_over_sportsbook": None if np.isnan(best_over[i]) else books[best_over_book[i]],
+            "best_under_price": None if np.isnan(best_under[i]) else int(best_under[i]),
+            "best_under_sportsbook": None if np.isnan(best_under[i]) else books[best_under_book[i]],
+            "best_over_probability": to_optional_float(best_over_probability[i]),
+            "implied_over_probability": to_optional_float(implied_over_probability[i]),
+            "consensus_over_probability": to_optional_float(consensus_over_probability[i]),
+            "n_sportsbooks": int(n_sportsbooks[i]),
+        }
+    return summaries
@@ -0,0 +1,92 @@
+import sys
+import re
+import numpy as np
+from unidecode import unidecode
+
+sys.path.append("utils")
+from base_class import BaseClass
+
+PARK_FACTOR_STAT_NAME = "Park Home Run Factor"
+# Home runs per game are averaged over each park's last PARK_WINDOW_GAMES games (about three
+# seasons of home games) and compared to the league over its last LEAGUE_WINDOW_GAMES games.
+# PRIOR_GAMES league-average games are mixed in so parks with few games stay close to 1.
+PARK_WINDOW_GAMES = 243
+LEAGUE_WINDOW_GAMES = 2430
+PRIOR_GAMES = 30
+
+def normalize_venue_name(venue):
+    """Baseball Reference and statsapi names differ slightly, e.g. "Yankee Stadium III" and "Yankee Stadium"."""
+    words = re.sub(r"[^a-z0-9 ]", " ", unidecode(venue).lower()).split()
+    if len(words) > 1 and words[-1] in ["ii", "iii", "iv"]:
+        words = words[:-1]
+    return " ".join(words)
+
+class ParkFactorTable(BaseClass):
+    """Rolling home run park factors, updated one game at a time.
+
+    Each venue gets an integer id and a row in ring buffers of home runs per game. The factor
+    before every added game is kept, so lookups for past games never see that game or later ones.
+    """
+    def __init__(self, park_window=PARK_WINDOW_GAMES, league_window=LEAGUE_WINDOW_GAMES, prior_games=PRIOR_GAMES):
+        self.park_window = park_window
+        self.league_window = league_window
+        self.prior_games = prior_games
+        self.venue_ids = {}
+        self.park_home_runs = np.zeros((0, park_window), dtype=np.int8)
+        self.park_games = np.zeros(0, dtype=np.int32)
+        self.park_sums = np.zeros(0, dtype=np.int32)
+        self.league_home_runs = np.zeros(league_window, dtype=np.int8)
+        self.league_games = 0
+        self.league_sum = 0
+        # game id -> factor of the game's venue before the game
+        self.game_factors = {}
+
+    def get_venue_id(self, venue, create=False):
+        if venue is None:
+            return None
+        key = normalize_venue_name(venue)
+        if key in self.venue_ids:
+            return self.venue_ids[key]
+        if not create:
+            return None
+        venue_id = len(self.venue_ids)
+        self.venue_ids[key] = venue_id
+        if venue_id == len(self.park_games):
+            capacity = max(32, 2 * venue_id)
+            self.park_home_runs = np.concatenate([self.park_home_runs, np.zeros((capacity - venue_id, self.park_window), dtype=np.int8)])
+            self.park_games = np.concatenate([self.park_games, np.zeros(capacity - venue_id, dtype=np.int32)])
+            self.park_sums = np.concatenate([self.park_sums, np.zeros(capacity - venue_id, dtype=np.int32)])
+        return venue_id
+
+    def get_factor(self, venue_id):
+        """Park home runs per game over league home runs per game, 1 if either is unknown."""
+        if venue_id is None or self.league_games == 0 or self.league_sum == 0:
+            return 1.0
+        league_rate = self.league_sum / min(self.league_games, self.league_window)
+        park_games = min(int(self.park_games[venue_id]), self.park_window)
+        park_rate = (int(self.park_sums[venue_id]) + self.prior_games * league_rate) / (park_games + self.prior_games)
+        return park_rate / league_rate
+
+    def add_game(self, game_id, venue, home_runs):
+        """Records the factor before game_id, then adds the game's home runs (both teams)."""
+        if game_id in self.game_factors:
+            return
+        venue_id = self.get_venue_id(venue, create=True)
+        self.game_factors[game_id] = self.get_factor(venue_id)
+
+        # The buffers start at 0, so the slot being overwritten is the game leaving the window
+        if venue_id is not None:
+            i = self.park_games[venue_id] % self.park_window
+            self.park_sums[venue_id] += home_runs - int(self.park_home_runs[venue_id, i])
+            self.park_home_runs[venue_id, i] = home_runs
+            self.park_games[venue_id] += 1
+        i = self.league_games % self.league_window
+        self.league_sum += home_runs - int(self.league_home_runs[i])
+        self.league_home_runs[i] = home_runs
+        self.league_games += 1
+
+    def get_factor_before_game(self, game_id):
+        return self.game_factors.get(game_id, 1.0)
+
+    def get_latest_factor(self, venue):
+        return self.get_factor(self.get_venue_id(venue))
@@ -1,5 +1,6 @@
 import sys
 import os
+import re
 import pickle
 import pandas as pd
 import numpy as np
@@ -8,18 +9,79 @@ from unidecode import unidecode
 
 sys.path.append("utils")
 from base_class import BaseClass
+from profiler import profiler
+
+# Season-to-date counters are kept as narrow integers, every other stat as float32
+HITTER_COUNT_STATS = ["Home Runs", "Runs Batted In", "At Bats", "Hits", "Runs Scored", "Games Played"]
+PITCHER_COUNT_STATS = ["Hits", "Runs Scored", "Earned Runs", "Bases on Balls",
+                       "Strikeouts", "Home Runs", "Pit", "Str", "Batters Faced", "Games Played"]
+INITIAL_CAPACITY = 16
+# Recent form stats, e.g. "Last 7 Games Home Runs" (sum over the player's last 7 games) and
+# "EWMA Home Runs" (exponentially weighted home runs per game), of any per-game counter
+ROLLING_STAT_PATTERN = re.compile(r"^Last (\d+) Games (.+)$")
+EWMA_STAT_PREFIX = "EWMA "
+EWMA_HALF_LIFE_GAMES = 10
+# Hitter totals in games against one opposing starting pitcher. Box scores only have full game
+# lines, so a game counts in full against the pitcher who started it.
+MATCHUP_STAT_NAMES = ["Matchup Games", "Matchup Plate Appearances", "Matchup At Bats", "Matchup Hits", "Matchup Home Runs"]
+
+def lookup_player(*args, **kwargs):
+    profiler.count("statsapi.lookup_player")
+    with profiler.stage("statsapi.lookup_player"):
+        return statsapi.lookup_player(*args, **kwargs)
+
+def player_stat_data(*args, **kwargs):
+    profiler.count("statsapi.player_stat_data")
+    with profiler.stage("statsapi.player_stat_data"):
+        return statsapi.player_stat_data(*args, **kwargs)
 
 def convert_innings_pitched(x):
     add_zeros = lambda x : x if x != "" else 0
     return int(float(add_zeros(x))) + (10/3) * (float(add_zeros(x)) - int(float(add_zeros(x))))
 
+def count_home_runs(details):
+    if "3·HR" in details:
+        return 3
+    elif "2·HR" in details:
+        return 2
+    elif "HR" in details:
+        return 1
+    return 0
+
+def to_int(x):
+    try:
+        return int(x) if x != "" else 0
+    except (TypeError, ValueError):
+        return 0
+
+def is_recent_stat(stat_name):
+    return ROLLING_STAT_PATTERN.match(stat_name) is not None or stat_name.startswith(EWMA_STAT_PREFIX)
+
+def get_game_key(game_id):
+    """Integer that sorts game ids chronologically, e.g. NYA202404050 -> 202404050."""
+    return int(game_id[3:])
+
+def resize_rows(a, capacity, n_rows):
+    resized = np.zeros((capacity,) + a.shape[1:], dtype=a.dtype)
+    resized[:n_rows] = a[:n_rows]
+    return resized
+
 class PlayerMap(BaseClass):
-    def __init__(self, hitter_stat_names, pitcher_stat_names):
+    def __init__(self, hitter_stat_names, pitcher_stat_names, load_season_stats=True):
         self.hitter_stat_names = hitter_stat_names
         self.pitcher_stat_names = pitcher_stat_names
+        # False skips the statsapi season stats lookup for each new player, e.g. to only read outcomes
+        self.load_season_stats = load_season_stats
         self.hitter_map = {}
         self.pitcher_map = {}
-
+        # (hitter, pitcher) -> row of matchup_totals, one column per MATCHUP_STAT_NAMES
+        self.matchup_rows = {}
+        self.matchup_totals = np.zeros((INITIAL_CAPACITY, len(MATCHUP_STAT_NAMES)), dtype=np.int32)
+        # Built by refresh_latest_stats once all games are added
+        self.latest_hitter_stats = None
+        self.latest_pitcher_stats = None
+
+    @profiler.timed("player_map.add_hitter_game")
     def add_game_stats_for_hitter(self, player_id, game_name, new_data, opposing_pitcher_id):
         # Process new data
         if "details" not in new_data:
@@ -31,15 +93,25 @@ class PlayerMap(BaseClass):
 
         if player_id in self.hitter_map:
             # Reset counts for certain stats each season
-            if game_name[3:7] != self.hitter_map[player_id].stats.index[-1][3:7]:
+            if game_name[3:7] != self.hitter_map[player_id].get_last_game_id()[3:7]:
                 for x in ["Home Runs", "Runs Batted In", "At Bats", "Hits", "Runs Scored"]:
                     game_stats[x] = 0
-            self.hitter_map[player_id].add_game_stats(game_name, game_stats, opposing_pitcher_id)
         else:
-            p = Hitter(player_id, self.hitter_stat_names)
-            p.add_game_stats(game_name, game_stats, opposing_pitcher_id)
-            self.hitter_map[player_id] = p
-
+            self.hitter_map[player_id] = Hitter(player_id, self.hitter_stat_names, yby_data=self.get_yby_data())
+
+        # The hitter keeps the matchup totals from before this game for point-in-time lookups. The
+        # matchup row is only created once the game is added, so a duplicate game leaves no empty row
+        row = self.hitter_map[player_id].add_game_stats(game_name, game_stats, opposing_pitcher_id,
+                                                        matchup_before=self.get_matchup_stats_array(player_id, opposing_pitcher_id))
+        if row is not None:
+            matchup_row = self.get_matchup_row(player_id, opposing_pitcher_id, create=True)
+            self.matchup_totals[matchup_row] += [1,
+                                                 to_int(new_data.get("Plate Appearances", 0)),
+                                                 to_int(new_data.get("At Bats", 0)),
+                                                 to_int(new_data.get("Hits", 0)),
+                                                 count_home_runs(new_data["details"])]
+
+    @profiler.timed("player_map.add_pitcher_game")
     def add_game_stats_for_pitcher(self, player_id, game_name, new_data):
         game_stats = self.transform_pitcher_stats(new_data, player_id)
         if game_stats is None:
@@ -47,16 +119,47 @@ class PlayerMap(BaseClass):
 
         if player_id in self.pitcher_map:
             # Reset counts for certain stats each season
-            if game_name[3:7] != self.pitcher_map[player_id].stats.index[-1][3:7]:
+            if game_name[3:7] != self.pitcher_map[player_id].get_last_game_id()[3:7]:
                 for x in ["Hits", "Runs Scored", "Earned Runs", "Bases on Balls",
                           "Strikeouts", "Home Runs", "Pit", "Str", "Batters Faced"]:
                     game_stats[x] = 0
             self.pitcher_map[player_id].add_game_stats(game_name, game_stats)
         else:
-            p = Pitcher(player_id, self.pitcher_stat_names)
+            p = Pitcher(player_id, self.pitcher_stat_names, yby_data=self.get_yby_data())
             p.add_game_stats(game_name, game_stats)
             self.pitcher_map[player_id] = p
 
+    def get_yby_data(self):
+        """yby_data for a new player: None to look it up, or no seasons when season stats are not loaded."""
+        return None if self.load_season_stats else []
+
+    def get_game_home_runs(self, player_ids, game_id):
+        """Total home runs the given hitters hit in game_id."""
+        total = 0
+        for player_id in player_ids:
+            hitter = self.hitter_map.get(player_id)
+            row = None if hitter is None else hitter.get_row(game_id)
+            if row is not None:
+                total += int(hitter.game_home_runs[row])
+        return total
+
+    def get_outcomes_for_date(self, date):
+        """Returns {hitter: (did_hit_home_run, game_id)} for games on date (YYYYMMDD, like game ids).
+
+        A hitter in both games of a doubleheader counts as a home run if they hit one in either,
+        with the game id of the first game they homered in (or of the first game otherwise).
+        """
+        # Game keys are the date followed by the game number, see get_game_key
+        start, end = int(date + "0"), int(date + "9")
+        outcomes = {}
+        for player_id, hitter in self.hitter_map.items():
+            keys = hitter.game_keys[:hitter.n_rows]
+            for row in range(int(np.searchsorted(keys, start)), int(np.searchsorted(keys, end, side="right"))):
+                did_hit_home_run = bool(hitter.game_home_runs[row] > 0)
+                if player_id not in outcomes or (did_hit_home_run and not outcomes[player_id][0]):
+                    outcomes[player_id] = (did_hit_home_run, hitter.game_ids[row])
+        return outcomes
+
     def transform_pitcher_stats(self, new_data, player_id):
         game_stats = {}
         add_zeros = lambda x : x if x != "" else 0
@@ -71,8 +174,9 @@ class PlayerMap(BaseClass):
                 except KeyError:
                     self.log(f"KeyError adding stats for {player_id}", error=True)
                     return
+                game_stats["Game " + stat_name] = num
                 if player_id in self.pitcher_map:
-                    num += self.pitcher_map[player_id].stats.iloc[-1][stat_name]
+                    num += self.pitcher_map[player_id].get_last_value(stat_name)
                 game_stats[stat_name] = num
             elif stat_name == "Innings Pitched":
                 try:
@@ -80,10 +184,11 @@ class PlayerMap(BaseClass):
                 except TypeError:
                     self.log(f"TypeError adding stats for {player_id}", error=True)
                     return
+                game_stats["Game " + stat_name] = num
                 if player_id in self.pitcher_map:
-                    num += self.pitcher_map[player_id].stats.iloc[-1][stat_name]
+                    num += self.pitcher_map[player_id].get_last_value(stat_name)
                 game_stats[stat_name] = num
-            elif stat_name.startswith("Average") or stat_name in ["Games Played", "Innings Pitched Per Game"]:
+            elif stat_name.startswith("Average") or stat_name in ["Games Played", "Innings Pitched Per Game"] or is_recent_stat(stat_name):
                 pass
             elif stat_name in new_data:
                 try:
@@ -100,15 +205,10 @@ class PlayerMap(BaseClass):
         add_zeros = lambda x : x if x != "" else 0
         for stat_name in self.hitter_stat_names:
             if stat_name == "Home Runs":
-                num_hrs = 0
-                if "3·HR" in new_data["details"]:
-                    num_hrs = 3
-                elif "2·HR" in new_data["details"]:
-                    num_hrs = 2
-                elif "HR" in new_data["details"]:
-                    num_hrs = 1
+                num_hrs = count_home_runs(new_data["details"])
+                game_stats["Game Home Runs"] = num_hrs
                 if player_id in self.hitter_map:
-                    num_hrs += self.hitter_map[player_id].stats.iloc[-1]["Home Runs"]
+                    num_hrs += self.hitter_map[player_id].get_last_value("Home Runs")
                 game_stats[stat_name] = num_hrs
             elif stat_name in ["Runs Batted In", "At Bats", "Hits", "Runs Scored"]:
                 try:
@@ -116,10 +216,11 @@ class PlayerMap(BaseClass):
                 except TypeError:
                     self.log(f"TypeError adding stats for {player_id}", error=True)
                     return
+                game_stats["Game " + stat_name] = num
                 if player_id in self.hitter_map:
-                    num += self.hitter_map[player_id].stats.iloc[-1][stat_name]
+                    num += self.hitter_map[player_id].get_last_value(stat_name)
                 game_stats[stat_name] = num
-            elif stat_name.startswith("Average") or stat_name == "At Bats Per Game" or stat_name == "Games Played":
+            elif stat_name.startswith("Average") or stat_name == "At Bats Per Game" or stat_name == "Games Played" or is_recent_stat(stat_name):
                 pass
             elif stat_name == "details":
                 game_stats[stat_name] = new_data[stat_name]
@@ -133,29 +234,107 @@ class PlayerMap(BaseClass):
                 raise ValueError(f"{stat_name} not in stat data")
         return game_stats
 
+    def get_matchup_row(self, hitter_id, pitcher_id, create=False):
+        key = (hitter_id, pitcher_id)
+        if key in self.matchup_rows:
+            return self.matchup_rows[key]
+        if not create:
+            return None
+        row = len(self.matchup_rows)
+        if row == len(self.matchup_totals):
+            # trim can leave no spare rows, so never grow to less than INITIAL_CAPACITY
+            self.matchup_totals = resize_rows(self.matchup_totals, max(INITIAL_CAPACITY, 2 * row), row)
+        self.matchup_rows[key] = row
+        return row
+
+    def get_matchup_stats_array(self, hitter_id, pitcher_id):
+        """The hitter's current totals against the pitcher as an array, zeros if they have not faced each other."""
+        row = self.get_matchup_row(hitter_id, pitcher_id)
+        if row is None:
+            return np.zeros(len(MATCHUP_STAT_NAMES), dtype=self.matchup_totals.dtype)
+        return self.matchup_totals[row]
+
+    def get_matchup_stats(self, hitter_id, pitcher_id):
+        """Returns the hitter's current totals against the pitcher, all 0 if they have not faced each other."""
+        row = self.get_matchup_row(hitter_id, pitcher_id)
+        if row is None:
+            return {x : 0 for x in MATCHUP_STAT_NAMES}
+        return dict(zip(MATCHUP_STAT_NAMES, self.matchup_totals[row].tolist()))
+
+    def get_matchup_totals(self, hitter_ids, pitcher_ids):
+        """Current totals of each (hitter, pitcher) pair, one column per MATCHUP_STAT_NAMES."""
+        rows = np.array([self.matchup_rows.get(x, -1) for x in zip(hitter_ids, pitcher_ids)], dtype=np.int64)
+        totals = np.zeros((len(rows), len(MATCHUP_STAT_NAMES)), dtype=np.int32)
+        found = rows >= 0
+        totals[found] = self.matchup_totals[rows[found]]
+        return totals
+
+    def refresh_latest_stats(self, season=None):
+        """Rebuilds the latest stats tables, with "Last Season" stats from season (last year by default)."""
+        season = pd.Timestamp.now().year - 1 if season is None else season
+        self.latest_hitter_stats = LatestStatsTable(list(self.hitter_map.values()),
+                                                    get_layout(self.hitter_stat_names, Hitter.count_stats), season)
+        self.latest_pitcher_stats = LatestStatsTable(list(self.pitcher_map.values()),
+                                                     get_layout(self.pitcher_stat_names, Pitcher.count_stats), season)
+
+    def trim(self):
+        """Releases the spare rows each player over-allocated while games were being added."""
+        for p in self.hitter_map.values():
+            p.trim()
+        for p in self.pitcher_map.values():
+            p.trim()
+        self.matchup_totals = resize_rows(self.matchup_totals, len(self.matchup_rows), len(self.matchup_rows))
+
+    def get_memory_report(self):
+        """Approximate memory held by the player map, in total and per 1000 players."""
+        hitter_bytes = sum(p.get_nbytes() for p in self.hitter_map.values())
+        pitcher_bytes = sum(p.get_nbytes() for p in self.pitcher_map.values())
+        matchup_bytes = sys.getsizeof(self.matchup_rows) + sys.getsizeof(self.matchup_totals) +\
+                        sum(sys.getsizeof(x) for x in self.matchup_rows.keys())
+        total_bytes = hitter_bytes + pitcher_bytes + matchup_bytes + sys.getsizeof(self.hitter_map) + sys.getsizeof(self.pitcher_map)
+        n_players = len(self.hitter_map) + len(self.pitcher_map)
+        return {
+            "hitters": len(self.hitter_map),
+            "pitchers": len(self.pitcher_map),
+            "game_rows": sum(p.n_rows - 1 for p in self.hitter_map.values()) + sum(p.n_rows - 1 for p in self.pitcher_map.values()),
+            "hitter_bytes": hitter_bytes,
+            "pitcher_bytes": pitcher_bytes,
+            "matchups": len(self.matchup_rows),
+            "matchup_bytes": matchup_bytes,
+            "total_bytes": total_bytes,
+            "bytes_per_1k_players": round(1000 * total_bytes / n_players) if n_players > 0 else 0,
+        }
+
     def get_player_list(self):
         return list(self.hitter_map.keys())
 
     def get_hitter(self, player_id):
         if player_id in self.hitter_map:
+            profiler.count("player_map.hits")
             return self.hitter_map[player_id]
         else:
+            profiler.count("player_map.misses")
             self.log(f"Player {player_id} not found")
             return None
 
     def get_pitcher(self, player_id):
         if player_id in self.pitcher_map:
+            profiler.count("player_map.hits")
             return self.pitcher_map[player_id]
         else:
+            profiler.count("player_map.misses")
             self.log(f"Player {player_id} not found")
             return None
 
     def get_player(self, player_id):
         if player_id in self.hitter_map:
+            profiler.count("player_map.hits")
             return self.hitter_map[player_id]
         elif player_id in self.pitcher_map:
+            profiler.count("player_map.hits")
             return self.pitcher_map[player_id]
         else:
+            profiler.count("player_map.misses")
             self.log(f"Player {player_id} not found")
             return None
 
@@ -180,91 +359,327 @@ STATSAPI_KEY_MAP = {
     "Games Played": "gamesPlayed",
 }
 
-class Pitcher(BaseClass):
-    def __init__(self, player_id, stat_names):
-        """Stats must be a dictionary
-        """
+class StatLayout:
+    """Column layout shared by every player of one kind.
+
+    Counters go in one integer matrix and all other stats in one float32 matrix, so a player
+    holds two arrays however many stats are tracked.
+    """
+    __slots__ = ("input_names", "stat_names", "count_names", "rate_names", "columns",
+                 "recent_bases", "windows", "max_window", "ewmas")
+
+    def __init__(self, stat_names, count_stats):
+        self.input_names = list(stat_names)
+        self.stat_names = [x for x in stat_names if x != "details"]
+        self.count_names = [x for x in self.stat_names if x in count_stats]
+        self.rate_names = [x for x in self.stat_names if x not in count_stats]
+        # stat name -> (is counter, column)
+        self.columns = {}
+        for x in self.stat_names:
+            if x in count_stats:
+                self.columns[x] = (True, self.count_names.index(x))
+            else:
+                self.columns[x] = (False, self.rate_names.index(x))
+
+        # Per-game stats that recent form stats are computed from, and
+        # (stat name, window, base) / (stat name, base) for each recent form stat
+        self.recent_bases = []
+        self.windows = []
+        self.ewmas = []
+        for x in self.stat_names:
+            match = ROLLING_STAT_PATTERN.match(x)
+            if match is not None:
+                base_name = match.group(2)
+            elif x.startswith(EWMA_STAT_PREFIX):
+                base_name = x[len(EWMA_STAT_PREFIX):]
+            else:
+                continue
+            if base_name not in count_stats + ["Innings Pitched"] or base_name == "Games Played" or base_name not in self.stat_names:
+                raise ValueError(f"{x} needs {base_name} to be a tracked per-game counter")
+            if base_name not in self.recent_bases:
+                self.recent_bases.append(base_name)
+            if match is not None:
+                self.windows.append((x, int(match.group(1)), self.recent_bases.index(base_name)))
+            else:
+                self.ewmas.append((x, self.recent_bases.index(base_name)))
+        self.max_window = max([x[1] for x in self.windows], default=0)
+
+layouts = {}
+
+def get_layout(stat_names, count_stats):
+    key = (tuple(stat_names), tuple(count_stats))
+    if key not in layouts:
+        layouts[key] = StatLayout(stat_names, count_stats)
+    return layouts[key]
+
+class Player(BaseClass):
+    """Season-to-date stats of one player after each of their games, one array row per game.
+
+    Row 0 is the "First" row of zeros, i.e. the stats before the player's first game.
+    Games must be added in chronological order.
+    """
+    __slots__ = ("player_id", "layout", "game_ids", "game_keys", "counts", "rates", "n_rows",
+                 "season", "season_games", "season_years", "season_values",
+                 "n_games", "window_values", "window_sums", "ewma_sums", "ewma_weight")
+    stat_group = None
+    count_stats = []
+    count_dtype = np.int32
+
+    def __init__(self, player_id, stat_names, yby_data=None):
         self.player_id = player_id
-        self.stat_names = list(stat_names)
-        self.stats = pd.DataFrame({ x : [0] for x in self.stat_names }, index=["First"])
-
+        self.layout = get_layout(stat_names, self.count_stats)
+        self.game_ids = ["First"]
+        self.game_keys = np.full(INITIAL_CAPACITY, -1, dtype=np.int64)
+        self.counts = np.zeros((INITIAL_CAPACITY, len(self.layout.count_names)), dtype=self.count_dtype)
+        self.rates = np.zeros((INITIAL_CAPACITY, len(self.layout.rate_names)), dtype=np.float32)
+        self.n_rows = 1
+        self.season = None
+        self.season_games = 0
+        # Ring buffer of the last max_window per-game values, and running sums/EWMAs over it
+        self.n_games = 0
+        self.window_values = np.zeros((self.layout.max_window, len(self.layout.recent_bases)), dtype=np.float32)
+        self.window_sums = np.zeros(len(self.layout.windows))
+        self.ewma_sums = np.zeros(len(self.layout.ewmas))
+        self.ewma_weight = 0.0
+        self.set_season_stats(self.get_yby_data() if yby_data is None else yby_data)
+
+    @property
+    def stat_names(self):
+        return self.layout.input_names
+
+    @property
+    def stats(self):
+        """The per-game stats as a DataFrame indexed by game id. Built on demand, for analysis only."""
+        data = {}
+        for x, (is_count, i) in self.layout.columns.items():
+            data[x] = (self.counts if is_count else self.rates)[:self.n_rows, i]
+        return pd.DataFrame(data, index=list(self.game_ids))
+
+    def get_yby_data(self):
         # Get player year by year stats
-        player_data = statsapi.lookup_player(player_id)
+        player_id = self.player_id
+        player_data = lookup_player(player_id)
         n = 10
         if len(player_data) == 0:
             # First try removing accents
-            player_data = statsapi.lookup_player(unidecode(player_id))
+            player_data = lookup_player(unidecode(player_id))
 
         if len(player_data) == 0:
             # Try to recover player_data by querying n previous years
             c = 0
             current_year = pd.Timestamp.now().year
             while len(player_data) == 0 and c < n:
-                player_data = statsapi.lookup_player(player_id, season=current_year-c)
+                player_data = lookup_player(player_id, season=current_year-c)
                 if len(player_data) == 0:
-                    player_data = statsapi.lookup_player(unidecode(player_id), season=current_year-c)
+                    player_data = lookup_player(unidecode(player_id), season=current_year-c)
                 if len(player_data) > 0:
                     self.log(f"Recovered player data for {player_id}")
                 c += 1
 
         if len(player_data) == 0:
             self.log(f"Player data for {player_id} not found")
-            self.yby_data = []
-        else:
-            player_data = player_data[0]
-            self.yby_data = statsapi.player_stat_data(player_data["id"], group="[pitching]", type="yearByYear", sportId=1)["stats"]
+            return []
+        player_data = player_data[0]
+        return player_stat_data(player_data["id"], group=self.stat_group, type="yearByYear", sportId=1)["stats"]
+
+    def set_season_stats(self, yby_data):
+        """Keeps the parsed stats of each season instead of the raw yearByYear payload."""
+        years, values = [], []
+        for elem in yby_data:
+            season = int(elem["season"])
+            if season in years:
+                # Only the first entry of a season is used, e.g. the first team of a traded player
+                continue
+            try:
+                season_stats = self.parse_season_stats(elem["stats"])
+            except Exception as e:
+                self.log(f"Could not parse {season} stats for {self.player_id}: {e}", error=True)
+                continue
+            years.append(season)
+            # NaN marks a stat that was not parsed
+            values.append([season_stats.get(x, np.nan) for x in self.layout.stat_names])
+        self.season_years = np.array(years, dtype=np.int16)
+        self.season_values = np.array(values, dtype=np.float32).reshape(len(years), len(self.layout.stat_names))
 
     def get_season_stats(self, season):
-        input_season = str(season)
-
-        player_pitching_stats = None
-        for elem in self.yby_data:
-            if elem["season"] == input_season:
-                player_pitching_stats = elem["stats"]
-                break
-        if player_pitching_stats is None:
-            # self.log(f"Data for {input_season} not found", error=True)
+        """"Last Season " stats for every layout column, NaN where the stat was not parsed, or None without that season."""
+        matches = np.flatnonzero(self.season_years == int(season))
+        if len(matches) == 0:
+            return None
+        values = self.season_values[matches[0]].tolist()
+        return {"Last Season " + x : v for x, v in zip(self.layout.stat_names, values)}
+
+    def get_row(self, game_id):
+        """Returns the row for game_id, or None if the player did not play in it."""
+        if game_id == "First":
+            return 0
+        key = get_game_key(game_id)
+        keys = self.game_keys[:self.n_rows]
+        i = int(np.searchsorted(keys, key))
+        while i < self.n_rows and keys[i] == key:
+            if self.game_ids[i] == game_id:
+                return i
+            i += 1
+        return None
+
+    def get_row_stats(self, row):
+        counts = self.counts[row].tolist()
+        rates = self.rates[row].tolist()
+        return {x : counts[i] if is_count else rates[i] for x, (is_count, i) in self.layout.columns.items()}
+
+    def get_last_value(self, stat_name):
+        is_count, i = self.layout.columns[stat_name]
+        return (self.counts if is_count else self.rates)[self.n_rows - 1, i].item()
+
+    def get_last_game_id(self):
+        return self.game_ids[-1]
+
+    def count_season_game(self, game_id):
+        """Returns the number of games played this season, including game_id."""
+        season = game_id[3:7]
+        if season != self.season:
+            self.season = season
+            self.season_games = 0
+        self.season_games += 1
+        return self.season_games
+
+    def update_recent_stats(self, new_data):
+        """Adds one game to the rolling windows and EWMAs in O(1) and sets their values in new_data."""
+        layout = self.layout
+        game_values = [new_data["Game " + x] for x in layout.recent_bases]
+        for j, (stat, window, base) in enumerate(layout.windows):
+            self.window_sums[j] += game_values[base]
+            if self.n_games >= window:
+                # Drop the game that just left this window
+                self.window_sums[j] -= self.window_values[(self.n_games - window) % layout.max_window, base]
+            new_data[stat] = self.window_sums[j]
+        if layout.max_window > 0:
+            self.window_values[self.n_games % layout.max_window] = game_values
+
+        if len(layout.ewmas) > 0:
+            decay = 0.5 ** (1 / EWMA_HALF_LIFE_GAMES)
+            self.ewma_weight = decay * self.ewma_weight + 1
+            for j, (stat, base) in enumerate(layout.ewmas):
+                self.ewma_sums[j] = decay * self.ewma_sums[j] + game_values[base]
+                new_data[stat] = self.ewma_sums[j] / self.ewma_weight
+        self.n_games += 1
+
+    def append_row(self, game_id, new_data):
+        key = get_game_key(game_id)
+        if key < self.game_keys[self.n_rows - 1]:
+            raise ValueError(f"{game_id} added after {self.game_ids[-1]} for {self.player_id}")
+        if self.n_rows == len(self.game_keys):
+            self.resize(2 * self.n_rows)
+        if len(self.layout.recent_bases) > 0:
+            self.update_recent_stats(new_data)
+        row = self.n_rows
+        self.game_keys[row] = key
+        self.counts[row] = [new_data[x] for x in self.layout.count_names]
+        self.rates[row] = [new_data[x] for x in self.layout.rate_names]
+        self.game_ids.append(game_id)
+        self.n_rows += 1
+        return row
+
+    def resize(self, capacity):
+        self.game_keys = resize_rows(self.game_keys, capacity, self.n_rows)
+        self.counts = resize_rows(self.counts, capacity, self.n_rows)
+        self.rates = resize_rows(self.rates, capacity, self.n_rows)
+
+    def trim(self):
+        if self.n_rows < len(self.game_keys):
+            self.resize(self.n_rows)
+
+    def get_nbytes(self):
+        """Approximate bytes held by this player. Game id strings are shared with other players and not counted."""
+        arrays = [self.game_keys, self.counts, self.rates, self.season_years, self.season_values,
+                  self.window_values, self.window_sums, self.ewma_sums]
+        return sys.getsizeof(self) + sys.getsizeof(self.game_ids) + sum(sys.getsizeof(x) for x in arrays)
+
+    def add_last_season_stats(self, stats, season):
+        last_season_stats = self.get_season_stats(season)
+        if last_season_stats is None:
+            last_season_stats = {"Last Season " + x : stats[x] for x in stats.keys()}
+        stats.update(last_season_stats)
+        return stats
+
+    def get_stats_before_game(self, game_id, game_date, num_games_threshold=0, include_last_season_data=True):
+        stats = self.get_stats_dict_before_game(game_id, game_date, num_games_threshold=num_games_threshold,
+                                                include_last_season_data=include_last_season_data)
+        if stats is None:
             return None
+        return pd.Series(stats, dtype=object)
+
+    def get_stats_dict_before_game(self, game_id, game_date, num_games_threshold=0, include_last_season_data=True):
+        """Like get_stats_before_game, as a plain dict."""
+        row = self.get_row(game_id)
+        if row is None or row == 0:
+            return None
+        stats = self.get_row_stats(row - 1)
+        if "Games Played" in stats and int(stats["Games Played"]) < num_games_threshold:
+            return None
+
+        if include_last_season_data:
+            stats = self.add_last_season_stats(stats, game_date.year - 1)
+        stats.update(self.get_game_stats(row))
+        return stats
+
+    def get_game_stats(self, row):
+        """Stats known before the game in row that are specific to that game."""
+        return {}
 
+    def get_latest_stats(self, include_last_season_data=True):
+        stats = self.get_row_stats(self.n_rows - 1)
+        if include_last_season_data:
+            stats = self.add_last_season_stats(stats, pd.Timestamp.now().year - 1)
+        return pd.Series(stats, dtype=object)
+
+class Pitcher(Player):
+    __slots__ = ()
+    stat_group = "[pitching]"
+    count_stats = PITCHER_COUNT_STATS
+    count_dtype = np.int32
+
+    @profiler.timed("pitcher.init")
+    def __init__(self, player_id, stat_names, yby_data=None):
+        super().__init__(player_id, stat_names, yby_data=yby_data)
+
+    def parse_season_stats(self, player_pitching_stats):
         ret = {}
-        prefix_string = "Last Season "
         key_map = STATSAPI_KEY_MAP
         innings_pitched = convert_innings_pitched(player_pitching_stats["inningsPitched"])
         for stat in self.stat_names:
             try:
                 if stat in key_map.keys():
                     if stat == "Innings Pitched":
-                        ret[prefix_string + stat] = innings_pitched
+                        ret[stat] = innings_pitched
                     else:
-                        ret[prefix_string + stat] = float(player_pitching_stats[key_map[stat]])
+                        ret[stat] = float(player_pitching_stats[key_map[stat]])
                 elif stat.startswith("Average") and " ".join(stat.split(" ")[1:]) in key_map.keys():
                     average_over = "battersFaced"
                     if int(player_pitching_stats[average_over]) == 0:
-                        ret[prefix_string + stat] = 0
+                        ret[stat] = 0
                     else:
-                        ret[prefix_string + stat] = float(player_pitching_stats[key_map[" ".join(stat.split(" ")[1:])]]) / float(player_pitching_stats[average_over])
+                        ret[stat] = float(player_pitching_stats[key_map[" ".join(stat.split(" ")[1:])]]) / float(player_pitching_stats[average_over])
                 elif stat == "Innings Pitched Per Game":
                     if int(player_pitching_stats["gamesPlayed"]) == 0:
-                        ret[prefix_string + stat] = 0
+                        ret[stat] = 0
                     else:
-                        ret[prefix_string + stat] = float(innings_pitched) / float(player_pitching_stats["gamesPlayed"])
-                elif stat == "details" or stat == "Games Played":
+                        ret[stat] = float(innings_pitched) / float(player_pitching_stats["gamesPlayed"])
+                elif stat == "details" or stat == "Games Played" or is_recent_stat(stat):
                     continue
                 else:
                     self.log(f"Stat {stat} not supported", error=True)
             except Exception as e:
                 self.log(e, error=True)
                 self.log(f"Setting {stat} to 0")
-                ret[prefix_string + stat] = 0
+                ret[stat] = 0
 
         return ret
 
     def add_game_stats(self, game_id, new_data):
-        if game_id in self.stats.index:
+        if self.get_row(game_id) is not None:
             return
-        season = game_id[3:7]
-        season_mask = [x[3:7] == season for x in list(self.stats.index)]
-        games_played = np.sum(season_mask) + 1
+        games_played = self.count_season_game(game_id)
         denom = new_data["Batters Faced"]
         for stat in self.stat_names:
             if stat.startswith("Average"):
@@ -276,113 +691,53 @@ class Pitcher(BaseClass):
                 new_data[stat] = new_data["Innings Pitched"] / games_played
             elif stat == "Games Played":
                 new_data[stat] = games_played
-        self.stats = pd.concat([ self.stats, pd.DataFrame(new_data, index=[game_id]) ])
-
-    def get_stats_before_game(self, game_id, game_date, num_games_threshold=0, include_last_season_data=True):
-        i = self.stats.index.get_indexer([game_id])[0]
-        stats = self.stats.iloc[i - 1]
-        if "Games Played" in stats and int(stats["Games Played"]) < num_games_threshold:
-            return None
-
-        if include_last_season_data:
-            last_season_stats = self.get_season_stats(game_date.year - 1)
-            if last_season_stats is None:
-                last_season_stats = {"Last Season " + x : stats[x] for x in stats.keys()}
-            stats = dict(stats)
-            stats.update(last_season_stats)
-            stats = pd.Series(stats)
-
-        return stats
-
-    def get_latest_stats(self, include_last_season_data=True):
-        stats = self.stats.iloc[-1]
-        if include_last_season_data:
-            last_season_stats = self.get_season_stats(pd.Timestamp.now().year - 1)
-            if last_season_stats is None:
-                last_season_stats = {"Last Season " + x : stats[x] for x in stats.keys()}
-            stats = dict(stats)
-            stats.update(last_season_stats)
-            stats = pd.Series(stats)
-        return stats
-
-
-class Hitter(BaseClass):
-    def __init__(self, player_id, stat_names):
-        """Stats must be a dictionary
-        """
-        self.player_id = player_id
-        self.stat_names = list(stat_names)
-        self.stats = pd.DataFrame({ x : [0] for x in self.stat_names }, index=["First"])
-        self.game_id_to_pitcher_id_dict = {}
+        self.append_row(game_id, new_data)
 
-        # Get player year by year stats
-        player_data = statsapi.lookup_player(player_id)
-        n = 10
-        if len(player_data) == 0:
-            # First try removing accents
-            player_data = statsapi.lookup_player(unidecode(player_id))
-
-        if len(player_data) == 0:
-            # Try to recover player_data by querying n previous years
-            c = 0
-            current_year = pd.Timestamp.now().year
-            while len(player_data) == 0 and c < n:
-                player_data = statsapi.lookup_player(player_id, season=current_year-c)
-                if len(player_data) == 0:
-                    player_data = statsapi.lookup_player(unidecode(player_id), season=current_year-c)
-                if len(player_data) > 0:
-                    self.log(f"Recovered player data for {player_id}")
-                c += 1
 
-        if len(player_data) == 0:
-            self.log(f"Player data for {player_id} not found")
-            self.yby_data = []
-        else:
-            player_data = player_data[0]
-            self.yby_data = statsapi.player_stat_data(player_data["id"], group="[hitting]", type="yearByYear", sportId=1)["stats"]
+class Hitter(Player):
+    __slots__ = ("game_home_runs", "pitcher_ids", "matchup_before")
+    stat_group = "[hitting]"
+    count_stats = HITTER_COUNT_STATS
+    count_dtype = np.int16
 
-    def get_season_stats(self, season):
-        input_season = str(season)
-
-        player_hitting_stats = None
-        for elem in self.yby_data:
-            if elem["season"] == input_season:
-                player_hitting_stats = elem["stats"]
-                break
-        if player_hitting_stats is None:
-            # self.log(f"Data for {input_season} not found", error=True)
-            return None
+    @profiler.timed("hitter.init")
+    def __init__(self, player_id, stat_names, yby_data=None):
+        # Home runs hit in each game, the only fact kept from the box score details
+        self.game_home_runs = np.zeros(INITIAL_CAPACITY, dtype=np.int8)
+        self.pitcher_ids = [None]
+        # Totals against each game's opposing pitcher before the game, one column per MATCHUP_STAT_NAMES
+        self.matchup_before = np.zeros((INITIAL_CAPACITY, len(MATCHUP_STAT_NAMES)), dtype=np.int16)
+        super().__init__(player_id, stat_names, yby_data=yby_data)
 
+    def parse_season_stats(self, player_hitting_stats):
         ret = {}
-        prefix_string = "Last Season "
         key_map = STATSAPI_KEY_MAP
         for stat in self.stat_names:
             if stat in key_map.keys():
-                ret[prefix_string + stat] = float(player_hitting_stats[key_map[stat]])
+                ret[stat] = float(player_hitting_stats[key_map[stat]])
             elif stat.startswith("Average") and " ".join(stat.split(" ")[1:]) in key_map.keys():
                 average_over = "gamesPlayed"
                 if int(player_hitting_stats[average_over]) == 0:
-                    ret[prefix_string + stat] = 0
+                    ret[stat] = 0
                 else:
-                    ret[prefix_string + stat] = float(player_hitting_stats[key_map[" ".join(stat.split(" ")[1:])]]) / float(player_hitting_stats[average_over])
+                    ret[stat] = float(player_hitting_stats[key_map[" ".join(stat.split(" ")[1:])]]) / float(player_hitting_stats[average_over])
             elif stat == "At Bats Per Game":
                 if int(player_hitting_stats["gamesPlayed"]) == 0:
-                    ret[prefix_string + stat] = 0
+                    ret[stat] = 0
                 else:
-                    ret[prefix_string + stat] = float(player_hitting_stats["atBats"]) / float(player_hitting_stats["gamesPlayed"])
-            elif stat == "details" or stat == "Games Played":
+                    ret[stat] = float(player_hitting_stats["atBats"]) / float(player_hitting_stats["gamesPlayed"])
+            elif stat == "details" or stat == "Games Played" or is_recent_stat(stat):
                 continue
             else:
                 self.log(f"Stat {stat} not supported", error=True)
 
         return ret
 
-    def add_game_stats(self, game_id, new_data, opposing_pitcher_id):
-        if game_id in self.stats.index:
-            return
-        season = game_id[3:7]
-        season_mask = [x[3:7] == season for x in list(self.stats.index)]
-        games_played = np.sum(season_mask) + 1
+    def add_game_stats(self, game_id, new_data, opposing_pitcher_id, matchup_before=None):
+        """Returns the new row, or None if the game was already added."""
+        if self.get_row(game_id) is not None:
+            return None
+        games_played = self.count_season_game(game_id)
         for stat in self.stat_names:
             if stat.startswith("Average"):
                 if games_played == 0:
@@ -393,57 +748,93 @@ class Hitter(BaseClass):
                 new_data[stat] = new_data["At Bats"] / games_played
             elif stat == "Games Played":
                 new_data[stat] = games_played
-        self.stats = pd.concat([ self.stats, pd.DataFrame(new_data, index=[game_id]) ])
-        self.game_id_to_pitcher_id_dict[game_id] = opposing_pitcher_id
+        row = self.append_row(game_id, new_data)
+        if "details" in new_data:
+            self.game_home_runs[row] = count_home_runs(new_data["details"])
+        if matchup_before is not None:
+            self.matchup_before[row] = matchup_before
+        self.pitcher_ids.append(opposing_pitcher_id)
+        return row
+
+    def resize(self, capacity):
+        super().resize(capacity)
+        self.game_home_runs = resize_rows(self.game_home_runs, capacity, self.n_rows)
+        self.matchup_before = resize_rows(self.matchup_before, capacity, self.n_rows)
+
+    def get_nbytes(self):
+        return super().get_nbytes() + sys.getsizeof(self.game_home_runs) + sys.getsizeof(self.pitcher_ids) +\
+               sys.getsizeof(self.matchup_before)
+
+    def get_game_stats(self, row):
+        # Against this game's opposing pitcher, so read from the game's own row
+        return dict(zip(MATCHUP_STAT_NAMES, self.matchup_before[row].tolist()))
 
     def get_pitcher_id_for_game(self, game_id):
-        if game_id not in self.game_id_to_pitcher_id_dict:
+        row = self.get_row(game_id)
+        if row is None or row == 0:
             self.log(f"{game_id} not found for {self.player_id}, skipping", error=True)
             return None
-        return self.game_id_to_pitcher_id_dict[game_id]
-
-    def get_stats_before_game(self, game_id, game_date, num_games_threshold=0, include_last_season_data=True):
-        u, c = np.unique(self.stats.index, return_counts=True)
-        dups = u[c > 1]
-        if len(dups) > 0:
-            dup = dups[0]
-            i = 0
-            print(self.player_id, game_id)
-            for i, x in enumerate(self.stats.index):
-                if x == dup:
-                    print(self.stats.iloc[i])
-        i = self.stats.index.get_indexer([game_id])[0]
-        hitting_stats = self.stats.iloc[i - 1]
-        if "Games Played" in hitting_stats and int(hitting_stats["Games Played"]) < num_games_threshold:
-            return None
-
-        if include_last_season_data:
-            last_season_stats = self.get_season_stats(game_date.year - 1)
-            if last_season_stats is None:
-                last_season_stats = {"Last Season " + x : hitting_stats[x] for x in hitting_stats.keys()}
-            hitting_stats = dict(hitting_stats)
-            hitting_stats.update(last_season_stats)
-            hitting_stats = pd.Series(hitting_stats)
-
-        return hitting_stats
+        return self.pitcher_ids[row]
 
     def did_hit_home_run(self, game_id):
         if game_id == "First":
             return False
         if "details" not in self.stat_names:
             raise BaseException("\"details\" not in stat_names. Cannot get HR data")
-        if self.stats.index.get_indexer([game_id])[0] == -1:
+        row = self.get_row(game_id)
+        if row is None:
             return None
-        return "HR" in self.stats.iloc[self.stats.index.get_indexer([game_id])[0]]["details"]
-
-    def get_latest_stats(self, include_last_season_data=True):
-        hitting_stats = self.stats.iloc[-1]
-        if include_last_season_data:
-            last_season_stats = self.get_season_stats(pd.Timestamp.now().year - 1)
-            if last_season_stats is None:
-                last_season_stats = {"Last Season " + x : hitting_stats[x] for x in hitting_stats.keys()}
-            hitting_stats = dict(hitting_stats)
-            hitting_stats.update(last_season_stats)
-            hitting_stats = pd.Series(hitting_stats)
-        return hitting_stats
+        return bool(self.game_home_runs[row] > 0)
+
+class LatestStatsTable:
+    """Latest stats of every player of one kind, one row per player, so a whole slate can be looked up at once.
+
+    Columns are the layout's stats followed by their "Last Season " versions, in the order of
+    Player.get_latest_stats. Last season stats that were not parsed are NaN.
+    """
+    __slots__ = ("player_rows", "stat_names", "count_names", "columns", "values")
+
+    def __init__(self, players, layout, season):
+        self.player_rows = {p.player_id : i for i, p in enumerate(players)}
+        self.stat_names = layout.stat_names
+        self.count_names = layout.count_names
+        self.columns = self.stat_names + ["Last Season " + x for x in self.stat_names]
+        n_stats = len(self.stat_names)
+        self.values = np.full((len(players), 2 * n_stats), np.nan)
+        if len(players) == 0:
+            return
 
+        counts = np.array([p.counts[p.n_rows - 1] for p in players], dtype=np.float64).reshape(len(players), -1)
+        rates = np.array([p.rates[p.n_rows - 1] for p in players], dtype=np.float64).reshape(len(players), -1)
+        for x, (is_count, i) in layout.columns.items():
+            self.values[:, self.stat_names.index(x)] = counts[:, i] if is_count else rates[:, i]
+        for j, p in enumerate(players):
+            matches = np.flatnonzero(p.season_years == season)
+            if len(matches) > 0:
+                self.values[j, n_stats:] = p.season_values[matches[0]]
+            else:
+                self.values[j, n_stats:] = self.values[j, :n_stats]
+
+    @classmethod
+    def from_values(cls, player_rows, stat_names, count_names, values):
+        """A table over existing values, e.g. a read-only view of a file published by map_server."""
+        table = cls.__new__(cls)
+        table.player_rows = player_rows
+        table.stat_names = stat_names
+        table.count_names = count_names
+        table.columns = stat_names + ["Last Season " + x for x in stat_names]
+        table.values = values
+        return table
+
+    def get_rows(self, player_ids):
+        """Row of each player, -1 for players not in the table."""
+        return np.array([self.player_rows.get(x, -1) for x in player_ids], dtype=np.int64)
+
+    def get_frame(self, rows, include_last_season_data=True, prefix=""):
+        """DataFrame of rows with counters as integers, column names prefixed with prefix."""
+        n_columns = len(self.columns) if include_last_season_data else len(self.stat_names)
+        values = self.values[rows]
+        data = {}
+        for i, x in enumerate(self.columns[:n_columns]):
+            data[prefix + x] = values[:, i].astype(np.int64) if x in self.count_names else values[:, i]
+        return pd.DataFrame(data)
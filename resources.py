@@ -0,0 +1,59 @@
+"""Process-wide Mongo client and HTTP sessions, created on first use and shared by every module."""
+import os
+from urllib.parse import urlparse
+
+MONGO_MAX_POOL_SIZE = 10
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 10000
+MONGO_CONNECT_TIMEOUT_MS = 10000
+MONGO_SOCKET_TIMEOUT_MS = 60000
+MONGO_MAX_IDLE_TIME_MS = 60000
+
+HTTP_TIMEOUT_SECONDS = 30
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 2
+HTTP_RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Baseball Reference blocks clients that go over 20 requests/min for an hour, so the session does
+# not retry there and the scraper retries in its own paced loop
+HOST_RETRIES = {
+    "www.baseball-reference.com": 0,
+}
+
+mongo_client = None
+sessions = {}
+
+def get_mongo_client():
+    global mongo_client
+    if mongo_client is None:
+        from pymongo import MongoClient
+        mongo_client = MongoClient(os.getenv("MONGO_URL"),
+                                   maxPoolSize=MONGO_MAX_POOL_SIZE,
+                                   serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                   connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                                   socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                                   maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                                   retryWrites=True)
+    return mongo_client
+
+def get_session(host):
+    """Keep-alive session for host (e.g. "api.the-odds-api.com"), retrying connection errors, 429s and 5xx with backoff."""
+    if host not in sessions:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=HOST_RETRIES.get(host, HTTP_RETRIES),
+                      backoff_factor=HTTP_BACKOFF_FACTOR,
+                      status_forcelist=HTTP_RETRY_STATUSES,
+                      allowed_methods=["GET"],
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        sessions[host] = session
+    return sessions[host]
+
+def get_session_for_url(url):
+    return get_session(urlparse(url).netloc)
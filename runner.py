@@ -7,15 +7,37 @@ import numpy as np
 
 sys.path.append("utils")
 from base_class import BaseClass
-from player import PlayerMap
+from profiler import profiler
+from player import PlayerMap, MATCHUP_STAT_NAMES
+from park_factors import ParkFactorTable, PARK_FACTOR_STAT_NAME
 from game import Game
 
+def get_latest_stats_for_slate(player_map, park_factors, player_ids, pitcher_ids, venues, include_last_season_data=True):
+    """Runner.get_latest_stats_for_slate over anything with a PlayerMap's latest stats tables and
+    get_matchup_totals, and a ParkFactorTable's get_latest_factor (e.g. map_server.SharedMapTables).
+    """
+    hitter_rows = player_map.latest_hitter_stats.get_rows(player_ids)
+    pitcher_rows = player_map.latest_pitcher_stats.get_rows(pitcher_ids)
+    found = np.flatnonzero((hitter_rows >= 0) & (pitcher_rows >= 0))
+
+    matchup_totals = player_map.get_matchup_totals([player_ids[i] for i in found], [pitcher_ids[i] for i in found])
+    stats = pd.concat([
+        player_map.latest_hitter_stats.get_frame(hitter_rows[found], include_last_season_data=include_last_season_data),
+        pd.DataFrame(matchup_totals, columns=MATCHUP_STAT_NAMES),
+        player_map.latest_pitcher_stats.get_frame(pitcher_rows[found], include_last_season_data=include_last_season_data,
+                                                  prefix="Opposing Pitcher "),
+    ], axis=1)
+    stats[PARK_FACTOR_STAT_NAME] = [park_factors.get_latest_factor(venues[i]) for i in found]
+    stats.index = found
+    return stats
+
 class Runner(BaseClass):
     def __init__(self, stat_names, pitcher_stat_names, data_dir="./data/game_data"):
         self.data_dir = data_dir
         self.stat_names = stat_names
         self.pitcher_stat_names = pitcher_stat_names
         self.player_map = PlayerMap(self.stat_names, self.pitcher_stat_names)
+        self.park_factors = ParkFactorTable()
 
     def get_games(self):
         return sorted([x.split("/")[-1][:-5] for x in glob.glob(os.path.join(self.data_dir, "*"))], key=lambda x : int(x[3:]))
@@ -27,36 +49,63 @@ class Runner(BaseClass):
             game.load(filename)
         return game
 
+    def get_game_filenames(self):
+        return sorted(glob.glob(os.path.join(self.data_dir, "*")), key=lambda x : int(x.split("/")[-1][3:-5]))
+
+    @profiler.timed("runner.build_player_map")
     def build_player_map_for_all_games(self, n=None):
         self.log("Simulating games")
 
         # Reset player map
         self.player_map = PlayerMap(self.stat_names, self.pitcher_stat_names)
+        self.park_factors = ParkFactorTable()
 
-        filenames = sorted(glob.glob(os.path.join(self.data_dir, "*")), key=lambda x : int(x.split("/")[-1][3:-5]))
+        filenames = self.get_game_filenames()
         if n is not None:
             filenames = filenames[:n]
         for filename in filenames:
-            with open(filename, "r") as f:
-                game = Game()
-                game.load(filename)
+            self.add_game_file(filename)
+        self.finish_build()
+
+    @profiler.timed("runner.build_player_map")
+    def build_player_map_for_dates(self, start_date=None, end_date=None):
+        """Adds the games from start_date to end_date (YYYYMMDD, inclusive) to the current map, e.g. one loaded from a snapshot."""
+        self.log(f"Simulating games from {start_date} to {end_date}")
+        for filename in self.get_game_filenames():
+            date = os.path.basename(filename)[3:11]
+            if (start_date is None or date >= start_date) and (end_date is None or date <= end_date):
+                self.add_game_file(filename)
+        self.finish_build()
+
+    def add_game_file(self, filename):
+        with open(filename, "r") as f:
+            game = Game()
+            game.load(filename)
 
-            self.log(f"{game.date.strftime('%m/%d/%y')} {game.home_team} vs. {game.away_team}")
+        self.log(f"{game.date.strftime('%m/%d/%y')} {game.home_team} vs. {game.away_team}")
 
+        with profiler.stage("runner.parse_game"):
             hitter_stats = game.get_hitter_stats_from_raw_data()
             home_hitter_stats = game.get_home_hitter_stats()
             away_hitter_stats = game.get_away_hitter_stats()
             home_pitcher_stats = game.get_home_pitcher_stats()
             away_pitcher_stats = game.get_away_pitcher_stats()
-            self.player_map.add_game_stats_for_pitcher(game.get_home_pitcher(), game.id, home_pitcher_stats)
-            self.player_map.add_game_stats_for_pitcher(game.get_away_pitcher(), game.id, away_pitcher_stats)
-            if hitter_stats is None:
-                continue
-            else:
-                for hitter in home_hitter_stats:
-                    self.player_map.add_game_stats_for_hitter(hitter, game.id, home_hitter_stats[hitter], game.get_away_pitcher())
-                for hitter in away_hitter_stats:
-                    self.player_map.add_game_stats_for_hitter(hitter, game.id, away_hitter_stats[hitter], game.get_home_pitcher())
+        profiler.count("runner.games")
+        self.player_map.add_game_stats_for_pitcher(game.get_home_pitcher(), game.id, home_pitcher_stats)
+        self.player_map.add_game_stats_for_pitcher(game.get_away_pitcher(), game.id, away_pitcher_stats)
+        if hitter_stats is None:
+            return
+        for hitter in home_hitter_stats:
+            self.player_map.add_game_stats_for_hitter(hitter, game.id, home_hitter_stats[hitter], game.get_away_pitcher())
+        for hitter in away_hitter_stats:
+            self.player_map.add_game_stats_for_hitter(hitter, game.id, away_hitter_stats[hitter], game.get_home_pitcher())
+        self.park_factors.add_game(game.id, game.venue, self.player_map.get_game_home_runs(hitter_stats, game.id))
+
+    def finish_build(self):
+        self.player_map.trim()
+        self.player_map.refresh_latest_stats()
+        memory_report = self.player_map.get_memory_report()
+        self.log(f"Player map holds {memory_report['total_bytes'] / 1e6:.1f} MB, {memory_report['bytes_per_1k_players'] / 1e6:.2f} MB per 1k players")
 
     def get_player_list(self):
         return self.player_map.get_player_list()
@@ -64,35 +113,51 @@ class Runner(BaseClass):
     def get_player(self, player_id):
         return self.player_map.get_player(player_id)
 
+    @profiler.timed("runner.get_stats_before_game")
     def get_stats_for_player_before_game(self, player_id, game_id, game_date, hitter_games_threshold=20,
                                          pitcher_games_threshold=1, include_last_season_data=True):
+        stats = self.get_stats_dict_for_player_before_game(player_id, game_id, game_date,
+                                                           hitter_games_threshold=hitter_games_threshold,
+                                                           pitcher_games_threshold=pitcher_games_threshold,
+                                                           include_last_season_data=include_last_season_data)
+        if stats is None:
+            return None
+        return pd.Series(stats, dtype=object)
+
+    def get_stats_dict_for_player_before_game(self, player_id, game_id, game_date, hitter_games_threshold=20,
+                                              pitcher_games_threshold=1, include_last_season_data=True):
+        """Like get_stats_for_player_before_game, as a plain dict, without building any pandas objects."""
         player = self.player_map.get_hitter(player_id)
-        player_stats = player.get_stats_before_game(game_id,
-                                                    game_date,
-                                                    num_games_threshold=hitter_games_threshold,
-                                                    include_last_season_data=include_last_season_data)
+        player_stats = player.get_stats_dict_before_game(game_id,
+                                                         game_date,
+                                                         num_games_threshold=hitter_games_threshold,
+                                                         include_last_season_data=include_last_season_data)
         if player_stats is None:
             return None
         pitcher_id = player.get_pitcher_id_for_game(game_id)
         if pitcher_id is None:
             return None
         pitcher = self.player_map.get_pitcher(pitcher_id)
-        pitcher_stats = pitcher.get_stats_before_game(game_id,
-                                                      game_date,
-                                                      num_games_threshold=pitcher_games_threshold,
-                                                      include_last_season_data=include_last_season_data)
+        pitcher_stats = pitcher.get_stats_dict_before_game(game_id,
+                                                           game_date,
+                                                           num_games_threshold=pitcher_games_threshold,
+                                                           include_last_season_data=include_last_season_data)
         if pitcher_stats is None:
             return None
-        pitcher_stats = pitcher_stats.rename({ x : "Opposing Pitcher " + x for x in pitcher_stats.index })
-        return pd.concat([player_stats, pitcher_stats])
+        stats = player_stats
+        stats.update({"Opposing Pitcher " + x : v for x, v in pitcher_stats.items()})
+        stats[PARK_FACTOR_STAT_NAME] = self.park_factors.get_factor_before_game(game_id)
+        return stats
 
-    def get_latest_stats_for_player_and_pitcher(self, player_id, pitcher_id, include_last_season_data=True):
+    @profiler.timed("runner.get_latest_stats")
+    def get_latest_stats_for_player_and_pitcher(self, player_id, pitcher_id, include_last_season_data=True, venue=None):
         player = self.player_map.get_hitter(player_id)
         if player is None:
             return None
         player_stats = player.get_latest_stats(include_last_season_data=include_last_season_data)
         if player_stats is None:
             return None
+        matchup_stats = pd.Series(self.player_map.get_matchup_stats(player_id, pitcher_id), dtype=object)
         pitcher = self.player_map.get_pitcher(pitcher_id)
         if pitcher is None:
             return None
@@ -100,5 +165,19 @@ class Runner(BaseClass):
         if pitcher_stats is None:
             return None
         pitcher_stats = pitcher_stats.rename({ x : "Opposing Pitcher " + x for x in pitcher_stats.index })
-        return pd.concat([player_stats, pitcher_stats])
+        stats = pd.concat([player_stats, matchup_stats, pitcher_stats])
+        stats[PARK_FACTOR_STAT_NAME] = self.park_factors.get_latest_factor(venue)
+        return stats
+
+
+    @profiler.timed("runner.get_latest_stats_for_slate")
+    def get_latest_stats_for_slate(self, player_ids, pitcher_ids, venues, include_last_season_data=True):
+        """Latest stats for every (player, pitcher, venue) at once, as one DataFrame.
 
+        Columns match get_latest_stats_for_player_and_pitcher. Rows whose hitter or pitcher is not
+        in the player map are left out; the index is the position in the inputs.
+        """
+        if self.player_map.latest_hitter_stats is None:
+            self.player_map.refresh_latest_stats()
+        return get_latest_stats_for_slate(self.player_map, self.park_factors, player_ids, pitcher_ids, venues,
+                                          include_last_season_data=include_last_season_data)
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+
+sys.path.append("utils")
+from base_class import BaseClass
+from profiler import profiler
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    player_name TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    date TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (player_name, game_id, model)
+);
+CREATE INDEX IF NOT EXISTS scores_model_date ON scores (model, date);
+"""
+# Hashes of an update file's items, kept next to it until --push_to_db has written them
+STAGED_SUFFIX = ".ledger.json"
+
+def get_staged_path(output_file):
+    return output_file + STAGED_SUFFIX
+
+def get_row_hash(model_version, features, item):
+    """Hash of everything an item is computed from: the model, the feature vector and the other item fields."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_version.encode())
+    h.update(features.astype("<f8").tobytes())
+    h.update(json.dumps({k : v for k, v in item.items() if k != "home_run_odds"}, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+class ScoreLedger(BaseClass):
+    """Hash of the inputs of every (player, game, model) item already emitted, kept in SQLite.
+
+    Re-scoring a date range only emits items whose hash changed, e.g. after a model change or a
+    corrected box score. Hashes are staged and only written by commit(), which the caller runs
+    once the items are in the database. When they go to an update file instead, stage() saves them
+    next to it and commit_staged() records them after the file is pushed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.pending = []
+        self.n_unchanged = 0
+        # model -> {(player_name, game_id): row_hash} for the date range being scored
+        self.known = {}
+
+    def close(self):
+        self.conn.close()
+
+    def load(self, model, start_date, end_date):
+        """Loads the hashes of model's items from start_date to end_date (YYYY-MM-DD, like item dates)."""
+        rows = self.conn.execute("SELECT player_name, game_id, row_hash FROM scores WHERE model = ? AND date >= ? AND date <= ?",
+                                 (model, start_date, end_date)).fetchall()
+        self.known[model] = {(x[0], x[1]) : x[2] for x in rows}
+
+    def is_unchanged(self, item, row_hash):
+        known = self.known.get(item["model"], {})
+        if known.get((item["player_name"], item["game_id"])) == row_hash:
+            profiler.count("score_ledger.unchanged")
+            self.n_unchanged += 1
+            return True
+        profiler.count("score_ledger.changed")
+        return False
+
+    def add(self, item, row_hash):
+        self.pending.append((item["player_name"], item["game_id"], item["model"], item["date"], row_hash))
+
+    def commit(self):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO scores (player_name, game_id, model, date, row_hash) VALUES (?, ?, ?, ?, ?)",
+                                  self.pending)
+        self.log(f"Ledger: {len(self.pending)} new or changed items, {self.n_unchanged} unchanged items skipped")
+        self.pending = []
+        self.n_unchanged = 0
+
+    def stage(self, output_file):
+        """Saves the pending hashes next to output_file, for commit_staged once it is pushed."""
+        staged_path = get_staged_path(output_file)
+        with open(staged_path, "w") as f:
+            json.dump({"ledger_path": os.path.abspath(self.path), "rows": self.pending}, f)
+        self.log(f"Ledger: {len(self.pending)} new or changed items staged in {staged_path}, {self.n_unchanged} unchanged items skipped")
+        self.pending = []
+        self.n_unchanged = 0
+
+def commit_staged(output_file):
+    """Records the hashes staged for output_file in their ledger and removes them; returns the number of rows."""
+    staged_path = get_staged_path(output_file)
+    if not os.path.exists(staged_path):
+        return 0
+    with open(staged_path, "r") as f:
+        staged = json.load(f)
+    ledger = ScoreLedger(staged["ledger_path"])
+    ledger.pending = [tuple(x) for x in staged["rows"]]
+    ledger.commit()
+    ledger.close()
+    os.remove(staged_path)
+    return len(staged["rows"])
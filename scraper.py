@@ -1,28 +1,42 @@
 import sys
 import os
 import time
-import requests
 import warnings
 import datetime
 import pandas as pd
 import numpy as np
+import requests
 
 from bs4 import BeautifulSoup, Comment, Tag, MarkupResemblesLocatorWarning
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
 sys.path.append("utils")
 from base_class import BaseClass
+from profiler import profiler
 from game import Game
+from resources import get_session_for_url, HTTP_TIMEOUT_SECONDS
 
 class BaseballReferenceScraper(BaseClass):
-    def __init__(self, data_dir="./data/game_data"):
+    def __init__(self, data_dir="./data/game_data", session=None):
         self.base_url = "https://www.baseball-reference.com/"
         self.headers = {"User-Agent": "User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Safari/537.36"}
         self.data_dir = data_dir
+        # Reuse one keep-alive connection for all requests to baseball-reference
+        self.session = session if session is not None else get_session_for_url(self.base_url)
 
     def get_response(self, link, n_tries=5):
         for i in range(n_tries):
-            res = requests.get(link, headers=self.headers)
+            try:
+                with profiler.stage("scraper.http"):
+                    res = self.session.get(link, headers=self.headers, timeout=HTTP_TIMEOUT_SECONDS)
+            except requests.exceptions.RequestException as e:
+                # The session does not retry baseball-reference requests, so connection errors are retried here at the same pace
+                time.sleep(3)
+                if i < n_tries - 1:
+                    self.log(f"Request for {link} failed ({e!r}), trying again", error=True)
+                continue
+            profiler.count("http.requests")
+            profiler.count("http.bytes", len(res.content))
             time.sleep(3)  # Sleep after request to avoid rate limits (20 req/min) https://www.sports-reference.com/bot-traffic.html
             if res.status_code != 200:
                 if i < n_tries - 1:
@@ -30,22 +44,29 @@ class BaseballReferenceScraper(BaseClass):
                 continue
             else:
                 return res
-        raise BaseException(f"Request for {link} failed")
+        raise RuntimeError(f"Request for {link} failed")
 
     def get_game_ids(self, start_time, end_time):
         game_ids = []
         for t in pd.date_range(start_time, end_time):
-            self.log(f"Getting game IDs for {t.strftime('%Y/%m/%d')}")
-            link = os.path.join(self.base_url, "boxes", f"?year={t.year}&month={t.month}&day={t.day}")
+            game_ids += self.get_game_ids_for_date(t)
+        self.log(f"{len(game_ids)} game IDs found")
+        return game_ids
 
-            res = self.get_response(link)
-            soup = BeautifulSoup(res.text, "html.parser")
+    @profiler.timed("scraper.get_game_ids")
+    def get_game_ids_for_date(self, t):
+        """Ids of the finished games on the /boxes/ page for t (a pd.Timestamp)."""
+        self.log(f"Getting game IDs for {t.strftime('%Y/%m/%d')}")
+        link = os.path.join(self.base_url, "boxes", f"?year={t.year}&month={t.month}&day={t.day}")
 
-            for a in soup.find_all("a"):
-                if a.get_text() == "Final":
-                    href = a["href"]
-                    game_ids.append(href.split("/")[-1].split(".shtml")[0])
-        self.log(f"{len(game_ids)} game IDs found")
+        res = self.get_response(link)
+        soup = BeautifulSoup(res.text, "html.parser")
+
+        game_ids = []
+        for a in soup.find_all("a"):
+            if a.get_text() == "Final":
+                href = a["href"]
+                game_ids.append(href.split("/")[-1].split(".shtml")[0])
         return game_ids
 
     def game_id_to_link(self, game_id):
@@ -88,6 +109,7 @@ class BaseballReferenceScraper(BaseClass):
             return None
         return df
 
+    @profiler.timed("scraper.get_game_data")
     def get_game_data(self, game_id):
         # Check if game is already in data_dir
         path = os.path.join(self.data_dir, game_id + ".json")
@@ -115,9 +137,9 @@ class BaseballReferenceScraper(BaseClass):
             if "Start Time" in div.get_text():
                 time = div.get_text().split("Start Time: ")[1].split(" Local")[0]
         if venue is None:
-            raise BaseException("Venue not found")
+            raise RuntimeError("Venue not found")
         if time is None:
-            raise BaseException("Time not found")
+            raise RuntimeError("Time not found")
 
         table_dfs = []
         comments = soup.find_all(text=lambda text:isinstance(text, Comment))
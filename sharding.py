@@ -0,0 +1,199 @@
+"""Date-sharded --get_updates for re-scoring long ranges with several processes or nodes.
+
+The range is split into contiguous date shards with about the same number of games. Each worker
+loads the newest runner snapshot from before its shard (or builds from scratch), adds games up
+to the end of its shard and writes a partial NDJSON. The merge step writes the partials in the
+order a single --get_updates run would. Workers only share the data, snapshot and output
+directories, so they can run on other nodes over a shared filesystem.
+"""
+import os
+import sys
+import glob
+import json
+import pickle
+import tempfile
+import subprocess
+import pandas as pd
+
+sys.path.append("utils")
+from base_class import BaseClass
+
+SNAPSHOT_VERSION = 2
+
+def get_game_date(game_id):
+    return game_id[3:11]
+
+def to_date_key(date):
+    return pd.Timestamp(date).strftime("%Y%m%d")
+
+def split_date_range(game_ids, start_date, end_date, n_shards):
+    """Splits [start_date, end_date] into n_shards contiguous (start, end) YYYYMMDD ranges with about the same number of games.
+
+    Shards always start on a game date, so no shard starts on an off day. A shard can be empty
+    (end before start) when there are fewer game dates than shards.
+    """
+    start_date, end_date = to_date_key(start_date), to_date_key(end_date)
+    games_per_date = {}
+    for game_id in game_ids:
+        date = get_game_date(game_id)
+        if start_date <= date <= end_date:
+            games_per_date[date] = games_per_date.get(date, 0) + 1
+    dates = sorted(games_per_date)
+    n_games = sum(games_per_date.values())
+
+    # Shard i starts at the first date where the running game count reaches i / n_shards of the total
+    starts = [start_date]
+    total = 0
+    for date in dates:
+        while len(starts) < n_shards and total >= len(starts) * n_games / n_shards and date > starts[-1]:
+            starts.append(date)
+        total += games_per_date[date]
+    day_after_end = to_date_key(pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    starts += [day_after_end] * (n_shards - len(starts))
+    ends = [to_date_key(pd.Timestamp(x) - pd.Timedelta(days=1)) for x in starts[1:]] + [end_date]
+    return list(zip(starts, ends))
+
+def get_partial_path(output_file, shard_index, n_shards):
+    return f"{output_file}.shard-{shard_index:03d}-of-{n_shards:03d}"
+
+def get_snapshot_path(snapshot_dir, date):
+    return os.path.join(snapshot_dir, f"runner_{date}.pickle")
+
+def count_games_before(game_ids, date):
+    return sum(1 for x in game_ids if get_game_date(x) < date)
+
+class ShardWorker(BaseClass):
+    """Builds the runner for one shard, through runner snapshots, and scores the shard."""
+    def __init__(self, data_dir, stat_names, pitcher_stat_names, snapshot_dir=None):
+        self.data_dir = data_dir
+        self.stat_names = stat_names
+        self.pitcher_stat_names = pitcher_stat_names
+        self.snapshot_dir = snapshot_dir
+
+    def new_runner(self):
+        from runner import Runner
+        return Runner(self.stat_names, self.pitcher_stat_names, data_dir=self.data_dir)
+
+    def save_snapshot(self, runner, date, n_games):
+        """Saves runner, which holds the n_games games before date."""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "stat_names": self.stat_names,
+            "pitcher_stat_names": self.pitcher_stat_names,
+            "date": date,
+            "n_games": n_games,
+            "runner": runner,
+        }
+        # Write then rename, so workers on other nodes never load a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, get_snapshot_path(self.snapshot_dir, date))
+        self.log(f"Saved snapshot of {n_games} games before {date}")
+
+    def load_snapshot(self, date, game_ids):
+        """Returns (runner, snapshot date) for the newest valid snapshot at or before date, or (None, None).
+
+        A snapshot is only used if it was built with the same stats and the data directory still
+        has the same number of games before its date.
+        """
+        if self.snapshot_dir is None:
+            return None, None
+        paths = sorted(glob.glob(get_snapshot_path(self.snapshot_dir, "*")), reverse=True)
+        for path in paths:
+            snapshot_date = os.path.basename(path)[len("runner_"):-len(".pickle")]
+            if snapshot_date > date:
+                continue
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot["version"] != SNAPSHOT_VERSION or snapshot["stat_names"] != self.stat_names or\
+               snapshot["pitcher_stat_names"] != self.pitcher_stat_names:
+                self.log(f"Snapshot {path} was built with other stats, skipping")
+                continue
+            if snapshot["n_games"] != count_games_before(game_ids, snapshot_date):
+                self.log(f"Snapshot {path} is out of date, skipping")
+                continue
+            self.log(f"Loaded snapshot {path}")
+            runner = snapshot["runner"]
+            runner.data_dir = self.data_dir
+            return runner, snapshot_date
+        return None, None
+
+    def build_runner(self, start_date, end_date):
+        """Runner holding every game through end_date, saving a snapshot at start_date for later runs."""
+        runner = self.new_runner()
+        game_ids = runner.get_games()
+        loaded, snapshot_date = self.load_snapshot(start_date, game_ids)
+        if loaded is not None:
+            runner = loaded
+        if snapshot_date != start_date:
+            day_before_start = to_date_key(pd.Timestamp(start_date) - pd.Timedelta(days=1))
+            runner.build_player_map_for_dates(snapshot_date, day_before_start)
+            n_games = count_games_before(game_ids, start_date)
+            if self.snapshot_dir is not None and n_games > 0:
+                self.save_snapshot(runner, start_date, n_games)
+        runner.build_player_map_for_dates(start_date, end_date)
+        return runner
+
+    def run(self, model_scorers, start_date, end_date, output_file, shard_index, n_shards):
+        """Scores shard shard_index of [start_date, end_date] and writes its partial file."""
+        from updates import UpdateBuilder
+        from update_io import NdjsonItemWriter
+
+        runner = self.new_runner()
+        shards = split_date_range(runner.get_games(), start_date, end_date, n_shards)
+        shard_start, shard_end = shards[shard_index]
+        self.log(f"Shard {shard_index + 1}/{n_shards}: {shard_start} to {shard_end}")
+
+        partial_path = get_partial_path(output_file, shard_index, n_shards)
+        tmp_path = partial_path + ".tmp"
+        with NdjsonItemWriter(tmp_path) as writer:
+            if shard_start <= shard_end:
+                builder = UpdateBuilder(self.build_runner(shard_start, shard_end))
+                for model_config, scorer in model_scorers:
+                    self.log(f"Getting updates for model {model_config['name']}")
+                    writer.write_all(builder.get_items_for_date_range(model_config, scorer, shard_start, shard_end))
+        # The partial only appears once it is complete, so merge can tell finished shards apart
+        os.replace(tmp_path, partial_path)
+        self.log(f"Wrote {writer.n_items} items to {partial_path}")
+        return writer.n_items
+
+def merge_partials(output_file, n_shards, model_names, remove=False):
+    """Writes the partials of all shards to output_file, in the order of a single --get_updates run.
+
+    That is model by model in model_names order, then shard by shard. Items of models not in
+    model_names go last. Raises ValueError if a shard has not finished.
+    """
+    paths = [get_partial_path(output_file, i, n_shards) for i in range(n_shards)]
+    missing = [x for x in paths if not os.path.exists(x)]
+    if len(missing) > 0:
+        raise ValueError(f"Shards not finished: {', '.join(missing)}")
+
+    n_items = 0
+    with open(output_file, "w") as out:
+        for model_name in list(model_names) + [None]:
+            for path in paths:
+                with open(path, "r") as f:
+                    for line in f:
+                        model = json.loads(line)["model"]
+                        if model == model_name or (model_name is None and model not in model_names):
+                            out.write(line)
+                            n_items += 1
+    if remove:
+        for path in paths:
+            os.remove(path)
+    return n_items
+
+def run_local_shards(main_path, start_date, end_date, data_dir, output_file, n_shards, snapshot_dir=None):
+    """Runs every shard as a separate main.py process on this machine and waits for all of them.
+
+    Returns the shard indices whose process failed.
+    """
+    processes = []
+    for i in range(n_shards):
+        args = [sys.executable, main_path, "--get_updates_shard", start_date, end_date, data_dir, output_file, str(i), str(n_shards)]
+        if snapshot_dir is not None:
+            args.append(snapshot_dir)
+        processes.append(subprocess.Popen(args))
+    return [i for i, p in enumerate(processes) if p.wait() != 0]
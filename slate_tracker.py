@@ -0,0 +1,155 @@
+import sys
+import sqlite3
+import datetime
+import pandas as pd
+
+sys.path.append("utils")
+from base_class import BaseClass
+from profiler import profiler
+from statsapi_cache import get_schedule, get_boxscore_data
+from updates import get_player_name, get_player_name_and_team
+
+# Statuses of games that have not started, as in SportsbookOddsDataHandler.get_games_to_update
+NOT_STARTED_STATUSES = ["Pre-Game", "Warmup", "Scheduled"]
+LINEUP_SIZE = 9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    status TEXT,
+    venue TEXT,
+    away_pitcher TEXT,
+    home_pitcher TEXT,
+    n_away_batters INTEGER NOT NULL DEFAULT 0,
+    n_home_batters INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS batters (
+    game_id INTEGER NOT NULL,
+    batter_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    side TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    scored INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (game_id, batter_id)
+);
+CREATE INDEX IF NOT EXISTS games_date ON games (date);
+CREATE INDEX IF NOT EXISTS batters_date ON batters (date, scored);
+"""
+
+def get_lineup_ids(boxscore_data, side):
+    return [x["personId"] for x in boxscore_data[side + "Batters"] if x["personId"] != 0]
+
+def get_starter_id(boxscore_data, side):
+    """The listed starter, or None before one is announced; the first row of the pitcher list is a header."""
+    pitchers = boxscore_data[side + "Pitchers"]
+    return pitchers[1]["personId"] if len(pitchers) >= 2 else None
+
+class SlateTracker(BaseClass):
+    """Lineup and starter state of today's games, kept in SQLite between polls.
+
+    Each poll only fetches the boxscores of games whose lineups or starters are still missing.
+    A game is complete once both lineups and starters are posted, or once it has started. Every
+    batter is scored once, except that a starter change seen while the game is still polled
+    makes the batters facing the new starter be scored again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def now(self):
+        return datetime.datetime.now().isoformat(timespec="seconds")
+
+    def get_date(self, date=None):
+        return pd.Timestamp.now().strftime("%Y-%m-%d") if date is None else pd.Timestamp(date).strftime("%Y-%m-%d")
+
+    def get_complete_games(self, date):
+        return {x[0] for x in self.conn.execute("SELECT game_id FROM games WHERE date = ? AND complete = 1", (date,))}
+
+    @profiler.timed("slate_tracker.poll")
+    def poll(self, date=None):
+        """Fetches the boxscores of date's (today's) games that are not complete and records new batters and starters.
+
+        Returns the number of batters added or to be scored again.
+        """
+        date = self.get_date(date)
+        schedule = get_schedule(None if date == self.get_date() else date)
+        complete = self.get_complete_games(date)
+        to_poll = [x for x in schedule if x["game_id"] not in complete]
+        self.log(f"{len(complete)} of {len(schedule)} games have lineups and starters, polling {len(to_poll)}")
+
+        n_new = 0
+        for game in to_poll:
+            n_new += self.poll_game(date, game)
+        return n_new
+
+    def poll_game(self, date, game):
+        game_id = game["game_id"]
+        boxscore_data = get_boxscore_data(game_id, status=game.get("status"))
+        row = self.conn.execute("SELECT away_pitcher, home_pitcher FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        old_pitchers = {"away": None, "home": None} if row is None else {"away": row[0], "home": row[1]}
+        known_batters = {x[0] for x in self.conn.execute("SELECT batter_id FROM batters WHERE game_id = ?", (game_id,))}
+
+        pitchers, lineups, new_batters = {}, {}, []
+        for side in ["away", "home"]:
+            starter_id = get_starter_id(boxscore_data, side)
+            pitchers[side] = None if starter_id is None else get_player_name(starter_id)
+            lineups[side] = get_lineup_ids(boxscore_data, side)
+            for batter_id in lineups[side]:
+                if batter_id not in known_batters:
+                    player_name, team_name = get_player_name_and_team(batter_id)
+                    new_batters.append((game_id, batter_id, date, side, player_name, team_name))
+
+        started = game.get("status") not in NOT_STARTED_STATUSES
+        has_lineups = all(len(lineups[x]) >= LINEUP_SIZE for x in lineups) and all(pitchers[x] is not None for x in pitchers)
+        with self.conn:
+            self.conn.execute("INSERT INTO games (game_id, date, status, venue, away_pitcher, home_pitcher, n_away_batters, n_home_batters, "
+                              "complete, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(game_id) DO UPDATE SET "
+                              "status = excluded.status, venue = excluded.venue, away_pitcher = excluded.away_pitcher, "
+                              "home_pitcher = excluded.home_pitcher, n_away_batters = excluded.n_away_batters, "
+                              "n_home_batters = excluded.n_home_batters, complete = excluded.complete, updated_at = excluded.updated_at",
+                              (game_id, date, game.get("status"), game.get("venue_name"), pitchers["away"], pitchers["home"],
+                               len(lineups["away"]), len(lineups["home"]), int(has_lineups or started), self.now()))
+            self.conn.executemany("INSERT OR IGNORE INTO batters (game_id, batter_id, date, side, player_name, team_name) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", new_batters)
+            n_rescored = 0
+            for side, batting_side in [("away", "home"), ("home", "away")]:
+                if old_pitchers[side] is not None and pitchers[side] != old_pitchers[side]:
+                    self.log(f"Starter for game {game_id} changed from {old_pitchers[side]} to {pitchers[side]}")
+                    n_rescored += self.conn.execute("UPDATE batters SET scored = 0 WHERE game_id = ? AND side = ? AND scored = 1",
+                                                    (game_id, batting_side)).rowcount
+        if len(new_batters) > 0 or n_rescored > 0:
+            self.log(f"Game {game_id}: {len(new_batters)} new batters, {n_rescored} to score again")
+        return len(new_batters) + n_rescored
+
+    def get_pending_slate(self, date=None):
+        """(keys, slate) for batters not scored yet whose opposing starter is known.
+
+        slate rows are (player_name, team_name, opposing_pitcher_name, venue_name) like
+        UpdateBuilder.get_todays_slate; pass keys to mark_scored once they are pushed.
+        """
+        rows = self.conn.execute("SELECT b.game_id, b.batter_id, b.player_name, b.team_name, "
+                                 "CASE b.side WHEN 'away' THEN g.home_pitcher ELSE g.away_pitcher END, g.venue "
+                                 "FROM batters b JOIN games g ON b.game_id = g.game_id "
+                                 "WHERE b.date = ? AND b.scored = 0 ORDER BY b.game_id, b.side, b.rowid", (self.get_date(date),)).fetchall()
+        rows = [x for x in rows if x[4] is not None]
+        return [(x[0], x[1]) for x in rows], [tuple(x[2:]) for x in rows]
+
+    def mark_scored(self, keys):
+        with self.conn:
+            self.conn.executemany("UPDATE batters SET scored = 1 WHERE game_id = ? AND batter_id = ?", keys)
+
+    def is_done(self, date=None):
+        """True once every game of date has its lineups and starters or has started."""
+        date = self.get_date(date)
+        schedule = get_schedule(None if date == self.get_date() else date)
+        complete = self.get_complete_games(date)
+        return all(x["game_id"] in complete for x in schedule)
@@ -1,22 +1,24 @@
 import os
 import sys
 import pickle
-import statsapi
 import tqdm
 import requests
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient
 
 from dotenv import load_dotenv
 load_dotenv()
 
 sys.path.append("utils")
 from base_class import BaseClass
+from profiler import profiler
+from database import get_database
+from resources import get_session_for_url, HTTP_TIMEOUT_SECONDS
+from statsapi_cache import get_schedule
+from odds import get_odds_summaries, PRICE_SUFFIX
 
-def get_database():
-    client = MongoClient(os.getenv("MONGO_URL"))
-    return client["home_run_data"]
+ODDS_PROJECTION = {"player_name": 1, "date": 1, "model": 1, "did_hit_hr": 1, "home_run_odds": 1, "odds_data.data": 1,
+                   "odds_summary": 1}
 
 class SportsbookOddsDataHandler(BaseClass):
     def __init__(self):
@@ -24,10 +26,7 @@ class SportsbookOddsDataHandler(BaseClass):
 
     def get_games_to_update(self, date=None, threshold_minutes=15, update_all_games=False):
         # We want to update games 15 minutes or so before they start
-        if date is None:
-            schedule = statsapi.schedule()
-        else:
-            schedule = statsapi.schedule(pd.Timestamp(date).strftime("%Y-%m-%d"))
+        schedule = get_schedule(None if date is None else pd.Timestamp(date).strftime("%Y-%m-%d"))
         threshold = pd.Timedelta(f"{threshold_minutes} minutes")
         games_to_update = []
         for game in schedule:
@@ -47,7 +46,10 @@ class SportsbookOddsDataHandler(BaseClass):
     def get_odds_for_event(self, event_id):
         url = f"https://api.the-odds-api.com/v4/sports/baseball_mlb/events/{event_id}/odds?apiKey={self.odds_api_key}&regions=us&markets=batter_home_runs&oddsFormat=american"
         try:
-            response = requests.get(url)
+            with profiler.stage("odds.http"):
+                response = get_session_for_url(url).get(url, timeout=HTTP_TIMEOUT_SECONDS)
+            profiler.count("http.requests")
+            profiler.count("http.bytes", len(response.content))
             response.raise_for_status()
             data = response.json()
             self.log(f"Found odds for event {event_id}")
@@ -67,7 +69,10 @@ class SportsbookOddsDataHandler(BaseClass):
     def get_odds_api_events(self):
         url = f"https://api.the-odds-api.com/v4/sports/baseball_mlb/events?apiKey={self.odds_api_key}"
         try:
-            response = requests.get(url)
+            with profiler.stage("odds.http"):
+                response = get_session_for_url(url).get(url, timeout=HTTP_TIMEOUT_SECONDS)
+            profiler.count("http.requests")
+            profiler.count("http.bytes", len(response.content))
             response.raise_for_status()
             data = response.json()
             self.log(f"Found {len(data)} Odds API MLB events")
@@ -123,20 +128,34 @@ class SportsbookOddsDataHandler(BaseClass):
                             "sportsbook": book,
                             "over_or_under": over_or_under,
                             "odds": odds,
+                            "price": market["price"],
                             "utc_update_time": str(pd.Timestamp.utcnow()),
                             "game_time": str(pd.Timestamp(event["commence_time"])),
                         })
         return ret
 
+    def get_odds_summaries(self, odds_updates):
+        """{player_name: summary} with the best prices and consensus probabilities, computed for all players at once."""
+        return get_odds_summaries([x["player_name"] for x in odds_updates],
+                                  [x["sportsbook"] for x in odds_updates],
+                                  [x["over_or_under"] for x in odds_updates],
+                                  # Updates from before prices were kept only have the string
+                                  [x.get("price", x["odds"]) for x in odds_updates])
+
+    @profiler.timed("odds.upload_results_to_db")
     def upload_results_to_db(self, odds_updates, collection):
         # First, we need to aggregate the results by player
-        all_player_names = list(set([x["player_name"] for x in odds_updates]))
-        for player in all_player_names:
-            player_updates = [x for x in odds_updates if x["player_name"] == player]
+        updates_by_player = {}
+        for update in odds_updates:
+            updates_by_player.setdefault(update["player_name"], []).append(update)
+        summaries = self.get_odds_summaries(odds_updates)
+        for player, player_updates in updates_by_player.items():
             player_update_sportsbooks = list(set([x["sportsbook"] for x in player_updates]))
             odds_object = {x: {} for x in player_update_sportsbooks}
             for update in player_updates:
                 odds_object[update["sportsbook"]][update["over_or_under"]] = update["odds"]
+                if "price" in update:
+                    odds_object[update["sportsbook"]][update["over_or_under"] + PRICE_SUFFIX] = int(update["price"])
 
             odds_data = {
                 "data": odds_object,
@@ -145,16 +164,23 @@ class SportsbookOddsDataHandler(BaseClass):
             }
 
             game_date = pd.Timestamp(player_updates[0]["game_time"]).tz_convert("America/New_York").strftime("%Y-%m-%d")
+            # Only the fields that are compared or logged, not stats or the full odds history
             queried_items = collection.find({"player_name": player,
                                               "date": game_date,
-                                              })
+                                              }, ODDS_PROJECTION)
             if queried_items is not None:
                 for queried_item in queried_items:
                     new_item = queried_item.copy()
                     new_item["odds_data"] = odds_data
+                    # Edge of each model against the no-vig consensus, so edge queries need no parsing
+                    odds_summary = dict(summaries[player])
+                    consensus = odds_summary["consensus_over_probability"]
+                    home_run_odds = queried_item.get("home_run_odds")
+                    odds_summary["edge"] = None if consensus is None or home_run_odds is None else home_run_odds - consensus
                     did_update = False
-                    if "odds_data" not in queried_item or queried_item["odds_data"]["data"] != odds_data["data"]:
-                        collection.replace_one(queried_item, new_item)
+                    if "odds_data" not in queried_item or queried_item["odds_data"]["data"] != odds_data["data"] or\
+                       queried_item.get("odds_summary") != odds_summary:
+                        collection.update_one({"_id": queried_item["_id"]}, {"$set": {"odds_data": odds_data, "odds_summary": odds_summary}})
                         self.log(f"Updating {new_item['player_name']} {new_item['date']} {new_item['model']} {new_item['did_hit_hr']} {new_item['home_run_odds']}")
                         did_update = True
                     if not did_update:
@@ -0,0 +1,118 @@
+"""On-disk cache for statsapi schedule and boxscore responses, shared by every process on the machine.
+
+Entries are stored per time bucket (now // ttl), so an entry expires at the end of its bucket and
+a later run fetches again. Each key has a lock file; the process holding the lock fetches and the
+others wait and then read its result, so concurrent cron runs make one request. Every fetch
+also removes the files of any key not used for longer than the longest ttl, so the directory
+does not grow with every date and game ever requested.
+"""
+import os
+import sys
+import glob
+import time
+import fcntl
+import pickle
+import datetime
+import tempfile
+import statsapi
+
+sys.path.append("utils")
+from profiler import profiler
+
+CACHE_DIR = os.getenv("STATSAPI_CACHE_DIR", ".statsapi_cache")
+CACHE_ENABLED = os.getenv("STATSAPI_CACHE", "1") != "0"
+SCHEDULE_TTL_SECONDS = 2 * 60
+PAST_SCHEDULE_TTL_SECONDS = 6 * 60 * 60
+BOXSCORE_TTL_SECONDS = 2 * 60
+FINAL_BOXSCORE_TTL_SECONDS = 6 * 60 * 60
+FINAL_STATUSES = ["Final", "Game Over", "Completed Early"]
+# Entries and lock files untouched for this long are expired whatever their ttl
+MAX_ENTRY_AGE_SECONDS = max(SCHEDULE_TTL_SECONDS, PAST_SCHEDULE_TTL_SECONDS, BOXSCORE_TTL_SECONDS, FINAL_BOXSCORE_TTL_SECONDS)
+
+def get_cache_path(name, key, bucket):
+    return os.path.join(CACHE_DIR, f"{name}_{key}_{bucket}.pickle")
+
+def read_entry(path):
+    try:
+        with open(path, "rb") as f:
+            return True, pickle.load(f)
+    except FileNotFoundError:
+        return False, None
+    except (EOFError, pickle.UnpicklingError):
+        return False, None
+
+def write_entry(path, value):
+    # Write then rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(value, f)
+    os.replace(tmp_path, path)
+
+def prune_cache(now=None):
+    """Removes entries, lock files and leftover temporary files not modified for MAX_ENTRY_AGE_SECONDS.
+
+    Lock files are rewritten on every miss, so a lock that old belongs to a key no run is using.
+    """
+    now = time.time() if now is None else now
+    n_removed = 0
+    for path in glob.glob(os.path.join(CACHE_DIR, "*")):
+        try:
+            if os.path.getmtime(path) < now - MAX_ENTRY_AGE_SECONDS:
+                os.remove(path)
+                n_removed += 1
+        except FileNotFoundError:
+            # Removed by another process
+            pass
+    return n_removed
+
+def cached_call(name, key, ttl, fetch):
+    """Returns fetch() for (name, key), reusing a result fetched by any process in the current ttl bucket."""
+    if not CACHE_ENABLED:
+        return fetch()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = get_cache_path(name, key, int(time.time() // ttl))
+    found, value = read_entry(path)
+    if found:
+        profiler.count("statsapi_cache.hits")
+        return value
+
+    with open(os.path.join(CACHE_DIR, f"{name}_{key}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another process may have fetched while we waited for the lock
+            found, value = read_entry(path)
+            if found:
+                profiler.count("statsapi_cache.hits")
+                return value
+            profiler.count("statsapi_cache.misses")
+            value = fetch()
+            write_entry(path, value)
+            for old_path in glob.glob(get_cache_path(name, key, "*")):
+                if old_path != path:
+                    os.remove(old_path)
+            prune_cache()
+            return value
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def get_schedule(date=None):
+    """statsapi.schedule for date (YYYY-MM-DD, today by default); past dates are cached for hours."""
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    date = today if date is None else date
+    ttl = PAST_SCHEDULE_TTL_SECONDS if date < today else SCHEDULE_TTL_SECONDS
+
+    def fetch():
+        profiler.count("statsapi.schedule")
+        with profiler.stage("statsapi.schedule"):
+            return statsapi.schedule(date)
+    return cached_call("schedule", date, ttl, fetch)
+
+def get_boxscore_data(game_id, status=None):
+    """statsapi.boxscore_data for game_id; status is the game's schedule status, finished games are cached for hours."""
+    ttl = FINAL_BOXSCORE_TTL_SECONDS if status in FINAL_STATUSES else BOXSCORE_TTL_SECONDS
+
+    def fetch():
+        profiler.count("statsapi.boxscore_data")
+        with profiler.stage("statsapi.boxscore_data"):
+            return statsapi.boxscore_data(game_id)
+    return cached_call("boxscore", game_id, ttl, fetch)
@@ -0,0 +1,217 @@
+import sys
+import os
+import json
+import glob
+import pickle
+import pandas as pd
+import numpy as np
+
+sys.path.append("utils")
+from base_class import BaseClass
+from model_artifact import LogisticScorer, get_artifact_path
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_EPOCHS = 5
+# The file config/models.py loads, wherever --train is run from
+TRAINED_MODELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "trained_models.json")
+
+class TrainingSetBuilder(BaseClass):
+    """Streams (features, did_hit_home_run) rows from a Runner into chunked .npy files.
+
+    Only one chunk of rows is held in memory at a time, so the size of the date range
+    does not change peak memory.
+    """
+    def __init__(self, runner, features, output_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+                 hitter_games_threshold=20, pitcher_games_threshold=1):
+        self.runner = runner
+        self.features = list(features)
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.hitter_games_threshold = hitter_games_threshold
+        self.pitcher_games_threshold = pitcher_games_threshold
+        self.chunks = []
+        self.n_rows = 0
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.X = np.empty((self.chunk_size, len(self.features)), dtype=np.float32)
+        self.y = np.empty((self.chunk_size,), dtype=np.int8)
+        self.game_ids = []
+        self.n_buffered = 0
+
+    def iter_rows(self, start_date, end_date):
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        for game_id in self.runner.get_games():
+            # Game IDs are like NYA202404050, so the date can be checked before loading the file
+            game_date = pd.Timestamp(game_id[3:11])
+            if game_date < start_date or game_date > end_date:
+                continue
+            game = self.runner.get_game(game_id)
+            hitters = game.get_hitters()
+            if hitters is None:
+                continue
+            for hitter_name in hitters:
+                hitter = self.runner.player_map.get_hitter(hitter_name)
+                if hitter is None:
+                    continue
+                stats = self.runner.get_stats_for_player_before_game(hitter_name,
+                                                                     game_id,
+                                                                     game.date,
+                                                                     hitter_games_threshold=self.hitter_games_threshold,
+                                                                     pitcher_games_threshold=self.pitcher_games_threshold)
+                if stats is None or len(stats) == 0:
+                    continue
+                x = np.array(stats[self.features]).astype(float)
+                if np.isnan(x).any():
+                    continue
+                did_hit_home_run = hitter.did_hit_home_run(game_id)
+                if did_hit_home_run is None:
+                    continue
+                yield game_id, x, int(did_hit_home_run)
+
+    def add_row(self, game_id, x, y):
+        self.X[self.n_buffered] = x
+        self.y[self.n_buffered] = y
+        self.game_ids.append(game_id)
+        self.n_buffered += 1
+        if self.n_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        name = f"chunk_{len(self.chunks):05d}"
+        x_path = os.path.join(self.output_dir, name + "_X.npy")
+        y_path = os.path.join(self.output_dir, name + "_y.npy")
+        ids_path = os.path.join(self.output_dir, name + "_game_ids.npy")
+        np.save(x_path, self.X[:self.n_buffered])
+        np.save(y_path, self.y[:self.n_buffered])
+        np.save(ids_path, np.array(self.game_ids, dtype="U16"))
+        self.chunks.append({
+            "X": os.path.basename(x_path),
+            "y": os.path.basename(y_path),
+            "game_ids": os.path.basename(ids_path),
+            "rows": self.n_buffered,
+        })
+        self.n_rows += self.n_buffered
+        self.log(f"Wrote {name} with {self.n_buffered} rows ({self.n_rows} total)")
+        self._reset_buffers()
+
+    def build(self, start_date, end_date):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        for f in glob.glob(os.path.join(self.output_dir, "chunk_*.npy")):
+            os.remove(f)
+
+        for game_id, x, y in self.iter_rows(start_date, end_date):
+            self.add_row(game_id, x, y)
+        self.flush()
+
+        manifest = {
+            "features": self.features,
+            "start_date": pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+            "end_date": pd.Timestamp(end_date).strftime("%Y-%m-%d"),
+            "hitter_games_threshold": self.hitter_games_threshold,
+            "pitcher_games_threshold": self.pitcher_games_threshold,
+            "n_rows": self.n_rows,
+            "chunks": self.chunks,
+        }
+        with open(os.path.join(self.output_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        self.log(f"Training set with {self.n_rows} rows saved to {self.output_dir}")
+        return manifest
+
+def load_manifest(training_dir):
+    with open(os.path.join(training_dir, MANIFEST_NAME), "r") as f:
+        return json.load(f)
+
+def iter_chunks(training_dir, manifest=None, features=None):
+    """Yields (X, y) per chunk, optionally restricted to a subset of the stored features."""
+    if manifest is None:
+        manifest = load_manifest(training_dir)
+    columns = None
+    if features is not None:
+        columns = [manifest["features"].index(x) for x in features]
+    for chunk in manifest["chunks"]:
+        X = np.load(os.path.join(training_dir, chunk["X"]), mmap_mode="r")
+        y = np.load(os.path.join(training_dir, chunk["y"]))
+        if columns is not None:
+            X = X[:, columns]
+        yield X, y
+
+def add_model_config_entry(entry, config_path=TRAINED_MODELS_PATH):
+    """Adds a model entry to the trained models file loaded by config/models.py, replacing one with the same paths."""
+    entries = []
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            entries = json.load(f)
+    entries = [x for x in entries if x["model_path"] != entry["model_path"]] + [entry]
+    with open(config_path, "w") as f:
+        json.dump(entries, f, indent=4)
+
+class ModelTrainer(BaseClass):
+    """Fits a StandardScaler and a logistic model on a chunked training set, one chunk at a time.
+
+    The scaler is fit in one pass over the chunks and the model with SGD over epochs passes, so
+    memory is bounded by the chunk size rather than the size of the training set.
+    """
+    def __init__(self, training_dir, features=None, epochs=DEFAULT_EPOCHS, random_state=42):
+        self.training_dir = training_dir
+        self.manifest = load_manifest(training_dir)
+        self.features = list(features) if features is not None else list(self.manifest["features"])
+        self.epochs = epochs
+        self.random_state = random_state
+
+    def fit(self):
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.linear_model import SGDClassifier
+
+        n_rows = self.manifest["n_rows"]
+        if n_rows == 0:
+            raise ValueError(f"No rows in training set {self.training_dir}")
+
+        scaler = StandardScaler()
+        for X, _ in iter_chunks(self.training_dir, self.manifest, self.features):
+            scaler.partial_fit(X)
+
+        self.log(f"Fitting model on {n_rows} rows with {len(self.features)} features for {self.epochs} epochs")
+        model = SGDClassifier(loss="log_loss", random_state=self.random_state)
+        rng = np.random.default_rng(self.random_state)
+        for epoch in range(self.epochs):
+            for X, y in iter_chunks(self.training_dir, self.manifest, self.features):
+                order = rng.permutation(len(X))
+                model.partial_fit(scaler.transform(X[order]), y[order], classes=[0, 1])
+
+        n_correct = 0
+        for X, y in iter_chunks(self.training_dir, self.manifest, self.features):
+            n_correct += int((model.predict(scaler.transform(X)) == y).sum())
+        self.log(f"Training accuracy {n_correct / n_rows:.4f}")
+        return scaler, model
+
+    def train(self, name, model_prefix, model_dir="model_data", config_path=TRAINED_MODELS_PATH, shadow=False):
+        """Fits and saves the model and adds its config entry, as a shadow of the model with the same name if shadow."""
+        scaler, model = self.fit()
+        scaler_path = os.path.join(model_dir, f"{model_prefix}_scaler.p")
+        model_path = os.path.join(model_dir, f"{model_prefix}_model.p")
+        with open(scaler_path, "wb") as f:
+            pickle.dump(scaler, f)
+        with open(model_path, "wb") as f:
+            pickle.dump(model, f)
+        self.log(f"Saved scaler to {scaler_path} and model to {model_path}")
+
+        artifact_path = get_artifact_path(model_path)
+        LogisticScorer.from_sklearn(scaler, model, features=self.features).save(artifact_path)
+        self.log(f"Saved NumPy artifact to {artifact_path}")
+
+        entry = {
+            "name": name,
+            "scaler_path": scaler_path,
+            "model_path": model_path,
+            "features": self.features,
+        }
+        if shadow:
+            entry["shadow"] = True
+        add_model_config_entry(entry, config_path=config_path)
+        self.log(f"Added {name}{' as a shadow' if shadow else ''} to {config_path}")
+        return entry
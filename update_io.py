@@ -0,0 +1,77 @@
+import json
+
+DEFAULT_BATCH_SIZE = 500
+
+class NpEncoder(json.JSONEncoder):
+    def default(self, obj):
+        # numpy is only needed when an item still holds numpy values
+        import numpy as np
+
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return super(NpEncoder, self).default(obj)
+
+class NdjsonItemWriter:
+    """Writes update items one JSON object per line as they are produced."""
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.n_items = 0
+        self.f = open(output_file, "w")
+        self.encoder = NpEncoder(ensure_ascii=True)
+
+    def write(self, item):
+        self.f.write(self.encoder.encode(item))
+        self.f.write("\n")
+        self.n_items += 1
+
+    def write_all(self, items):
+        for item in items:
+            self.write(item)
+        return self.n_items
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def write_items(items, output_file):
+    """Streams items (any iterable, e.g. a generator) to an NDJSON file and returns the count."""
+    with NdjsonItemWriter(output_file) as writer:
+        return writer.write_all(items)
+
+def iter_items(input_file):
+    """Yields items from an NDJSON update file, or from an old-style file holding one JSON array."""
+    with open(input_file, "r") as f:
+        first_char = ""
+        while first_char.isspace() or first_char == "":
+            first_char = f.read(1)
+            if first_char == "":
+                return
+        f.seek(0)
+        if first_char == "[":
+            # Old format written with a single json.dump(items, f)
+            for item in json.load(f):
+                yield item
+            return
+        for line in f:
+            line = line.strip()
+            if len(line) > 0:
+                yield json.loads(line)
+
+def iter_batches(items, batch_size=DEFAULT_BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
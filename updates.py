@@ -0,0 +1,296 @@
+import sys
+import tqdm
+import pandas as pd
+import numpy as np
+import statsapi
+
+sys.path.append("utils")
+from base_class import BaseClass
+from profiler import profiler
+from statsapi_cache import get_schedule, get_boxscore_data
+from score_ledger import get_row_hash
+
+MIN_ABS_TO_PUSH = 50
+ITEM_STAT_NAMES = ["Batting Average", "Home Runs", "Runs Batted In", "On-Base%", "Slugging %", "At Bats", "Games Played"]
+
+def date_greater_than_or_equal(d1, d2):
+    return d1.year > d2.year or\
+           (d1.year == d2.year and d1.month > d2.month) or\
+           (d1.year == d2.year and d1.month == d2.month and d1.day >= d2.day)
+
+def did_hit_home_run_code(did_hit_home_run):
+    """Encodes did_hit_home_run for the database: 0 = no, 1 = yes, 2 = unknown."""
+    if did_hit_home_run is None:
+        return 2
+    elif did_hit_home_run:
+        return 1
+    else:
+        return 0
+
+def get_item_stats(stats):
+    """Returns the stats sub-dict of an item with builtin Python numbers so it can go straight to Mongo.
+
+    Rates are stored as float32, so they are rounded to drop the float32 noise (.263 rather than .2630000114).
+    """
+    item_stats = {}
+    for x in ITEM_STAT_NAMES:
+        value = stats[x].item() if isinstance(stats[x], np.generic) else stats[x]
+        if isinstance(value, float):
+            value = round(value, 6)
+        item_stats[x] = value
+    return item_stats
+
+def get_ledger_version(model_config, scorer):
+    """Version hashed into ledger rows: the scorer's, followed by its shadows' when there are any."""
+    return ",".join([scorer.version] + [x.version for _, x in model_config.get("shadows", [])])
+
+def get_ledger_features(model_config):
+    """Features hashed into ledger rows: the model's, followed by any other features its shadows use."""
+    features = list(model_config["features"])
+    for shadow_config, _ in model_config.get("shadows", []):
+        features += [x for x in shadow_config["features"] if x not in features]
+    return features
+
+def get_shadow_odds(model_config, get_features):
+    """{version: P(home run)} per row for the shadows of a registry model config, or None without shadows.
+
+    get_features(features) returns the rows' values of a feature list as a 2D array. Rows missing
+    one of a shadow's features get None for that shadow.
+    """
+    shadows = model_config.get("shadows", [])
+    if len(shadows) == 0:
+        return None
+    shadow_odds = None
+    for shadow_config, shadow_scorer in shadows:
+        X = get_features(shadow_config["features"])
+        complete = ~np.isnan(X).any(axis=1)
+        with profiler.stage("score_shadows"):
+            predicted_probs = shadow_scorer.predict_proba(np.where(complete[:, None], X, 0.0))
+        if shadow_odds is None:
+            shadow_odds = [{} for _ in range(len(X))]
+        for odds, is_complete, predicted_prob in zip(shadow_odds, complete.tolist(), predicted_probs.tolist()):
+            odds[shadow_config["version"]] = predicted_prob if is_complete else None
+    return shadow_odds
+
+def get_player_name(player_id):
+    return statsapi.lookup_player(player_id)[0]["nameFirstLast"]
+
+def get_player_name_and_team(player_id):
+    player_query = statsapi.lookup_player(player_id)[0]
+    return player_query["nameFirstLast"], statsapi.lookup_team(int(player_query["currentTeam"]["id"]))[0]["name"]
+
+class UpdateBuilder(BaseClass):
+    """Builds the model result items pushed to the database from a built Runner."""
+    def __init__(self, runner):
+        self.runner = runner
+
+    def get_items_for_date_range(self, model_config, scorer, start_date, end_date, ledger=None):
+        """Yields an item per hitter of every game in the range; with a ScoreLedger, only new or changed items."""
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        r = self.runner
+        if ledger is not None:
+            ledger.load(model_config["name"], start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+            model_version = get_ledger_version(model_config, scorer)
+            ledger_features = get_ledger_features(model_config)
+        # Game ids start with the team and date, so games outside the range are skipped without loading them
+        game_ids = [x for x in r.get_games() if start_date.strftime("%Y%m%d") <= x[3:11] <= end_date.strftime("%Y%m%d")]
+        for game_id in tqdm.tqdm(game_ids):
+            game = r.get_game(game_id)
+            if not (date_greater_than_or_equal(pd.Timestamp(game.date), start_date) and date_greater_than_or_equal(end_date, pd.Timestamp(game.date))):
+                continue
+            home_hitters, away_hitters = game.get_home_hitters(), game.get_away_hitters()
+            if home_hitters is None or away_hitters is None:
+                continue
+            hitter_teams = [(x, game.home_team) for x in home_hitters] + [(x, game.away_team) for x in away_hitters]
+            for player_name, team_name in hitter_teams:
+                stats = r.get_stats_for_player_before_game(player_name,
+                                                           game_id,
+                                                           game.date,
+                                                           include_last_season_data=True,
+                                                           hitter_games_threshold=0,
+                                                           pitcher_games_threshold=0)
+                if stats is not None and stats["At Bats"] < MIN_ABS_TO_PUSH:
+                    self.log(f"Not enough ABs ({stats['At Bats']}) for {player_name}, skipping")
+                    continue
+                if stats is None or len(stats) == 0:
+                    continue
+                features = np.array(stats[model_config["features"]]).astype(float)
+                if np.isnan(features).any():
+                    self.log(f"Missing features for {player_name}, skipping", error=True)
+                    continue
+                hitter = r.player_map.get_hitter(player_name)
+                did_hit_home_run = hitter.did_hit_home_run(game_id)
+                item = {
+                    "player_name": player_name,
+                    "opposing_pitcher": hitter.get_pitcher_id_for_game(game_id),
+                    "team_name": team_name,
+                    "date": game.date.strftime("%Y-%m-%d"),
+                    "model": model_config["name"],
+                    "model_version": model_config.get("version"),
+                    "home_run_odds": None,
+                    "did_hit_hr": did_hit_home_run_code(did_hit_home_run),
+                    "stats": get_item_stats(stats),
+                    "game_id": game_id,
+                }
+                if ledger is not None:
+                    row_hash = get_row_hash(model_version, np.array(stats.reindex(ledger_features), dtype=float), item)
+                    if ledger.is_unchanged(item, row_hash):
+                        continue
+                with profiler.stage("score"):
+                    item["home_run_odds"] = float(scorer.predict_proba(features))
+                shadow_odds = get_shadow_odds(model_config, lambda x: np.array(stats.reindex(x), dtype=float)[None, :])
+                if shadow_odds is not None:
+                    item["shadow_odds"] = shadow_odds[0]
+                if ledger is not None:
+                    ledger.add(item, row_hash)
+                yield item
+
+    def get_items_for_date_range_with_workers(self, model_scorers, start_date, end_date, n_workers=1, ledger=None):
+        """The items of get_items_for_date_range for each (model_config, scorer), in the same order.
+
+        Feature rows are assembled once for all models by feature_pool (in n_workers forked processes)
+        and each model scores them in one batch.
+        """
+        from feature_pool import extract_features
+        from player import get_layout, Hitter
+
+        r = self.runner
+        start_date, end_date = pd.Timestamp(start_date).strftime("%Y%m%d"), pd.Timestamp(end_date).strftime("%Y%m%d")
+        game_ids = [x for x in r.get_games() if start_date <= x[3:11] <= end_date]
+        columns = list(ITEM_STAT_NAMES)
+        for model_config, _ in model_scorers:
+            for features in [model_config["features"]] + [x["features"] for x, _ in model_config.get("shadows", [])]:
+                columns += [x for x in features if x not in columns]
+        metadata, values = extract_features(r, game_ids, columns, n_workers=n_workers)
+        self.log(f"Extracted {len(metadata)} feature rows from {len(game_ids)} games with {n_workers} workers")
+
+        enough_abs = values[:, columns.index("At Bats")] >= MIN_ABS_TO_PUSH
+        self.log(f"Not enough ABs for {int((~enough_abs).sum())} rows, skipping")
+        # Counters come back as floats from the feature matrix
+        count_names = get_layout(r.stat_names, Hitter.count_stats).count_names
+        item_columns = [columns.index(x) for x in ITEM_STAT_NAMES]
+        for model_config, scorer in model_scorers:
+            X = values[:, [columns.index(x) for x in model_config["features"]]]
+            complete = enough_abs & ~np.isnan(X).any(axis=1)
+            if (enough_abs & ~complete).any():
+                self.log(f"Missing features for {int((enough_abs & ~complete).sum())} rows, skipping", error=True)
+            if ledger is not None:
+                ledger.load(model_config["name"], pd.Timestamp(start_date).strftime("%Y-%m-%d"), pd.Timestamp(end_date).strftime("%Y-%m-%d"))
+                model_version = get_ledger_version(model_config, scorer)
+                ledger_columns = [columns.index(x) for x in get_ledger_features(model_config)]
+
+            rows, items, row_hashes = [], [], []
+            for row, row_values in zip(np.flatnonzero(complete).tolist(), values[np.ix_(complete, item_columns)].tolist()):
+                player_name, team_name, opposing_pitcher, date, game_id, did_hit_home_run = metadata[row]
+                stats = {x : int(v) if x in count_names else v for x, v in zip(ITEM_STAT_NAMES, row_values)}
+                item = {
+                    "player_name": player_name,
+                    "opposing_pitcher": opposing_pitcher,
+                    "team_name": team_name,
+                    "date": date,
+                    "model": model_config["name"],
+                    "model_version": model_config.get("version"),
+                    "home_run_odds": None,
+                    "did_hit_hr": did_hit_home_run_code(did_hit_home_run),
+                    "stats": get_item_stats(stats),
+                    "game_id": game_id,
+                }
+                if ledger is not None:
+                    row_hash = get_row_hash(model_version, values[row, ledger_columns], item)
+                    if ledger.is_unchanged(item, row_hash):
+                        continue
+                    row_hashes.append(row_hash)
+                rows.append(row)
+                items.append(item)
+
+            with profiler.stage("score"):
+                predicted_probs = scorer.predict_proba(X[rows]).tolist()
+            shadow_odds = get_shadow_odds(model_config, lambda x: values[np.ix_(rows, [columns.index(y) for y in x])])
+            for i, (item, predicted_prob) in enumerate(zip(items, predicted_probs)):
+                item["home_run_odds"] = predicted_prob
+                if shadow_odds is not None:
+                    item["shadow_odds"] = shadow_odds[i]
+                if ledger is not None:
+                    ledger.add(item, row_hashes[i])
+                yield item
+
+    def get_todays_slate(self):
+        """Returns (player_name, team_name, opposing_pitcher_name, venue_name) for batters in today's boxscores."""
+        schedule = get_schedule()
+        game_ids = [x["game_id"] for x in schedule]
+        venues = {x["game_id"]: x.get("venue_name") for x in schedule}
+        statuses = {x["game_id"]: x.get("status") for x in schedule}
+        self.log(f"Getting updates for {len(game_ids)} games")
+
+        slate = []
+        for game_id in tqdm.tqdm(game_ids):
+            boxscore_data = get_boxscore_data(game_id, status=statuses[game_id])
+            away_batter_ids = [x["personId"] for x in boxscore_data["awayBatters"] if x["personId"] != 0]
+            home_batter_ids = [x["personId"] for x in boxscore_data["homeBatters"] if x["personId"] != 0]
+
+            if len(boxscore_data["awayPitchers"]) < 2 or len(boxscore_data["homePitchers"]) < 2:
+                self.log(f"Pitcher data not found for game {game_id}, skipping", error=True)
+                continue
+            away_pitcher_name = get_player_name(boxscore_data["awayPitchers"][1]["personId"])
+            home_pitcher_name = get_player_name(boxscore_data["homePitchers"][1]["personId"])
+
+            for batter_ids, pitcher_name in [(away_batter_ids, home_pitcher_name), (home_batter_ids, away_pitcher_name)]:
+                for bid in batter_ids:
+                    player_name, player_team = get_player_name_and_team(bid)
+                    slate.append((player_name, player_team, pitcher_name, venues[game_id]))
+        self.log(f"Found {len(slate)} batters today")
+        return slate
+
+    def get_slate_stats(self, slate, tables=None):
+        """Latest stats for every slate row that has a hitter and pitcher in the player map, indexed by slate position.
+
+        tables is an attached map_server.SharedMapTables to look the slate up in instead of the runner.
+        """
+        player_ids, pitcher_ids, venues = [x[0] for x in slate], [x[2] for x in slate], [x[3] for x in slate]
+        if tables is not None:
+            from runner import get_latest_stats_for_slate
+            stats = get_latest_stats_for_slate(tables, tables, player_ids, pitcher_ids, venues)
+        else:
+            stats = self.runner.get_latest_stats_for_slate(player_ids, pitcher_ids, venues)
+        if len(stats) < len(slate):
+            self.log(f"{len(slate) - len(stats)} of {len(slate)} batters or their pitchers not found, skipping")
+        return stats
+
+    def get_items_for_slate(self, model_config, scorer, slate, slate_stats=None):
+        """Scores the whole slate in one pass; slate_stats from get_slate_stats can be shared between models."""
+        date = pd.Timestamp.now().strftime("%Y-%m-%d")
+        if slate_stats is None:
+            slate_stats = self.get_slate_stats(slate)
+        enough_abs = slate_stats["At Bats"] >= MIN_ABS_TO_PUSH
+        for i in slate_stats.index[~enough_abs]:
+            self.log(f"Not enough ABs ({slate_stats.at[i, 'At Bats']}) for {slate[i][0]}, skipping")
+        stats = slate_stats[enough_abs]
+
+        features = stats[model_config["features"]].to_numpy(dtype=float)
+        # Last season stats that statsapi did not return are NaN
+        complete = ~np.isnan(features).any(axis=1)
+        for i in stats.index[~complete]:
+            self.log(f"Missing features for {slate[i][0]}, skipping", error=True)
+        with profiler.stage("score"):
+            predicted_probs = scorer.predict_proba(features[complete]).tolist()
+        item_stats = stats.loc[complete, ITEM_STAT_NAMES].to_dict("records")
+        shadow_odds = get_shadow_odds(model_config, lambda x: stats.loc[complete, x].to_numpy(dtype=float))
+
+        for j, (i, predicted_prob, player_stats) in enumerate(zip(stats.index[complete], predicted_probs, item_stats)):
+            player_name, player_team, pitcher_name, venue = slate[i]
+            item = {
+                "player_name": player_name,
+                "opposing_pitcher": pitcher_name,
+                "team_name": player_team,
+                "date": date,
+                "model": model_config["name"],
+                "model_version": model_config.get("version"),
+                "home_run_odds": predicted_prob,
+                # Today's games have not been played yet
+                "did_hit_hr": did_hit_home_run_code(None),
+                "stats": get_item_stats(player_stats),
+                "game_id": -1,
+            }
+            if shadow_odds is not None:
+                item["shadow_odds"] = shadow_odds[j]
+            yield item
@@ -1,15 +1,18 @@
 import os
-import pandas as pd
+import datetime
 
 class BaseClass:
+    __slots__ = ()
+
     def log(self, text, error=False, log=True, verbose=True):
-        msg = f"[{pd.Timestamp.now()}] {text}"
+        now = datetime.datetime.now()
+        msg = f"[{now}] {text}"
         if error:
-            msg = f"[{pd.Timestamp.now()}] ERROR: {text}"
+            msg = f"[{now}] ERROR: {text}"
         if verbose:
             print(msg)
         if log:
-            logfile = os.path.join("logs", pd.Timestamp.now().strftime("%Y%m%d") + ".log")
+            logfile = os.path.join("logs", now.strftime("%Y%m%d") + ".log")
             with open(logfile, "a") as f:
                 f.write(msg + "\n")
 
@@ -0,0 +1,160 @@
+import io
+import sys
+import functools
+import json
+import time
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.hook = self.profiler._start_hook(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if self.hook is not None:
+            self.profiler._stop_hook(self.hook)
+        stage = self.profiler.stages.get(self.name)
+        if stage is None:
+            stage = self.profiler.stages[self.name] = {"calls": 0, "seconds": 0.0}
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        return False
+
+class Profiler:
+    """Process-wide stage timers and counters, off unless enabled with --profile.
+
+    with profiler.stage("runner.load_game"):
+        ...
+    profiler.count("http.requests")
+
+    Nested stages are timed independently, so a parent stage's time includes its children.
+    One stage can also be run under cProfile or pyinstrument with set_profile_hook.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        self.hook_stage = None
+        self.hook_kind = None
+        self.hook_profiler = None
+        self.hook_depth = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+
+    def set_profile_hook(self, stage_name, kind="cprofile"):
+        if kind not in ["cprofile", "pyinstrument"]:
+            raise ValueError(f"Unknown profiler {kind}")
+        self.hook_stage = stage_name
+        self.hook_kind = kind
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name):
+        """Decorator form of stage(); checks enabled at call time."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Stage(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _start_hook(self, name):
+        if name != self.hook_stage:
+            return None
+        self.hook_depth += 1
+        if self.hook_depth > 1:
+            # Recursive entry into the hooked stage is already being profiled
+            return "nested"
+        if self.hook_profiler is None:
+            if self.hook_kind == "pyinstrument":
+                from pyinstrument import Profiler as PyinstrumentProfiler
+                self.hook_profiler = PyinstrumentProfiler()
+            else:
+                import cProfile
+                self.hook_profiler = cProfile.Profile()
+        if self.hook_kind == "pyinstrument":
+            self.hook_profiler.start()
+        else:
+            self.hook_profiler.enable()
+        return name
+
+    def _stop_hook(self, hook):
+        self.hook_depth -= 1
+        if hook == "nested":
+            return
+        if self.hook_kind == "pyinstrument":
+            self.hook_profiler.stop()
+        else:
+            self.hook_profiler.disable()
+
+    def get_report(self):
+        return {
+            "stages": {name: {"calls": x["calls"], "seconds": round(x["seconds"], 6)} for name, x in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def format_table(self):
+        lines = []
+        lines.append(f"{'stage':<40} {'calls':>10} {'seconds':>12} {'ms/call':>10}")
+        for name, x in sorted(self.stages.items(), key=lambda x: -x[1]["seconds"]):
+            ms_per_call = 1000 * x["seconds"] / x["calls"] if x["calls"] > 0 else 0
+            lines.append(f"{name:<40} {x['calls']:>10} {x['seconds']:>12.3f} {ms_per_call:>10.3f}")
+        if len(self.counters) > 0:
+            lines.append("")
+            lines.append(f"{'counter':<40} {'value':>10}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<40} {value:>10}")
+        return "\n".join(lines)
+
+    def format_hook_report(self):
+        if self.hook_profiler is None:
+            return None
+        if self.hook_kind == "pyinstrument":
+            return self.hook_profiler.output_text()
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self.hook_profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        return out.getvalue()
+
+    def write_report(self, output_file=None):
+        """Prints the summary table, or dumps JSON if output_file is given."""
+        if output_file is not None:
+            with open(output_file, "w") as f:
+                json.dump(self.get_report(), f, indent=2)
+        else:
+            print(self.format_table(), file=sys.stderr)
+        hook_report = self.format_hook_report()
+        if hook_report is not None:
+            print(f"Profile of stage {self.hook_stage}:", file=sys.stderr)
+            print(hook_report, file=sys.stderr)
+
+profiler = Profiler()